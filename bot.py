@@ -1,6 +1,7 @@
-import os, asyncio, html, logging, time
+import os, asyncio, html, logging
 from dataclasses import asdict
-from typing import Dict
+from typing import Dict, List
+from urllib.parse import urlsplit
 
 from dotenv import load_dotenv
 
@@ -20,9 +21,10 @@ from bot_kb import (
     upgrade_parts_kb,
     driver_kb,
     lobby_main_kb,
+    warm_catalog_kbs,
+    warm_static_kbs,
 )
 from economy_v1 import (
-    load_player,
     list_catalog,
     buy_car,
     set_current_car,
@@ -30,12 +32,38 @@ from economy_v1 import (
     set_current_track,
     car_stats,
     redeem_bonus_code,
+    upgrade_status,
+    available_parts,
+    buy_upgrade,
 )
-from game_api import run_player_race, get_upgrade_status, list_available_upgrades, buy_car_upgrade, load_car_by_id
-from lobby import find_user_lobby, create_lobby, join_lobby, leave_lobby, LOBBIES
+from game_api import run_player_race_async, load_car_by_id
+from player_store import aload_player, get_player_store, install_player_store, player_saved
+from leaderboard import get_leaderboards
+from ledger import get_ledger
+from race_service import get_race_service
+from race_scheduler import get_race_scheduler
+from premium import is_premium
+from outbox import PRIORITY_EVENT, PRIORITY_RESULT, PRIORITY_TICK, get_outbox
+from live_view import LiveMessage, LiveStandings, live_mode
+from update_processor import PerUserUpdateProcessor, release_turn
+from single_flight import OperationInProgress, get_single_flight
+from event_throttle import EventThrottle, Pacer
+import metrics
+import startup
+from lobby import find_user_lobby, create_lobby, join_lobby, leave_lobby, get_lobby
 
 TIERS = ["starter", "club", "sport", "gt", "hyper"]
 
+# polling или webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # публичный адрес, который получит Telegram
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+# Другой Bot API сервер, например fake_bot_api для нагрузочных тестов
+BOT_API_URL = os.getenv("BOT_API_URL")
+
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
 logger = logging.getLogger("racing-bot")
 
@@ -61,8 +89,11 @@ def help_text() -> str:
         "<code>/track</code> — выбрать трассу\n"
         "<code>/settrack &lt;id&gt;</code> — задать трассу\n"
         "<code>/race</code> — начать гонку\n"
+        "<code>/queue</code> — загрузка трасс\n"
+        "<code>/top [track_id] [класс]</code> — таблица рекордов\n"
         "<code>/upgrades</code> — апгрейды машины\n"
-        "<code>/lobby_create</code> — создать лобби"
+        "<code>/lobby_create</code> — создать лобби\n"
+        "<code>/mm [track_id]</code> — найти соперников"
     )
 
 async def send_html(update: Update, text: str, reply_markup=None):
@@ -75,7 +106,7 @@ async def send_html(update: Update, text: str, reply_markup=None):
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = _uid(update); name = _uname(update)
-    load_player(uid, name)
+    await aload_player(uid, name)
     await update.effective_chat.send_message(
         help_text(), parse_mode=ParseMode.HTML, reply_markup=main_menu_kb()
     )
@@ -115,19 +146,25 @@ async def catalog(update: Update, context: ContextTypes.DEFAULT_TYPE, tier: str
     )
 
 async def buy_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    uid = _uid(update); name = _uname(update)
-    p = load_player(uid, name)
     if not context.args:
         await send_html(update, "Использование: <code>/buy &lt;car_id&gt;</code> (см. /catalog)")
         return
-    car_id = context.args[0]
-    msg = buy_car(p, car_id)
-    await send_html(update, esc(msg))
+    await _buy_car(update, context.args[0])
+
+async def _buy_car(update: Update, car_id: str):
+    async def go():
+        p = await aload_player(_uid(update), _uname(update))
+        msg = buy_car(p, car_id)
+        # подтверждаем покупку только после записи на диск
+        await player_saved(p.user_id)
+        await send_html(update, esc(msg))
+
+    await get_single_flight().run(_uid(update), f"buy:{car_id}", go)
 
 
 async def garage(update: Update, context: ContextTypes.DEFAULT_TYPE, tier: str | None = None, page: int = 1):
     uid = _uid(update); name = _uname(update)
-    p = load_player(uid, name)
+    p = await aload_player(uid, name)
     if not p.garage:
         await update.effective_chat.send_message(
             "Гараж пуст. Открой каталог и купи машину.",
@@ -168,7 +205,7 @@ async def garage(update: Update, context: ContextTypes.DEFAULT_TYPE, tier: str |
 
 async def setcar_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = _uid(update); name = _uname(update)
-    p = load_player(uid, name)
+    p = await aload_player(uid, name)
     if not context.args:
         await send_html(update, "Использование: <code>/setcar &lt;car_id&gt;</code>")
         return
@@ -176,13 +213,12 @@ async def setcar_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def driver(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = _uid(update); name = _uname(update)
-    p = load_player(uid, name)
+    p = await aload_player(uid, name)
     kb = driver_kb()
-    if not p.driver_json:
+    d = p.driver_profile()
+    if d is None:
         await send_html(update, "Профиль пилота появится после первой гонки (<code>/race</code>).", reply_markup=kb)
         return
-    from models_v2 import DriverProfile
-    d = DriverProfile.from_json(p.driver_json)
     skills = asdict(d)
     lines = ["<b>Навыки пилота:</b>"]
     for k in ["braking","consistency","stress","throttle","cornering","starts"]:
@@ -193,10 +229,10 @@ async def driver(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def lobby_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = _uid(update); name = _uname(update)
-    p = load_player(uid, name)
+    p = await aload_player(uid, name)
     lid = find_user_lobby(uid)
     if lid:
-        info = LOBBIES.get(lid, {})
+        info = get_lobby(lid) or {}
         players = info.get("players", [])
         lines = [f"<b>Лобби {esc(lid)}</b>"]
         for pl in players:
@@ -219,7 +255,7 @@ async def track_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def settrack_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = _uid(update); name = _uname(update)
-    p = load_player(uid, name)
+    p = await aload_player(uid, name)
     if not context.args:
         await send_html(update, "Использование: <code>/settrack &lt;track_id&gt;</code> (см. /track)")
         return
@@ -230,13 +266,14 @@ async def bonus_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not context.args:
         await send_html(update, "Использование: <code>/bonus &lt;код&gt;</code>")
         return
-    p = load_player(uid, name)
+    p = await aload_player(uid, name)
     msg = redeem_bonus_code(p, context.args[0])
+    await player_saved(uid)
     await send_html(update, esc(msg))
 
 async def upgrades_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = _uid(update); name = _uname(update)
-    p = load_player(uid, name)
+    p = await aload_player(uid, name)
     car_id = context.args[0] if context.args else p.current_car
     if not car_id:
         await send_html(update, "Укажи машину: <code>/upgrades &lt;car_id&gt;</code>")
@@ -245,8 +282,9 @@ async def upgrades_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def show_upgrades_menu(update, uid, name, car_id):
-    status = get_upgrade_status(uid, name, car_id)
-    parts = list_available_upgrades(uid, name, car_id)
+    p = await aload_player(uid, name)
+    status = upgrade_status(p, car_id)
+    parts = available_parts(p, car_id)
     if parts:
         desc = "\n".join(f"{p['name']} — {p['desc']}" for p in parts)
         status += "\nДоступно:\n" + desc
@@ -256,65 +294,150 @@ async def show_upgrades_menu(update, uid, name, car_id):
     await send_html(update, esc(status), reply_markup=kb)
 
 async def race(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # повторный /race или двойное нажатие не запускает вторую гонку
+    try:
+        await get_single_flight().run(_uid(update), "race", lambda: _race_flow(update, context), exclusive=True)
+    except OperationInProgress as e:
+        await send_html(update, f"⏳ {esc(e)}")
+
+# лента событий гонки: тики не чаще раза в EVENT_TICK_INTERVAL_S, последний побеждает
+_FEED = EventThrottle()
+
+
+def _feed_message(evt: Dict) -> tuple[str | None, int, str | None]:
+    """Feed text, priority and coalesce key of one race event."""
+    etype = evt.get("type")
+    if etype == "penalty":
+        sev = esc(evt.get("severity", "minor"))
+        msg = (
+            f"🚫 <b>Пенальти ({sev})</b>\n"
+            f"⏱ <i>+{evt['delta_s']:.2f}s</i> на {esc(evt['segment'])}\n"
+            f"📉 Нагрузка: {evt['load']:.2f}"
+        )
+        return msg, PRIORITY_EVENT, None
+    if etype == "segment_tick":
+        msg = (
+            f"🏎️ <b>Круг {evt['lap']}/{evt['laps']}</b>\n"
+            f"📍 <b>{esc(evt['segment'])}</b> <i>(ID {evt['segment_id']})</i>\n"
+            f"⚡️ <code>{evt['speed']:.1f} км/ч</code>\n"
+            f"⏰ <code>{evt['time_s']:.1f} сек</code>\n"
+            f"📊 <code>{evt['distance']:.0f}/{evt['segment_length']:.0f} м</code>"
+        )
+        # устаревший тик, который ещё не ушёл, заменяется свежим
+        return msg, PRIORITY_TICK, "tick"
+    if etype == "segment_change":
+        msg = (
+            f"🔁 <b>Новый участок: {esc(evt['segment'])}</b>\n"
+            f"⚡️ <code>{evt['speed']:.1f} км/ч</code>\n"
+            f"⏰ <code>{evt['time_s']:.1f} сек</code>"
+        )
+        return msg, PRIORITY_EVENT, None
+    if etype == "lap_complete":
+        return f"🏁 <b>Круг {evt['lap']} завершён</b> — <code>{evt['time_s']:.2f}s</code>", PRIORITY_EVENT, None
+    if etype == "race_complete":
+        msg = (
+            f"🏁 <b>Гонка завершена!</b>\n"
+            f"⏱ <code>{evt['time_s']:.2f}s</code>\n"
+            f"⚠️ Инцидентов: <code>{evt.get('incidents',0)}</code>"
+        )
+        return msg, PRIORITY_RESULT, None
+    if etype == "skill_up":
+        return f"📈 <b>{esc(evt['skill'])}</b> +{evt['delta']:.2f} → {evt['new']:.1f}", PRIORITY_EVENT, None
+    return None, PRIORITY_EVENT, None
+
+async def _race_flow(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = _uid(update); name = _uname(update)
     lid = find_user_lobby(uid)
     if lid:
         await send_html(update, f"Ты в лобби {esc(lid)}. Выйди: /lobby_leave {esc(lid)}")
         return
-    loop = asyncio.get_running_loop()
+    outbox = get_outbox(context.bot)
+    chat_id = update.effective_chat.id
+
+    def post(msg: str, priority: int = PRIORITY_EVENT, coalesce: str | None = None):
+        return outbox.send(chat_id, msg, priority=priority, coalesce=coalesce, parse_mode=ParseMode.HTML)
+
+    live = live_mode()
+    standings = LiveStandings([{"user_id": uid, "name": name}])
+    view = LiveMessage(outbox, chat_id, lambda: standings.board("🏎 Гонка"))
 
-    def on_evt(evt: Dict):
+    def show(evt: Dict) -> None:
         etype = evt.get("type")
-        msg = None
-        if etype == "penalty":
-            sev = esc(evt.get("severity", "minor"))
-            msg = (
-                f"🚫 <b>Пенальти ({sev})</b>\n"
-                f"⏱ <i>+{evt['delta_s']:.2f}s</i> на {esc(evt['segment'])}\n"
-                f"📉 Нагрузка: {evt['load']:.2f}"
-            )
-        elif etype == "segment_tick":
-            msg = (
-                f"🏎️ <b>Круг {evt['lap']}/{evt['laps']}</b>\n"
-                f"📍 <b>{esc(evt['segment'])}</b> <i>(ID {evt['segment_id']})</i>\n"
-                f"⚡️ <code>{evt['speed']:.1f} км/ч</code>\n"
-                f"⏰ <code>{evt['time_s']:.1f} сек</code>\n"
-                f"📊 <code>{evt['distance']:.0f}/{evt['segment_length']:.0f} м</code>"
-            )
-            asyncio.run_coroutine_threadsafe(send_html(update, msg), loop)
-            time.sleep(20.0)
+        if live and etype != "skill_up":
+            # одно сообщение со статусом вместо сообщения на каждое событие
+            standings.update(dict(evt, user_id=uid))
+            view.touch()
             return
-        elif etype == "segment_change":
-            msg = (
-                f"🔁 <b>Новый участок: {esc(evt['segment'])}</b>\n"
-                f"⚡️ <code>{evt['speed']:.1f} км/ч</code>\n"
-                f"⏰ <code>{evt['time_s']:.1f} сек</code>"
-            )
-        elif etype == "lap_complete":
-            msg = f"🏁 <b>Круг {evt['lap']} завершён</b> — <code>{evt['time_s']:.2f}s</code>"
-        elif etype == "race_complete":
-            msg = (
-                f"🏁 <b>Гонка завершена!</b>\n"
-                f"⏱ <code>{evt['time_s']:.2f}s</code>\n"
-                f"⚠️ Инцидентов: <code>{evt.get('incidents',0)}</code>"
-            )
-        elif etype == "skill_up":
-            msg = f"📈 <b>{esc(evt['skill'])}</b> +{evt['delta']:.2f} → {evt['new']:.1f}"
-        if msg:
-            asyncio.run_coroutine_threadsafe(send_html(update, msg), loop)
+        for e in _FEED.push(uid, evt):
+            msg, priority, coalesce = _feed_message(e)
+            if msg:
+                post(msg, priority, coalesce)
 
+    def on_position(pos: int) -> None:
+        post(f"⏳ Все трассы заняты. Ты в очереди: <b>{pos}</b>", coalesce="queue")
+
+    events: List[Dict] = []
     try:
-        result = await loop.run_in_executor(None, lambda: run_player_race(uid, name, laps=1, on_event=on_evt))
+        async with get_race_scheduler().slot([uid], premium=is_premium(uid), on_position=on_position):
+            result = await run_player_race_async(uid, name, laps=1, on_event=events.append)
+        # слот нужен только на симуляцию; показ в темпе гонки идёт уже без него
+        # и не задерживает следующие обновления пользователя
+        release_turn()
+        pacer = Pacer()
+        for evt in events:
+            await pacer.wait(evt)
+            show(evt)
     except Exception as e:
         logger.exception("Race error")
         await send_html(update, f"❌ {esc(e)}")
         return
+    finally:
+        _FEED.end(uid)
+        await view.close()
+
+    best = "\n🥇 Личный рекорд!" if result.get("personal_best") else ""
+    await post(
+        f"🏆 <b>Итог:</b> ⏱ {result['time_s']:.2f}s | ⚠️ {result['incidents']} | 💰 {fmt_money(result['reward'])}{best}",
+        PRIORITY_RESULT,
+    )
 
+async def queue_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    m = get_race_scheduler().metrics()
     await send_html(
         update,
-        f"🏆 <b>Итог:</b> ⏱ {result['time_s']:.2f}s | ⚠️ {result['incidents']} | 💰 {fmt_money(result['reward'])}"
+        f"🏎 Гонок идёт: <b>{m.active}</b> из {get_race_scheduler().limit}\n"
+        f"⏳ В очереди: <b>{m.queued}</b>\n"
+        f"⌛ Ожидание: среднее {m.wait_avg_s:.1f}s, p95 {m.wait_p95_s:.1f}s, макс {m.wait_max_s:.1f}s",
     )
 
+async def top_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    uid = _uid(update); name = _uname(update)
+    p = await aload_player(uid, name)
+    args = context.args or []
+    track_id = args[0] if args else p.current_track
+    if not track_id:
+        await send_html(update, "Использование: <code>/top &lt;track_id&gt; [класс]</code>")
+        return
+    if len(args) > 1:
+        tier = args[1]
+    else:
+        item = list_catalog()["cars"].get(p.current_car or "", {})
+        tier = item.get("tier", TIERS[0])
+    board = get_leaderboards().ranking(track_id, tier, uid)
+    tracks = list_tracks()
+    lines = [f"<b>Рекорды: {esc(tracks.get(track_id, track_id))} ({esc(tier.capitalize())})</b>"]
+    if not board["top"]:
+        lines.append("Пока никто не проехал эту трассу в этом классе.")
+    for e in board["top"]:
+        lines.append(f"{e['pos']}. {esc(e['name'])} — <code>{e['time_s']:.2f}s</code>")
+    me = board["me"]
+    if me and me["pos"] > len(board["top"]):
+        lines.append(f"…\n{me['pos']}. {esc(me['name'])} — <code>{me['time_s']:.2f}s</code> (ты)")
+    elif not me:
+        lines.append("Твоего результата здесь пока нет.")
+    lines.append(f"Участников: {board['total']}")
+    await send_html(update, "\n".join(lines))
+
 async def on_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     if not query or not query.data:
@@ -335,12 +458,11 @@ async def on_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         _, tier, page = data.split(":", 2)
         await catalog(update, context, tier=tier, page=int(page))
     elif data.startswith("buy:"):
-        p = load_player(uid, name)
-        await send_html(update, esc(buy_car(p, data.split(":",1)[1])))
+        await _buy_car(update, data.split(":",1)[1])
     elif data == "nav:tracks":
         await track_cmd(update, context)
     elif data.startswith("settrack:"):
-        p = load_player(uid, name)
+        p = await aload_player(uid, name)
         await send_html(update, esc(set_current_track(p, data.split(":",1)[1])))
     elif data == "nav:garage":
         await garage(update, context)
@@ -359,7 +481,7 @@ async def on_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif data == "nav:lobby":
         await lobby_menu(update, context)
     elif data == "lobby_create":
-        p = load_player(uid, name)
+        p = await aload_player(uid, name)
         if not p.current_track or not p.current_car:
             await send_html(update, "Сначала выбери машину и трассу")
         else:
@@ -388,9 +510,15 @@ async def on_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await show_upgrades_menu(update, uid, name, car_id)
     elif data.startswith("buyupg:"):
         _, car_id, part_id = data.split(":", 2)
-        msg = buy_car_upgrade(uid, name, car_id, part_id)
-        await send_html(update, esc(msg))
-        await show_upgrades_menu(update, uid, name, car_id)
+
+        async def go():
+            p = await aload_player(uid, name)
+            msg = buy_upgrade(p, car_id, part_id)
+            await player_saved(uid)
+            await send_html(update, esc(msg))
+            await show_upgrades_menu(update, uid, name, car_id)
+
+        await get_single_flight().run(uid, data, go)
 
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
     logger.exception("Unhandled error", exc_info=context.error)
@@ -400,16 +528,57 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> N
     except Exception:
         pass
 
+# Что прогреваем в фоне после старта; первый запрос без прогрева строит кэш сам
+_WARMERS = (
+    ("catalog", warm_catalog_kbs),
+    ("keyboards", warm_static_kbs),
+    ("race_pool", lambda: get_race_service().start()),
+    ("leaderboards", get_leaderboards),
+    # журнал переигрывается здесь, а не в первом обработчике на цикле событий
+    ("ledger", get_ledger),
+)
+_prewarm_task = None
+
+async def _post_init(app: Application) -> None:
+    global _prewarm_task
+    metrics.start()
+    import bot_lobby
+    bot_lobby.start_lobby_reaper(app.bot)
+    startup.TIMER.mark("init")
+    logger.info(startup.TIMER.report())
+    # Не держим опрос обновлений, пока поднимаются процессы симуляции
+    _prewarm_task = asyncio.ensure_future(startup.prewarm(_WARMERS))
+
+async def _post_shutdown(app: Application) -> None:
+    if _prewarm_task is not None:
+        # иначе пул гонок может подняться уже после остановки
+        await _prewarm_task
+    await get_race_service().shutdown()
+    await get_player_store().aflush()
+
 def build_app() -> Application:
     token = os.getenv("BOT_TOKEN")
     if not token:
         raise RuntimeError("Не задан BOT_TOKEN. Создай .env или экспортируй переменную окружения.")
 
+    # Игроки читаются из памяти, а пишутся на диск в отдельном потоке
+    install_player_store()
+
     # Disable certificate verification and ignore proxy settings from the
     # environment. Some environments (e.g. CI) inject a proxy with a custom
     # certificate which can break TLS handshakes when verifying.
     request = HTTPXRequest(httpx_kwargs={"verify": False, "trust_env": False})
-    app = Application.builder().token(token).request(request).build()
+    builder = (
+        Application.builder()
+        .token(token)
+        .request(request)
+        .concurrent_updates(PerUserUpdateProcessor())
+        .post_init(_post_init)
+        .post_shutdown(_post_shutdown)
+    )
+    if BOT_API_URL:
+        builder = builder.base_url(BOT_API_URL)
+    app = builder.build()
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("catalog", catalog))
     app.add_handler(CommandHandler("buy", buy_cmd))
@@ -423,16 +592,52 @@ def build_app() -> Application:
     app.add_handler(CommandHandler("upgrades", upgrades_cmd))
     app.add_handler(CommandHandler("help", help_cmd))
     app.add_handler(CommandHandler("race", race))
+    app.add_handler(CommandHandler("top", top_cmd))
+    app.add_handler(CommandHandler("queue", queue_cmd))
     app.add_handler(CallbackQueryHandler(on_callback))
     import bot_lobby
     bot_lobby.setup(app)
     app.add_error_handler(error_handler)
     return app
 
+def _webhook_url() -> str:
+    """Address to register with ``setWebhook``.
+
+    Telegram needs a public URL, so ``WEBHOOK_URL`` is required unless the
+    bot talks to a local fake Bot API that can reach the listener directly.
+    """
+    if WEBHOOK_URL:
+        return WEBHOOK_URL
+    api_host = urlsplit(BOT_API_URL).hostname if BOT_API_URL else None
+    if api_host not in ("127.0.0.1", "localhost", "::1"):
+        raise RuntimeError(
+            "Не задан WEBHOOK_URL: Telegram нужен публичный адрес вебхука "
+            "(локальный адрес допустим только с локальным BOT_API_URL)"
+        )
+    host = "127.0.0.1" if WEBHOOK_LISTEN in ("0.0.0.0", "::") else WEBHOOK_LISTEN
+    return f"http://{host}:{WEBHOOK_PORT}/{WEBHOOK_PATH}"
+
 def main():
+    startup.TIMER.mark("import")
+    # без адреса вебхука падаем до сборки бота, а не после регистрации чужого адреса
+    webhook_url = _webhook_url() if BOT_MODE == "webhook" else None
     app = build_app()
+    startup.TIMER.mark("build_app")
     print("Bot is ready. Use: python run.py (or python -m scripts.run_bot)")
-    app.run_polling(allowed_updates=Update.ALL_TYPES)
+    if BOT_MODE == "webhook":
+        # нужен python-telegram-bot[webhooks]; TLS снимает прокси перед ботом
+        app.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=webhook_url,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES,
+        )
+    elif BOT_MODE == "polling":
+        app.run_polling(allowed_updates=Update.ALL_TYPES)
+    else:
+        raise RuntimeError(f"Неизвестный BOT_MODE: {BOT_MODE} (нужен polling или webhook)")
 
 if __name__ == "__main__":
     main()
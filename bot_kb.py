@@ -1,4 +1,4 @@
-from typing import Dict, List
+from typing import Dict, List, Optional, Sequence, Tuple
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 
 from economy_v1 import list_catalog, list_tracks
@@ -11,32 +11,77 @@ def fmt_money(v: int) -> str:
     return f"{v:,}".replace(",", " ")
 
 
+# Кнопки и разметка Telegram неизменяемы, поэтому их можно переиспользовать
+# между вызовами и пользователями.
+_NAV_ROWS: Tuple[Tuple[InlineKeyboardButton, ...], ...] = (
+    (
+        InlineKeyboardButton("Справка", callback_data="nav:help"),
+        InlineKeyboardButton("Гараж", callback_data="nav:garage"),
+    ),
+    (
+        InlineKeyboardButton("Каталог", callback_data="nav:catalog"),
+        InlineKeyboardButton("Трассы", callback_data="nav:tracks"),
+    ),
+    (
+        InlineKeyboardButton("Водитель", callback_data="nav:driver"),
+        InlineKeyboardButton("Лобби", callback_data="nav:lobby"),
+    ),
+)
+
+
 def _nav_menu_rows() -> List[List[InlineKeyboardButton]]:
     """Standard navigation buttons shown on every screen."""
-    return [
-        [
-            InlineKeyboardButton("Справка", callback_data="nav:help"),
-            InlineKeyboardButton("Гараж", callback_data="nav:garage"),
-        ],
-        [
-            InlineKeyboardButton("Каталог", callback_data="nav:catalog"),
-            InlineKeyboardButton("Трассы", callback_data="nav:tracks"),
-        ],
-        [
-            InlineKeyboardButton("Водитель", callback_data="nav:driver"),
-            InlineKeyboardButton("Лобби", callback_data="nav:lobby"),
-        ],
-    ]
+    return [list(row) for row in _NAV_ROWS]
 
 
-def _with_nav(rows: List[List[InlineKeyboardButton]]) -> InlineKeyboardMarkup:
+def _with_nav(rows: Sequence[Sequence[InlineKeyboardButton]]) -> InlineKeyboardMarkup:
     """Append navigation rows to keyboard rows and return markup."""
-    return InlineKeyboardMarkup(_nav_menu_rows() + rows)
+    return InlineKeyboardMarkup(_NAV_ROWS + tuple(tuple(r) for r in rows))
+
+
+class _KeyboardCache:
+    """Markups derived from one source dict (catalog or track list).
+
+    ``list_catalog``/``list_tracks`` return the same object until their files
+    change, so a different object means the cached markups are stale.
+    """
+
+    def __init__(self) -> None:
+        self.source: Optional[Dict] = None
+        self.markups: Dict[Tuple, InlineKeyboardMarkup] = {}
+
+    def get(self, source: Dict, key: Tuple, build) -> InlineKeyboardMarkup:
+        if source is not self.source:
+            self.source = source
+            self.markups = {}
+        kb = self.markups.get(key)
+        if kb is None:
+            kb = self.markups[key] = build()
+        return kb
+
+
+_CATALOG_KBS = _KeyboardCache()
+_TRACK_KBS = _KeyboardCache()
+_STATIC_KBS: Dict[str, InlineKeyboardMarkup] = {}
+
+
+def _static(name: str, build) -> InlineKeyboardMarkup:
+    kb = _STATIC_KBS.get(name)
+    if kb is None:
+        kb = _STATIC_KBS[name] = build()
+    return kb
+
+
+def _tier_row(prefix: str) -> Tuple[InlineKeyboardButton, ...]:
+    return tuple(InlineKeyboardButton(t.capitalize(), callback_data=f"{prefix}:{t}") for t in TIERS)
+
+
+_GARAGE_TIER_ROW = _tier_row("gar_tier")
 
 
 def main_menu_kb() -> InlineKeyboardMarkup:
     """Main menu with quick navigation links."""
-    return InlineKeyboardMarkup(_nav_menu_rows())
+    return _static("main", lambda: InlineKeyboardMarkup(_NAV_ROWS))
 
 
 def garage_kb(p, tier: str | None = None, page: int = 1) -> InlineKeyboardMarkup:
@@ -45,12 +90,9 @@ def garage_kb(p, tier: str | None = None, page: int = 1) -> InlineKeyboardMarkup
     tiers = TIERS
     tier = tier or tiers[0]
 
-    rows: List[List[InlineKeyboardButton]] = []
+    rows: List[Sequence[InlineKeyboardButton]] = []
     # class selection buttons
-    rows.append([
-        InlineKeyboardButton(t.capitalize(), callback_data=f"gar_tier:{t}")
-        for t in tiers
-    ])
+    rows.append(_GARAGE_TIER_ROW)
 
     cars = [cid for cid in p.garage if cat["cars"].get(cid, {}).get("tier") == tier]
     per_page = 10
@@ -71,16 +113,18 @@ def garage_kb(p, tier: str | None = None, page: int = 1) -> InlineKeyboardMarkup
 
 
 def catalog_kb(cat: Dict, tier: str | None = None, page: int = 1) -> InlineKeyboardMarkup:
-    """Keyboard with catalog cars and buy buttons, grouped by class with pagination."""
-    tiers = TIERS
-    tier = tier or tiers[0]
+    """Keyboard with catalog cars and buy buttons, grouped by class with pagination.
 
-    rows: List[List[InlineKeyboardButton]] = []
+    Markups are cached per ``(tier, page)`` until the catalog changes.
+    """
+    tier = tier or TIERS[0]
+    return _CATALOG_KBS.get(cat, (tier, page), lambda: _build_catalog_kb(cat, tier, page))
+
+
+def _build_catalog_kb(cat: Dict, tier: str, page: int) -> InlineKeyboardMarkup:
+    rows: List[Sequence[InlineKeyboardButton]] = []
     # class selection buttons
-    rows.append([
-        InlineKeyboardButton(t.capitalize(), callback_data=f"cat_tier:{t}")
-        for t in tiers
-    ])
+    rows.append(_tier_row("cat_tier"))
 
     cars = [
         (cid, item)
@@ -107,9 +151,14 @@ def catalog_kb(cat: Dict, tier: str | None = None, page: int = 1) -> InlineKeybo
 
 
 def tracks_kb() -> InlineKeyboardMarkup:
-    """Keyboard listing available tracks."""
+    """Keyboard listing available tracks; cached until the track files change."""
+    tracks = list_tracks()
+    return _TRACK_KBS.get(tracks, (), lambda: _build_tracks_kb(tracks))
+
+
+def _build_tracks_kb(tracks: Dict[str, str]) -> InlineKeyboardMarkup:
     rows = []
-    for tid, name in list(list_tracks().items())[:12]:
+    for tid, name in list(tracks.items())[:12]:
         rows.append([InlineKeyboardButton(f"{name}", callback_data=f"settrack:{tid}")])
     rows.append([InlineKeyboardButton("Обновить", callback_data="nav:tracks")])
     return _with_nav(rows)
@@ -126,17 +175,39 @@ def upgrade_parts_kb(car_id: str, parts: list) -> InlineKeyboardMarkup:
 
 def driver_kb() -> InlineKeyboardMarkup:
     """Keyboard for driver profile actions."""
-    rows = [[InlineKeyboardButton("Ввести бонускод", callback_data="nav:bonus")]]
-    return _with_nav(rows)
+    return _static(
+        "driver", lambda: _with_nav([[InlineKeyboardButton("Ввести бонускод", callback_data="nav:bonus")]])
+    )
 
 
 def lobby_main_kb(lobby_id: str | None = None, is_host: bool = False) -> InlineKeyboardMarkup:
     """Keyboard for lobby view and actions."""
+    if not lobby_id:
+        return _static(
+            "lobby",
+            lambda: _with_nav([
+                [InlineKeyboardButton("Создать лобби", callback_data="lobby_create")],
+                [InlineKeyboardButton("Обновить", callback_data="nav:lobby")],
+            ]),
+        )
     rows: List[List[InlineKeyboardButton]] = []
-    if lobby_id:
-        rows.append([InlineKeyboardButton("Выйти", callback_data=f"lobby_leave:{lobby_id}")])
-        rows.append([InlineKeyboardButton("Обновить", callback_data="nav:lobby")])
-    else:
-        rows.append([InlineKeyboardButton("Создать лобби", callback_data="lobby_create")])
-        rows.append([InlineKeyboardButton("Обновить", callback_data="nav:lobby")])
+    rows.append([InlineKeyboardButton("Выйти", callback_data=f"lobby_leave:{lobby_id}")])
+    rows.append([InlineKeyboardButton("Обновить", callback_data="nav:lobby")])
     return _with_nav(rows)
+
+
+def warm_catalog_kbs() -> int:
+    """Parse the catalog and build the first page of every tier."""
+    cat = list_catalog()
+    for tier in TIERS:
+        catalog_kb(cat, tier)
+    return len(cat["cars"])
+
+
+def warm_static_kbs() -> int:
+    """Build the track list and the keyboards that never change."""
+    tracks_kb()
+    main_menu_kb()
+    driver_kb()
+    lobby_main_kb()
+    return len(_STATIC_KBS)
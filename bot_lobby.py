@@ -1,29 +1,56 @@
 from telegram import Update
 from telegram.constants import ParseMode
 from telegram.ext import Application, CommandHandler, ContextTypes
-from typing import Dict, List, Callable
-import asyncio
-import time
+from typing import Dict, Iterable, List, Optional
 from collections import defaultdict
+import asyncio
+import heapq
+import logging
+import os
 
-from economy_v1 import load_player
+from economy_v1 import list_catalog, car_stats
+from player_store import aload_player
 from game_api import load_car_by_id
 from lobby import (
     create_lobby,
     join_lobby,
     leave_lobby,
-    start_lobby_race,
-    LOBBIES,
+    run_lobby_race,
+    finish_lobby_race,
+    LOBBY_POST_RACE_S,
+    get_lobby,
     find_user_lobby,
 )
+from lobby_expiry import LobbyReaper
+from matchmaking import MATCH_QUEUE, Match, Ticket, form_lobby, performance_index
 from bot_kb import lobby_main_kb
+from premium import premium_many
+from race_scheduler import RaceAlreadyActive, RaceQueueFull, get_race_scheduler
+from single_flight import OperationInProgress, get_single_flight
+from event_throttle import EventThrottle, Pacer, playback_duration as event_playback_duration
+from outbox import PRIORITY_EVENT, PRIORITY_RESULT, get_outbox
+from live_view import LiveMessage, LiveStandings, live_mode
+from update_processor import release_turn
 from bot import _uid, _uname, send_html, esc
 
+logger = logging.getLogger("racing-bot")
+
+# Ускорение воспроизведения лобби и максимальная пауза между событиями
+LOBBY_PLAYBACK_SPEED = float(os.getenv("LOBBY_PLAYBACK_SPEED", "1.0"))
+LOBBY_PLAYBACK_MAX_GAP = float(os.getenv("LOBBY_PLAYBACK_MAX_GAP", "5.0"))
+MM_TICK_S = float(os.getenv("MM_TICK_S", "1.0"))
+
+# лента событий лобби; ключ — гонщик, чьё событие
+_FEED = EventThrottle()
+
+_mm_task: Optional[asyncio.Task] = None
+_reaper: Optional[LobbyReaper] = None
+
 
 async def broadcast_lobby_state(lobby_id: str, bot) -> None:
     if not bot:
         return
-    lobby_info = LOBBIES.get(lobby_id)
+    lobby_info = get_lobby(lobby_id)
     if not lobby_info:
         return
     lines = [f"<b>Лобби {esc(lobby_id)}</b>"]
@@ -32,19 +59,102 @@ async def broadcast_lobby_state(lobby_id: str, bot) -> None:
         car = p.get("car", "?")
         lines.append(f"- {esc(p['name'])} — {esc(car)}")
     msg = "\n".join(lines)
-    for p in players:
-        is_host = players[0]["user_id"] == p["user_id"] if players else False
-        await bot.send_message(
-            int(p["chat_id"]),
-            msg,
-            parse_mode=ParseMode.HTML,
-            reply_markup=lobby_main_kb(lobby_id, is_host),
+    outbox = get_outbox(bot)
+    chats = [_player_chat(p) for p in players]
+    if not chats:
+        return
+    # общий чат нескольких игроков получает одно сообщение, с кнопками хоста, если он там
+    host_chat = chats[0]
+    outbox.broadcast([host_chat], msg, parse_mode=ParseMode.HTML, reply_markup=lobby_main_kb(lobby_id, True))
+    outbox.broadcast(
+        [c for c in chats if c != host_chat],
+        msg,
+        parse_mode=ParseMode.HTML,
+        reply_markup=lobby_main_kb(lobby_id, False),
+    )
+
+def _to_chat_id(x):
+    try:
+        return int(x)
+    except (TypeError, ValueError):
+        return x
+
+
+def _player_chat(p: Dict):
+    return _to_chat_id(p.get("chat_id") or p["user_id"])
+
+
+def _lobby_event_text(evt: Dict) -> Optional[str]:
+    etype = evt.get("type")
+    if etype == "segment_change":
+        return (
+            f"➡️ {esc(evt['name'])}: Новый участок {esc(evt['segment'])} "
+            f"🚀{evt['speed']:.1f} км/ч ⏱{evt['time_s']:.1f} сек"
         )
+    if etype == "penalty":
+        return (
+            f"🚫 {esc(evt['name'])} penalty {esc(evt.get('severity','minor'))}"
+            f"+{evt['delta_s']:.2f}s on {esc(evt['segment'])}"
+        )
+    if etype == "lap_complete":
+        return f"🏁 {esc(evt['name'])} завершил круг {evt['lap']} за {evt['time_s']:.2f}s"
+    if etype == "race_complete":
+        return f"🏁 {esc(evt['name'])} финишировал за {evt['time_s']:.2f}s"
+    return None
+
+
+def playback_duration(events: List[Dict], speed: float = 1.0) -> float:
+    """Seconds :func:`play_lobby_events` will take for ``events``."""
+    return event_playback_duration(events, speed, LOBBY_PLAYBACK_MAX_GAP)
+
+
+async def play_lobby_events(bot, events: Iterable[Dict], players: List[Dict], speed: float = 1.0) -> None:
+    """Replay merged lobby events on one asyncio clock.
+
+    ``events`` must be ordered by ``time_s``; a :class:`Pacer` spaces them
+    out, capping gaps at ``LOBBY_PLAYBACK_MAX_GAP`` seconds.  In live mode
+    every participant gets one standings message that is edited as the
+    replay advances instead of a message per event; in feed mode each
+    driver's events pass the shared throttle first.
+    """
+    outbox = get_outbox(bot)
+    standings = LiveStandings(players)
+    live = live_mode()
+    views: Dict[str, LiveMessage] = {}
+    pacer = Pacer(speed, LOBBY_PLAYBACK_MAX_GAP)
+    try:
+        for evt in events:
+            await pacer.wait(evt)
+            standings.update(evt)
+            if live:
+                for p in players:
+                    view = views.get(p["user_id"])
+                    if view is None:
+                        view = views[p["user_id"]] = LiveMessage(
+                            outbox, _to_chat_id(p["user_id"]), lambda: standings.board("🏎 Гонка лобби")
+                        )
+                    view.touch()
+                continue
+            for e in _FEED.push(evt["user_id"], evt):
+                msg = _lobby_event_text(e)
+                if not msg:
+                    continue
+                if e.get("type") in ("lap_complete", "race_complete"):
+                    msg += "\n" + standings.text()
+                priority = PRIORITY_RESULT if e.get("type") == "race_complete" else PRIORITY_EVENT
+                # очередь отправки сама соблюдает лимиты, воспроизведение её не ждёт
+                outbox.send(_to_chat_id(e["user_id"]), msg, priority=priority, parse_mode=ParseMode.HTML)
+    finally:
+        for p in players:
+            _FEED.end(p["user_id"])
+        for view in views.values():
+            await view.close()
+
 
 async def lobby_create_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = _uid(update)
     name = _uname(update)
-    p = load_player(uid, name)
+    p = await aload_player(uid, name)
     track_id = context.args[0] if context.args else p.current_track
     if not track_id:
         await send_html(update, "Укажи трассу: <code>/lobby_create &lt;track_id&gt;</code>")
@@ -63,7 +173,7 @@ async def lobby_join_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await send_html(update, "Использование: <code>/lobby_join &lt;id&gt;</code>")
         return
     try:
-        p = load_player(uid, name)
+        p = await aload_player(uid, name)
         if not p.current_car:
             await send_html(update, "Сначала выбери машину: /garage")
             return
@@ -79,6 +189,8 @@ async def lobby_join_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
             car=car.name,
         )
         lid = context.args[0]
+        # вошёл в лобби сам — подбор ему больше не нужен
+        MATCH_QUEUE.dequeue(uid)
         await send_html(update, f"Присоединился к лобби {esc(lid)}")
         await broadcast_lobby_state(lid, getattr(context, "bot", None))
     except Exception as e:
@@ -102,73 +214,74 @@ async def lobby_start_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await send_html(update, "Использование: <code>/lobby_start &lt;id&gt;</code>")
         return
     lid = context.args[0]
-    lobby_info = LOBBIES.get(lid, {})
+    lobby_info = get_lobby(lid) or {}
     player_stats = lobby_info.get("players", [])
     if uid not in [p["user_id"] for p in player_stats]:
         await send_html(update, "Сначала присоединись к лобби")
         return
+    # старт, нажатый несколькими участниками или дважды, запускает одну гонку
+    try:
+        await get_single_flight().run(
+            f"lobby:{lid}", "start", lambda: _run_lobby(update, context, lid, player_stats), exclusive=True
+        )
+    except OperationInProgress:
+        await send_html(update, "⏳ Гонка в этом лобби уже идёт")
+
 
+async def _run_lobby(update: Update, context: ContextTypes.DEFAULT_TYPE, lid: str, player_stats: List[Dict]) -> None:
+    uid = _uid(update)
     groups: Dict[str, List[Dict]] = {}
     for p in player_stats:
         groups.setdefault(p.get("chat_id", p["user_id"]), []).append(p)
 
-    def _to_chat_id(x):
-        try:
-            return int(x)
-        except (TypeError, ValueError):
-            return x
-
     def tag(p: Dict) -> str:
         return f'<a href="tg://user?id={p["user_id"]}">{esc(p["name"])}</a>'
 
     tags_all = " ".join(tag(p) for p in player_stats)
-    for p in player_stats:
-        await context.bot.send_message(
-            _to_chat_id(p["user_id"]),
-            f"🏁 Гонка началась: {tags_all}",
-            parse_mode=ParseMode.HTML,
-        )
+    outbox = get_outbox(context.bot)
 
-    loop = asyncio.get_running_loop()
-    prev: Dict[str, float] = defaultdict(float)
-
-    def on_evt(evt: Dict) -> None:
-        uid = evt.get("user_id")
-        etype = evt.get("type")
-        msg = None
-        if etype == "segment_change":
-            msg = (
-                f"➡️ {esc(evt['name'])}: Новый участок {esc(evt['segment'])} "
-                f"🚀{evt['speed']:.1f} км/ч ⏱{evt['time_s']:.1f} сек"
-            )
-        elif etype == "penalty":
-            msg = (
-                f"🚫 {esc(evt['name'])} penalty {esc(evt.get('severity','minor'))}"
-                f"+{evt['delta_s']:.2f}s on {esc(evt['segment'])}"
-            )
-        elif etype == "lap_complete":
-            msg = (
-                f"🏁 {esc(evt['name'])} завершил круг {evt['lap']} "
-                f"за {evt['time_s']:.2f}s"
-            )
-        elif etype == "race_complete":
-            msg = f"🏁 {esc(evt['name'])} финишировал за {evt['time_s']:.2f}s"
-        if msg and uid:
-            asyncio.run_coroutine_threadsafe(
-                context.bot.send_message(_to_chat_id(uid), msg, parse_mode=ParseMode.HTML),
-                loop,
-            )
-        if uid is not None and "time_s" in evt:
-            delay = max(0.0, evt["time_s"] - prev[uid])
-            prev[uid] = evt["time_s"]
-            time.sleep(min(delay, 5.0))
+    # Гонка симулируется целиком без задержек, а темп задаёт воспроизведение
+    streams: Dict[str, List[Dict]] = defaultdict(list)
+
+    def collect(evt: Dict) -> None:
+        if "time_s" in evt and evt.get("user_id") is not None:
+            streams[evt["user_id"]].append(evt)
+
+    scheduler = get_race_scheduler()
+    uids = [p["user_id"] for p in player_stats]
+
+    def on_position(pos: int) -> None:
+        outbox.send(_to_chat_id(uid), f"⏳ Все трассы заняты. Лобби в очереди: <b>{pos}</b>",
+                    coalesce="queue", parse_mode=ParseMode.HTML)
 
     try:
-        results = await loop.run_in_executor(None, lambda: start_lobby_race(lid, on_event=on_evt))
-    except Exception as e:
+        async with scheduler.slot(uids, premium=bool(premium_many(uids)), on_position=on_position):
+            outbox.broadcast(
+                [_to_chat_id(p["user_id"]) for p in player_stats],
+                f"🏁 Гонка началась: {tags_all}",
+                parse_mode=ParseMode.HTML,
+            )
+            try:
+                # гонщики симулируются в процессах сервиса гонок, как и одиночные заезды
+                results = await run_lobby_race(lid, on_event=collect)
+            except Exception as e:
+                await send_html(update, f"❌ {esc(e)}")
+                return
+    except (RaceAlreadyActive, RaceQueueFull) as e:
         await send_html(update, f"❌ {esc(e)}")
         return
 
+    # слот нужен только на симуляцию; повтор гонки его не держит,
+    # как и очередь обновлений пользователя
+    release_turn()
+    merged = list(heapq.merge(*streams.values(), key=lambda e: e["time_s"]))
+    # лобби не должно истечь, пока идёт повтор гонки
+    finish_lobby_race(lid, playback_duration(merged, LOBBY_PLAYBACK_SPEED) + LOBBY_POST_RACE_S)
+    await play_lobby_events(context.bot, merged, player_stats, speed=LOBBY_PLAYBACK_SPEED)
+    await _send_lobby_results(context.bot, lid, results, player_stats, groups)
+
+
+async def _send_lobby_results(bot, lid: str, results: List[Dict], player_stats: List[Dict], groups: Dict) -> None:
     finished = [r for r in results if "result" in r]
     finished.sort(key=lambda r: r["result"]["time_s"])
     winner_time = finished[0]["result"]["time_s"] if finished else 0.0
@@ -187,8 +300,96 @@ async def lobby_start_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
             lines.append(f"{esc(r['name'])}: ❌ {esc(r['error'])}")
 
     message = "\n".join(lines)
-    for chat_id in groups.keys():
-        await context.bot.send_message(_to_chat_id(chat_id), message, parse_mode=ParseMode.HTML)
+    fan = await get_outbox(bot).broadcast(
+        [_to_chat_id(chat_id) for chat_id in groups], message, priority=PRIORITY_RESULT, parse_mode=ParseMode.HTML
+    )
+    if fan.failed:
+        logger.warning("Lobby %s results not delivered to %d chat(s)", lid, len(fan.failed))
+
+
+async def _announce_match(bot, match: Match) -> None:
+    try:
+        lid = form_lobby(match)
+    except Exception:
+        logger.exception("Failed to form lobby for match")
+        return
+    get_outbox(bot).broadcast(
+        [_to_chat_id(t.chat_id) for t in match.tickets],
+        f"🎯 Соперники найдены! Лобби <code>{esc(lid)}</code>. Старт: /lobby_start {esc(lid)}",
+        priority=PRIORITY_RESULT,
+        parse_mode=ParseMode.HTML,
+    )
+    await broadcast_lobby_state(lid, bot)
+
+
+async def _matchmaking_loop(bot) -> None:
+    while True:
+        await asyncio.sleep(MM_TICK_S)
+        for match in MATCH_QUEUE.tick():
+            await _announce_match(bot, match)
+
+
+def _ensure_matchmaking_loop(bot) -> None:
+    global _mm_task
+    if _mm_task is None or _mm_task.done():
+        _mm_task = asyncio.get_running_loop().create_task(_matchmaking_loop(bot))
+
+
+async def mm_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    uid = _uid(update)
+    name = _uname(update)
+    if find_user_lobby(uid):
+        await send_html(update, "Ты уже в лобби. Выйди: /lobby_leave")
+        return
+    p = await aload_player(uid, name)
+    track_id = context.args[0] if context.args else p.current_track
+    if not p.current_car or not track_id:
+        await send_html(update, "Сначала выбери машину и трассу")
+        return
+    item = list_catalog()["cars"].get(p.current_car, {})
+    stats = car_stats(p, p.current_car)
+    ticket = Ticket(
+        user_id=uid,
+        name=name,
+        chat_id=str(update.effective_chat.id),
+        track_id=track_id,
+        tier=item.get("tier", "starter"),
+        pi=performance_index(stats["power"], stats["mass"], stats["tire_grip"]),
+        car=item.get("name", p.current_car),
+        mass=stats["mass"],
+        power=stats["power"],
+    )
+    try:
+        match = MATCH_QUEUE.enqueue(ticket)
+    except RuntimeError as e:
+        await send_html(update, f"❌ {esc(e)}")
+        return
+    _ensure_matchmaking_loop(context.bot)
+    if match:
+        await _announce_match(context.bot, match)
+    else:
+        await send_html(update, "🔎 Ищем соперников… Отмена: /mm_leave")
+
+
+async def mm_leave_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if MATCH_QUEUE.dequeue(_uid(update)):
+        await send_html(update, "Поиск соперников отменён")
+    else:
+        await send_html(update, "Ты не в очереди подбора")
+
+
+async def _notify_expired(bot, lobby_id: str, snapshot: Dict) -> None:
+    chats = [_player_chat(p) for p in snapshot.get("players", [])]
+    get_outbox(bot).broadcast(chats, f"⌛ Лобби {esc(lobby_id)} закрыто.")
+
+
+def start_lobby_reaper(bot) -> LobbyReaper:
+    """Start closing expired lobbies on the running event loop."""
+    global _reaper
+    if _reaper is None:
+        _reaper = LobbyReaper(on_expire=lambda lid, snap: _notify_expired(bot, lid, snap))
+        _reaper.attach(asyncio.get_running_loop())
+    return _reaper
 
 
 def setup(app: Application) -> None:
@@ -196,3 +397,5 @@ def setup(app: Application) -> None:
     app.add_handler(CommandHandler("lobby_join", lobby_join_cmd))
     app.add_handler(CommandHandler("lobby_leave", lobby_leave_cmd))
     app.add_handler(CommandHandler("lobby_start", lobby_start_cmd))
+    app.add_handler(CommandHandler("mm", mm_cmd))
+    app.add_handler(CommandHandler("mm_leave", mm_leave_cmd))
@@ -1,15 +1,21 @@
-import os, json, tempfile
-from dataclasses import dataclass, asdict, field
-from typing import List, Dict, Optional
+import os, json, tempfile, time, logging
+from dataclasses import dataclass, asdict, field, fields
+from typing import List, Dict, Optional, Tuple
 from pathlib import Path
 
+from ledger import record as record_txn
+from models_v2 import DriverProfile
+
 DATA_DIR = Path(os.getenv("GAME_DATA_DIR", "./data"))
-USERS_DIR = DATA_DIR / "users"
-USERS_DIR.mkdir(parents=True, exist_ok=True)
+USERS_DIR = DATA_DIR / "users"  # создаётся при первой записи
 CARS_DIR = DATA_DIR / "cars"
 TRACKS_DIR = DATA_DIR / "tracks"
 
+logger = logging.getLogger(__name__)
+
 DEFAULT_START_BALANCE = 20000
+# Версия формата файла игрока; старые файлы обновляет migrate_players.py
+PLAYER_SCHEMA_VERSION = 2
 RACE_BASE_REWARD = {
     "starter": 150,
     "club": 220,
@@ -194,54 +200,158 @@ class Player:
     garage: List[str] = field(default_factory=list)
     current_car: Optional[str] = None
     current_track: Optional[str] = None
-    driver_json: Optional[str] = None
+    driver: Optional[Dict] = None  # embedded DriverProfile fields
     races_today: int = 0
     last_race_day: Optional[str] = None
     upgrades: Dict[str, UpgradeProgress] = field(default_factory=dict)  # car_id -> progress
+    schema_version: int = PLAYER_SCHEMA_VERSION
+    # DriverProfile строится из ``driver`` только при первом обращении
+    _driver_obj: Optional[DriverProfile] = field(default=None, init=False, repr=False, compare=False)
+    # проводки (kind, delta, balance, ref), которые попадут в журнал после сохранения
+    _txns: List[Tuple[str, int, int, Optional[str]]] = field(default_factory=list, init=False, repr=False, compare=False)
 
     def __post_init__(self):
         if self.garage is None:
             self.garage = []
 
+    def driver_profile(self) -> Optional[DriverProfile]:
+        """Return the driver profile, parsing the embedded dict on first use."""
+        if self._driver_obj is None and self.driver:
+            self._driver_obj = DriverProfile(**self.driver)
+        return self._driver_obj
+
+    def set_driver_profile(self, d: DriverProfile) -> None:
+        self._driver_obj = d
+
+    @property
+    def driver_json(self) -> Optional[str]:
+        """Legacy string form of the driver profile."""
+        d = self.driver_profile()
+        return d.to_json() if d else None
+
+    def to_dict(self) -> Dict:
+        data = {f.name: getattr(self, f.name) for f in fields(self) if not f.name.startswith("_")}
+        data["garage"] = list(self.garage)
+        data["upgrades"] = {cid: asdict(u) for cid, u in self.upgrades.items()}
+        if self._driver_obj is not None:
+            data["driver"] = asdict(self._driver_obj)
+        return data
+
     def to_json(self) -> str:
-        return json.dumps(asdict(self), ensure_ascii=False, indent=2)
+        return json.dumps(self.to_dict(), ensure_ascii=False, separators=(",", ":"))
 
 def _user_path(uid: str) -> Path:
     return USERS_DIR / f"{uid}.json"
 
+def _normalize_upgrades(raw: Dict) -> Dict[str, Dict]:
+    """Convert the historical dict/list/int ``upgrades`` formats to dicts."""
+    out: Dict[str, Dict] = {}
+    for cid, val in raw.items():
+        if isinstance(val, dict):
+            out[cid] = {
+                "level": int(val.get("level", 0)),
+                "parts": list(val.get("parts", [])),
+                "custom_done": bool(val.get("custom_done", False)),
+            }
+        elif isinstance(val, list):
+            out[cid] = {"level": 0, "parts": list(val), "custom_done": False}
+        elif isinstance(val, int):
+            out[cid] = {"level": val, "parts": [], "custom_done": False}
+        else:
+            out[cid] = {"level": 0, "parts": [], "custom_done": False}
+    return out
+
+
+class PlayerSchemaTooNew(RuntimeError):
+    """The player file was written by a newer version of the bot."""
+
+
+def migrate_player_data(data: Dict, name: Optional[str] = None) -> bool:
+    """Upgrade a raw player document to ``PLAYER_SCHEMA_VERSION`` in place.
+
+    Returns ``True`` when the document was changed.  Raises
+    :class:`PlayerSchemaTooNew` for documents from a newer release.
+    """
+    version = data.get("schema_version", 0)
+    if version == PLAYER_SCHEMA_VERSION:
+        return False
+    if version > PLAYER_SCHEMA_VERSION:
+        raise PlayerSchemaTooNew(
+            f"Файл игрока в формате v{version}, эта версия бота понимает только v{PLAYER_SCHEMA_VERSION}"
+        )
+    if version < 1:
+        data.setdefault("name", name if name is not None else data.get("user_id", ""))
+        data.setdefault("balance", DEFAULT_START_BALANCE)
+        data.setdefault("garage", [])
+        data.setdefault("races_today", 0)
+        data.setdefault("last_race_day", None)
+        data["upgrades"] = _normalize_upgrades(data.get("upgrades") or {})
+    if version < 2:
+        # v2: профиль пилота хранится объектом, а не JSON-строкой
+        raw = data.pop("driver_json", None)
+        try:
+            data["driver"] = json.loads(raw) if raw else None
+        except ValueError:
+            data["driver"] = None
+    data["schema_version"] = PLAYER_SCHEMA_VERSION
+    return True
+
+
+def player_from_data(data: Dict, name: Optional[str] = None) -> Player:
+    """Build a :class:`Player` from a raw document, migrating legacy ones."""
+    if data.get("schema_version") != PLAYER_SCHEMA_VERSION:
+        migrate_player_data(data, name)
+    data["upgrades"] = {cid: UpgradeProgress(**val) for cid, val in data["upgrades"].items()}
+    return Player(**data)
+
+
+def _quarantine(pth: Path) -> None:
+    """Move an unreadable player file aside instead of overwriting it."""
+    dst = pth.with_name(f"{pth.name}.corrupt-{int(time.time())}")
+    try:
+        os.replace(pth, dst)
+        logger.warning("Corrupt player file %s moved to %s", pth, dst.name)
+    except OSError:
+        logger.warning("Corrupt player file %s could not be moved aside", pth)
+
+
+# Хранилище с отложенной записью (см. player_store); бот включает его при старте
+_STORE = None
+
+
+def use_player_store(store) -> None:
+    """Route :func:`load_player`/:func:`save_player` through ``store``.
+
+    ``None`` restores direct, synchronous file access.
+    """
+    global _STORE
+    _STORE = store
+
+
+def player_store():
+    return _STORE
+
+
 def load_player(uid: str, name: str) -> Player:
+    if _STORE is not None:
+        return _STORE.load(uid, name)
+    return _read_player(uid, name)
+
+
+def _read_player(uid: str, name: str) -> Player:
     pth = _user_path(uid)
     if pth.exists():
         try:
             data = json.loads(pth.read_text(encoding="utf-8"))
-            data.setdefault("name", name)
-            data.setdefault("balance", DEFAULT_START_BALANCE)
-            data.setdefault("garage", [])
-
-            data.setdefault("races_today", 0)
-            data.setdefault("last_race_day", None)
-
-            data.setdefault("upgrades", {})
-            upg: Dict[str, UpgradeProgress] = {}
-            for cid, val in data["upgrades"].items():
-                if isinstance(val, dict):
-                    lvl = int(val.get("level", 0))
-                    parts = list(val.get("parts", []))
-                    custom = bool(val.get("custom_done", False))
-                    upg[cid] = UpgradeProgress(level=lvl, parts=parts, custom_done=custom)
-                elif isinstance(val, list):
-                    upg[cid] = UpgradeProgress(level=0, parts=list(val))
-                elif isinstance(val, int):
-                    upg[cid] = UpgradeProgress(level=val, parts=[])
-                else:
-                    upg[cid] = UpgradeProgress()
-
-            data["upgrades"] = upg
-            return Player(**data)
+            return player_from_data(data, name)
+        except PlayerSchemaTooNew:
+            # файл цел, его записал более новый бот (откат при выкладке) — не трогаем
+            raise
         except Exception:
-            pass
+            _quarantine(pth)
     p = Player(user_id=uid, name=name)
-    pth.write_text(p.to_json(), encoding="utf-8")
+    _atomic_write(pth, p.to_json())
+    record_txn(uid, "open", p.balance, p.balance)
     return p
 
 def _atomic_write(path: Path, text: str):
@@ -253,10 +363,86 @@ def _atomic_write(path: Path, text: str):
         os.fsync(f.fileno())
     os.replace(tmp, path)
 
-def save_player(p: Player) -> None:
-    _atomic_write(_user_path(p.user_id), p.to_json())
+def _note_txn(p: Player, kind: str, delta: int, ref: Optional[str] = None) -> None:
+    """Queue a ledger entry for ``p``; :func:`save_player` records it once saved."""
+    p._txns.append((kind, int(delta), p.balance, ref))
 
-def list_catalog() -> Dict:
+
+def _record_txns(uid: str, txns: List[Tuple[str, int, int, Optional[str]]]) -> None:
+    for kind, delta, balance, ref in txns:
+        record_txn(uid, kind, delta, balance, ref)
+
+
+def save_player(p: Player):
+    """Persist ``p`` and then record its queued ledger entries.
+
+    Entries go to the ledger only after the document is written, so a
+    failed save never leaves a transaction that did not happen; they stay
+    queued on ``p`` for the next save instead.  With a player store the
+    write is asynchronous and its future is returned, otherwise ``None``.
+    """
+    txns, p._txns = p._txns, []
+    try:
+        if _STORE is not None:
+            fut = _STORE.save(p)
+        else:
+            _atomic_write(_user_path(p.user_id), p.to_json())
+            fut = None
+    except BaseException:
+        p._txns[:0] = txns
+        raise
+    if fut is None:
+        _record_txns(p.user_id, txns)
+    elif txns:
+        def settled(f) -> None:
+            if f.exception() is None:
+                _record_txns(p.user_id, txns)
+            else:
+                p._txns[:0] = txns
+
+        fut.add_done_callback(settled)
+    return fut
+
+# Как часто каталог и трассы сверяются с диском, секунд
+CATALOG_RECHECK_S = float(os.getenv("CATALOG_RECHECK_S", "5"))
+# Кэш каталога и трасс: путь каталога -> (mtime каталога, когда сверяли, данные)
+_DIR_CACHE: Dict[str, Tuple[int, float, Dict]] = {}
+
+
+def _dir_mtime(d: Path) -> int:
+    try:
+        return os.stat(d).st_mtime_ns
+    except FileNotFoundError:
+        return 0
+
+
+def _cached_dir(d: Path, load) -> Dict:
+    """Data loaded from ``d``, reloaded when the directory itself changes.
+
+    Adding, removing or atomically replacing a file (write + rename) bumps
+    the directory mtime.  It is checked with one ``stat`` at most every
+    ``CATALOG_RECHECK_S`` seconds; in-place edits need :func:`reload_catalog`.
+    """
+    key = str(d)
+    now = time.monotonic()
+    cached = _DIR_CACHE.get(key)
+    if cached is not None and now - cached[1] < CATALOG_RECHECK_S:
+        return cached[2]
+    mtime = _dir_mtime(d)
+    if cached is not None and cached[0] == mtime:
+        _DIR_CACHE[key] = (mtime, now, cached[2])
+        return cached[2]
+    data = load()
+    _DIR_CACHE[key] = (mtime, now, data)
+    return data
+
+
+def reload_catalog() -> None:
+    """Forget cached cars and tracks; the next call reads them again."""
+    _DIR_CACHE.clear()
+
+
+def _load_catalog() -> Dict:
     out = {"cars": {}}
     for p in CARS_DIR.glob("*.json"):
         try:
@@ -275,7 +461,17 @@ def list_catalog() -> Dict:
             continue
     return out
 
-def list_tracks() -> Dict[str, str]:
+
+def list_catalog() -> Dict:
+    """Car catalog, re-read only when ``CARS_DIR`` changes (see :func:`_cached_dir`).
+
+    The same dict is returned until then, so treat it as read-only; a new
+    object after a change lets callers (e.g. keyboard caches) notice it.
+    """
+    return _cached_dir(CARS_DIR, _load_catalog)
+
+
+def _load_tracks() -> Dict[str, str]:
     out = {}
     for p in TRACKS_DIR.glob("*.json"):
         try:
@@ -287,6 +483,11 @@ def list_tracks() -> Dict[str, str]:
             continue
     return out
 
+
+def list_tracks() -> Dict[str, str]:
+    """Track names by id; cached like :func:`list_catalog`."""
+    return _cached_dir(TRACKS_DIR, _load_tracks)
+
 def buy_car(p: Player, car_id: str) -> str:
     cat = list_catalog()
     if car_id not in cat["cars"]:
@@ -299,6 +500,7 @@ def buy_car(p: Player, car_id: str) -> str:
     p.garage.append(car_id)
     if p.current_car is None:
         p.current_car = car_id
+    _note_txn(p, "buy_car", -price, car_id)
     save_player(p)
     stats = car_stats(p, car_id)
     power = int(stats["base_power"])
@@ -331,15 +533,24 @@ def payout_for_race(car_tier: str, laps: int, incidents: int, clean: bool) -> in
     mult = 1.0 + (CLEAN_BONUS if clean else 0.0)
     return max(0, int(base * mult))
 
-def reward_player(p: Player, amount: int) -> None:
+def reward_player(
+    p: Player, amount: int, *, kind: str = "reward", ref: Optional[str] = None, save: bool = True
+) -> None:
+    """Credit the player and record the transaction in the ledger.
+
+    ``save=False`` lets callers that persist the player right afterwards skip
+    the extra document rewrite; the entry is recorded with that save.
+    """
     p.balance += int(amount)
-    save_player(p)
+    _note_txn(p, kind, amount, ref)
+    if save:
+        save_player(p)
 
 
 def redeem_bonus_code(p: Player, code: str) -> str:
     """Apply a bonus code reward for the player."""
     if code == "TestNewBounty":
-        reward_player(p, 100_000)
+        reward_player(p, 100_000, kind="bonus", ref=code)
         return f"🎁 Начислено 100000. Баланс: {p.balance}."
     return "🚫 Неверный код."
 
@@ -413,6 +624,7 @@ def buy_upgrade(p: Player, car_id: str, part_id: str) -> str:
         p.balance -= cost
         progress.custom_done = True
         p.upgrades[car_id] = progress
+        _note_txn(p, "buy_upgrade", -cost, f"{car_id}:custom")
         save_player(p)
         after = car_stats(p, car_id)
         dp = after["power"] - before["power"]
@@ -444,6 +656,7 @@ def buy_upgrade(p: Player, car_id: str, part_id: str) -> str:
         msg_end = ""
         current_level = progress.level + 1
     p.upgrades[car_id] = progress
+    _note_txn(p, "buy_upgrade", -cost, f"{car_id}:{part_id}")
     save_player(p)
     after = car_stats(p, car_id)
     dp = after["power"] - before["power"]
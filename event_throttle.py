@@ -0,0 +1,149 @@
+"""One throttling layer between race engine events and their outputs.
+
+Engines emit an event per segment change, every 7.5 simulated seconds
+(``segment_tick``), per penalty, lap and finish.  Frontends used to limit
+that each in their own way.  They now share two pieces:
+
+* :class:`EventThrottle` decides *what* goes out.  Each event type can
+  have a minimum wall-clock interval per stream (``segment_tick`` every
+  ``EVENT_TICK_INTERVAL_S``, ``segment_change`` every
+  ``EVENT_SEGMENT_INTERVAL_S``; 0 means no limit).  An event that comes too
+  early replaces the pending one of its type and goes out with the next
+  event of that stream once its interval has passed, so the output always
+  shows the latest state.  Critical events (penalties, laps, finish, skill
+  gains) are never delayed or dropped.  ``race_complete`` discards what is
+  still pending for the stream and forgets it.  At most
+  ``EVENT_THROTTLE_MAX_KEYS`` streams are tracked; the least recently used
+  ones are forgotten first.
+* :class:`Pacer` decides *when*: events are spaced out on the event loop
+  clock by their simulated ``time_s``, divided by a speed and with long
+  gaps capped.  The schedule follows the loop clock, so slow sinks do not
+  make the race drift.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, FrozenSet, Hashable, Iterable, List, Optional
+
+EVENT_TICK_INTERVAL_S = float(os.getenv("EVENT_TICK_INTERVAL_S", "20"))
+EVENT_SEGMENT_INTERVAL_S = float(os.getenv("EVENT_SEGMENT_INTERVAL_S", "0"))
+EVENT_THROTTLE_MAX_KEYS = int(os.getenv("EVENT_THROTTLE_MAX_KEYS", "10000"))
+RACE_PLAYBACK_SPEED = float(os.getenv("RACE_PLAYBACK_SPEED", "1.0"))
+RACE_PLAYBACK_MAX_GAP = float(os.getenv("RACE_PLAYBACK_MAX_GAP", "5.0"))
+
+CRITICAL_EVENTS: FrozenSet[str] = frozenset({"penalty", "lap_complete", "race_complete", "skill_up"})
+
+
+def default_intervals() -> Dict[str, float]:
+    return {"segment_tick": EVENT_TICK_INTERVAL_S, "segment_change": EVENT_SEGMENT_INTERVAL_S}
+
+
+class _Stream:
+    __slots__ = ("last", "pending")
+
+    def __init__(self) -> None:
+        self.last: Dict[str, float] = {}
+        # тип -> последнее придержанное событие; порядок вставки = порядок прихода
+        self.pending: Dict[str, Dict] = {}
+
+
+class EventThrottle:
+    def __init__(
+        self,
+        intervals: Optional[Dict[str, float]] = None,
+        critical: Iterable[str] = CRITICAL_EVENTS,
+        max_keys: int = EVENT_THROTTLE_MAX_KEYS,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.intervals = default_intervals() if intervals is None else dict(intervals)
+        self.critical = frozenset(critical)
+        self.max_keys = max(1, max_keys)
+        self.clock = clock
+        self.dropped = 0
+        self._streams: "OrderedDict[Hashable, _Stream]" = OrderedDict()
+        # lobby.py зовёт из потоков пула гонок
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._streams)
+
+    def push(self, key: Hashable, evt: Dict) -> List[Dict]:
+        """Events of stream ``key`` to deliver now, ``evt`` included if allowed."""
+        etype = evt.get("type")
+        with self._lock:
+            now = self.clock()
+            st = self._streams.get(key)
+            if st is None:
+                st = self._streams[key] = _Stream()
+                if len(self._streams) > self.max_keys:
+                    self._streams.popitem(last=False)
+            else:
+                self._streams.move_to_end(key)
+            out = self._due(st, now)
+            interval = self.intervals.get(etype, 0.0)
+            if etype in self.critical or interval <= 0:
+                out.append(evt)
+            elif now - st.last.get(etype, float("-inf")) >= interval:
+                st.last[etype] = now
+                out.append(evt)
+            else:
+                if etype in st.pending:
+                    self.dropped += 1
+                    del st.pending[etype]
+                st.pending[etype] = evt
+            if etype == "race_complete":
+                # придержанные тики после финиша уже никому не нужны
+                self.dropped += len(st.pending)
+                del self._streams[key]
+            return out
+
+    def _due(self, st: _Stream, now: float) -> List[Dict]:
+        out = []
+        for etype in list(st.pending):
+            if now - st.last.get(etype, float("-inf")) >= self.intervals.get(etype, 0.0):
+                st.last[etype] = now
+                out.append(st.pending.pop(etype))
+        return out
+
+    def end(self, key: Hashable) -> None:
+        """Forget stream ``key`` and whatever it still holds back."""
+        with self._lock:
+            self._streams.pop(key, None)
+
+
+class Pacer:
+    """Spaces ordered events on the loop clock by their simulated time."""
+
+    def __init__(self, speed: float = RACE_PLAYBACK_SPEED, max_gap: float = RACE_PLAYBACK_MAX_GAP):
+        self.speed = max(speed, 1e-3)
+        self.max_gap = max_gap
+        self.sim_prev = 0.0
+        self.offset = 0.0
+        self._start: Optional[float] = None
+
+    def advance(self, evt: Dict) -> float:
+        """Move the schedule past ``evt``; returns its offset from the start."""
+        sim = evt.get("time_s", self.sim_prev)
+        self.offset += min(max(0.0, sim - self.sim_prev) / self.speed, self.max_gap)
+        self.sim_prev = max(self.sim_prev, sim)
+        return self.offset
+
+    async def wait(self, evt: Dict) -> None:
+        loop = asyncio.get_running_loop()
+        if self._start is None:
+            self._start = loop.time()
+        delay = self._start + self.advance(evt) - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+def playback_duration(events: Iterable[Dict], speed: float = RACE_PLAYBACK_SPEED,
+                      max_gap: float = RACE_PLAYBACK_MAX_GAP) -> float:
+    """Seconds a :class:`Pacer` takes to play ``events``."""
+    pacer = Pacer(speed, max_gap)
+    for evt in events:
+        pacer.advance(evt)
+    return pacer.offset
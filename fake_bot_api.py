@@ -0,0 +1,324 @@
+"""Local stand-in for the Telegram Bot API, for load tests.
+
+:class:`FakeBotAPI` answers the calls the bot makes (``getMe``,
+``getUpdates``, ``sendMessage``, ``editMessageText``,
+``editMessageReplyMarkup``, ``answerCallbackQuery`` and a few no-ops)
+over plain HTTP on asyncio streams.  Outgoing messages are limited like the
+real service: a token bucket per chat and a global one, answered with
+``429 Too Many Requests`` and ``retry_after`` when exceeded.
+
+Point the bot at it with ``BOT_API_URL=http://127.0.0.1:8081/bot`` and any
+token shaped like ``123:abc``.  Tests and :mod:`loadtest_bot` inject updates
+with :meth:`FakeBotAPI.push_update` and watch replies per chat through
+:meth:`FakeBotAPI.subscribe`.
+
+Run standalone with ``python fake_bot_api.py --port 8081``.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import time
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional, Set, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+from outbox import TokenBucket
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "FakeBot", "username": "fake_race_bot"}
+
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 429: "Too Many Requests"}
+
+
+class ApiError(Exception):
+    def __init__(self, code: int, description: str, retry_after: Optional[int] = None):
+        super().__init__(description)
+        self.code = code
+        self.description = description
+        self.retry_after = retry_after
+
+
+def _decode_params(headers: Dict[str, str], body: bytes, query: str) -> Dict[str, Any]:
+    params: Dict[str, Any] = dict(parse_qsl(query))
+    ctype = headers.get("content-type", "")
+    if not body:
+        return params
+    if ctype.startswith("application/json"):
+        params.update(json.loads(body))
+        return params
+    if not ctype.startswith("application/x-www-form-urlencoded"):
+        raise ApiError(400, "Bad Request: unsupported content type")
+    for key, value in parse_qsl(body.decode("utf-8"), keep_blank_values=True):
+        # PTB кодирует в JSON всё, кроме строк
+        if value[:1] in ("{", "[") and key != "text":
+            try:
+                value = json.loads(value)
+            except ValueError:
+                pass
+        params[key] = value
+    return params
+
+
+def _chat_id(params: Dict[str, Any]) -> Any:
+    raw = params.get("chat_id")
+    if raw is None:
+        raise ApiError(400, "Bad Request: chat_id is empty")
+    try:
+        return int(raw)
+    except (TypeError, ValueError):
+        return raw
+
+
+class FakeBotAPI:
+    def __init__(
+        self,
+        *,
+        chat_rate: float = 1.0,
+        chat_burst: float = 3,
+        global_rate: float = 30.0,
+        global_burst: float = 30,
+        latency_s: float = 0.0,
+    ):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.latency_s = latency_s
+        self._global = TokenBucket(global_rate, global_burst, time.monotonic())
+        self._chat_buckets: Dict[Any, TokenBucket] = {}
+        self._updates: List[Dict] = []
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._new_updates: Optional[asyncio.Event] = None
+        self._subscribers: Dict[Any, Set[asyncio.Queue]] = defaultdict(set)
+        self._texts: Dict[Tuple[Any, int], str] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._connections: Set[asyncio.Task] = set()
+        self.calls: Counter = Counter()
+        self.limited = 0
+        self.started = time.monotonic()
+
+    # ---- управление из тестов и драйвера ----
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> int:
+        """Start listening and return the bound port."""
+        self._new_updates = asyncio.Event()
+        self._server = await asyncio.start_server(self._handle, host, port)
+        self.started = time.monotonic()
+        return self._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+        # долгие getUpdates и keep-alive соединения закрываем сами
+        for task in list(self._connections):
+            task.cancel()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+
+    def push_update(self, update: Dict) -> int:
+        """Queue an update for ``getUpdates``; ``update_id`` is assigned here."""
+        update = dict(update, update_id=next(self._update_ids))
+        self._updates.append(update)
+        if self._new_updates is not None:
+            self._new_updates.set()
+        return update["update_id"]
+
+    def subscribe(self, chat_id: Any) -> asyncio.Queue:
+        """Queue that receives every message sent or edited in ``chat_id``."""
+        q: asyncio.Queue = asyncio.Queue()
+        self._subscribers[chat_id].add(q)
+        return q
+
+    def unsubscribe(self, chat_id: Any, q: asyncio.Queue) -> None:
+        subs = self._subscribers.get(chat_id)
+        if subs is not None:
+            subs.discard(q)
+            if not subs:
+                del self._subscribers[chat_id]
+
+    def stats(self) -> Dict[str, Any]:
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        out = self.calls["sendMessage"] + self.calls["editMessageText"]
+        return {
+            "calls": dict(self.calls),
+            "rate_limited": self.limited,
+            "messages_per_s": round(out / elapsed, 1),
+        }
+
+    # ---- HTTP ----
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                _, target, _ = line.decode("latin-1").split(" ", 2)
+                headers: Dict[str, str] = {}
+                while True:
+                    h = await reader.readline()
+                    if h in (b"\r\n", b"\n", b""):
+                        break
+                    k, v = h.decode("latin-1").split(":", 1)
+                    headers[k.strip().lower()] = v.strip()
+                body = await reader.readexactly(int(headers.get("content-length", "0")))
+                status, payload = await self._call(target, headers, body)
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                writer.write(
+                    f"HTTP/1.1 {status} {_REASONS.get(status, 'Error')}\r\n"
+                    f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n\r\n".encode("latin-1")
+                    + data
+                )
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        except asyncio.CancelledError:
+            # остановка сервера; не даём asyncio ругаться на отменённый обработчик
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+    async def _call(self, target: str, headers: Dict[str, str], body: bytes) -> Tuple[int, Dict]:
+        url = urlsplit(target)
+        parts = url.path.strip("/").split("/")
+        if len(parts) != 2 or not parts[0].startswith("bot"):
+            return 404, {"ok": False, "error_code": 404, "description": "Not Found"}
+        method = parts[1]
+        self.calls[method] += 1
+        handler = getattr(self, f"_m_{method.lower()}", None)
+        if handler is None:
+            return 404, {"ok": False, "error_code": 404, "description": "Not Found: method not found"}
+        try:
+            params = _decode_params(headers, body, url.query)
+            if self.latency_s:
+                await asyncio.sleep(self.latency_s)
+            result = await handler(params)
+        except ApiError as e:
+            payload: Dict[str, Any] = {"ok": False, "error_code": e.code, "description": e.description}
+            if e.retry_after is not None:
+                payload["parameters"] = {"retry_after": e.retry_after}
+            return e.code, payload
+        return 200, {"ok": True, "result": result}
+
+    # ---- лимиты ----
+
+    def _take(self, chat_id: Any) -> None:
+        now = time.monotonic()
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst, now)
+        delay = max(bucket.delay(now), self._global.delay(now))
+        if delay > 0:
+            self.limited += 1
+            retry = max(1, math.ceil(delay))
+            raise ApiError(429, f"Too Many Requests: retry after {retry}", retry_after=retry)
+        bucket.take(now)
+        self._global.take(now)
+
+    # ---- методы ----
+
+    def _message(self, chat_id: Any, message_id: int, text: str, reply_markup: Any = None) -> Dict:
+        msg = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+            "text": text,
+        }
+        if isinstance(reply_markup, dict) and "inline_keyboard" in reply_markup:
+            msg["reply_markup"] = reply_markup
+        return msg
+
+    def _publish(self, chat_id: Any, kind: str, msg: Dict) -> None:
+        evt = dict(msg, kind=kind, at=time.monotonic())
+        for q in self._subscribers.get(chat_id, ()):
+            q.put_nowait(evt)
+
+    async def _m_getme(self, params: Dict) -> Dict:
+        return dict(BOT_USER, can_join_groups=True, can_read_all_group_messages=False, supports_inline_queries=False)
+
+    async def _m_deletewebhook(self, params: Dict) -> bool:
+        return True
+
+    _m_setwebhook = _m_deletewebhook
+    _m_setmycommands = _m_deletewebhook
+    _m_close = _m_deletewebhook
+    _m_logout = _m_deletewebhook
+
+    async def _m_getupdates(self, params: Dict) -> List[Dict]:
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        timeout = float(params.get("timeout") or 0)
+        if offset:
+            self._updates = [u for u in self._updates if u["update_id"] >= offset]
+        if not self._updates and timeout > 0:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:limit]
+
+    async def _m_sendmessage(self, params: Dict) -> Dict:
+        chat_id = _chat_id(params)
+        text = params.get("text") or ""
+        if not text:
+            raise ApiError(400, "Bad Request: message text is empty")
+        self._take(chat_id)
+        message_id = next(self._message_ids)
+        self._texts[(chat_id, message_id)] = text
+        msg = self._message(chat_id, message_id, text, params.get("reply_markup"))
+        self._publish(chat_id, "send", msg)
+        return msg
+
+    async def _m_editmessagetext(self, params: Dict) -> Dict:
+        chat_id = _chat_id(params)
+        message_id = int(params.get("message_id") or 0)
+        text = params.get("text") or ""
+        if (chat_id, message_id) not in self._texts:
+            raise ApiError(400, "Bad Request: message to edit not found")
+        if self._texts[(chat_id, message_id)] == text:
+            raise ApiError(400, "Bad Request: message is not modified")
+        self._take(chat_id)
+        self._texts[(chat_id, message_id)] = text
+        msg = self._message(chat_id, message_id, text, params.get("reply_markup"))
+        self._publish(chat_id, "edit", msg)
+        return msg
+
+    async def _m_editmessagereplymarkup(self, params: Dict) -> Any:
+        chat_id = _chat_id(params)
+        message_id = int(params.get("message_id") or 0)
+        return self._message(chat_id, message_id, self._texts.get((chat_id, message_id), "…"))
+
+    async def _m_answercallbackquery(self, params: Dict) -> bool:
+        return True
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    ap = argparse.ArgumentParser(description="Local fake Telegram Bot API server")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8081)
+    ap.add_argument("--chat-rate", type=float, default=1.0)
+    ap.add_argument("--global-rate", type=float, default=30.0)
+    args = ap.parse_args(argv)
+
+    async def serve() -> None:
+        api = FakeBotAPI(chat_rate=args.chat_rate, global_rate=args.global_rate, global_burst=args.global_rate)
+        port = await api.start(args.host, args.port)
+        print(f"Fake Bot API on http://{args.host}:{port}/bot — Ctrl+C to stop")
+        await asyncio.Event().wait()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,11 @@
-import os, json
+import os, json, asyncio
+from dataclasses import dataclass
 from typing import Optional, Dict, Callable
 from pathlib import Path
 from datetime import date
-from models_v2 import Car, Track, TrackSegment, DriverProfile, run_race
+from models_v2 import Car, Track, DriverProfile, load_track, run_race
 from economy_v1 import (
+    Player,
     load_player,
     save_player,
     list_catalog,
@@ -19,15 +21,16 @@ from economy_v1 import (
     available_parts,
 )
 from premium import is_premium
+from leaderboard import get_leaderboards
+from race_service import get_race_service, job_for
+from player_store import player_saved
+import metrics
+import profiling
+from profiling import RaceProfile, StackProfile
 
 DATA_DIR = Path(os.getenv("GAME_DATA_DIR", "./data"))
 MAX_RACES_PER_DAY = 5
 
-def load_track(path: Path) -> Track:
-    data = json.loads(path.read_text(encoding="utf-8"))
-    segs = [TrackSegment(**s) for s in data["segments"]]
-    return Track(data.get("id", path.stem), data.get("name", path.stem), segs)
-
 def load_car_by_id(car_id: str) -> Car:
     p = DATA_DIR / "cars" / f"{car_id}.json"
     data = json.loads(p.read_text(encoding="utf-8"))
@@ -38,15 +41,14 @@ def load_car_by_id(car_id: str) -> Car:
     return Car(**data)
 
 def ensure_driver(p) -> DriverProfile:
-    if p.driver_json:
-        try:
-            return DriverProfile.from_json(p.driver_json)
-        except Exception:
-            pass
-    return DriverProfile.default(p.user_id, p.name)
+    try:
+        d = p.driver_profile()
+    except Exception:
+        d = None
+    return d or DriverProfile.default(p.user_id, p.name)
 
 def save_driver(p, d: DriverProfile):
-    p.driver_json = d.to_json()
+    p.set_driver_profile(d)
     save_player(p)
 
 
@@ -85,16 +87,37 @@ def get_upgrade_status(user_id: str, name: str, car_id: str) -> str:
     p = load_player(user_id, name)
     return upgrade_status(p, car_id)
 
-def run_player_race(user_id: str, name: str, track_id: Optional[str]=None, laps: int=1,
-                    on_event: Optional[Callable[[Dict], None]] = None) -> Dict:
+@dataclass
+class RaceSetup:
+    """Everything needed to simulate one player's race."""
+    player: Player
+    driver: DriverProfile
+    car: Car
+    track: Track
+    tier: str
+    track_id: str
+    laps: int
+    profile: Optional[RaceProfile] = None
+
+
+def _mark(prof: Optional[RaceProfile], phase: str) -> None:
+    if prof is not None:
+        prof.mark(phase)
+
+
+def prepare_player_race(user_id: str, name: str, track_id: Optional[str] = None, laps: int = 1,
+                        profile: Optional[RaceProfile] = None) -> RaceSetup:
+    """Load the player, upgraded car and track and consume a daily race slot."""
     p = load_player(user_id, name)
     d = ensure_driver(p)
+    _mark(profile, "load_player")
     if not p.current_car:
         raise RuntimeError("У тебя нет текущей машины. Купи или выбери из гаража.")
     car = load_car_by_id(p.current_car)
     cat = list_catalog()
     item = cat["cars"].get(car.id)
     tier = item.get("tier", "starter") if item else "starter"
+    _mark(profile, "load_car")
     progress = p.upgrades.get(car.id)
     if progress:
         max_parts = UPGRADE_CLASSES.get(tier, 0) * PARTS_PER_CLASS
@@ -104,6 +127,7 @@ def run_player_race(user_id: str, name: str, track_id: Optional[str]=None, laps:
             car.power *= 1.0 + eff.get("power", 0.0)
             car.mass *= 1.0 + eff.get("mass", 0.0)
             car.tire_grip *= 1.0 + eff.get("tire_grip", 0.0)
+    _mark(profile, "apply_upgrades")
 
     tid = track_id or p.current_track
     if not tid:
@@ -112,13 +136,29 @@ def run_player_race(user_id: str, name: str, track_id: Optional[str]=None, laps:
     if not tpath.exists():
         raise RuntimeError(f"Файл трассы не найден: {tpath}")
     track = load_track(tpath)
+    _mark(profile, "load_track")
 
     _check_daily_limit(p)
+    _mark(profile, "daily_limit")
+    return RaceSetup(player=p, driver=d, car=car, track=track, tier=tier, track_id=tid, laps=laps, profile=profile)
 
-    summary, gains = run_race(car, track, laps=laps, driver=d, on_event=on_event)
+
+def settle_player_race(setup: RaceSetup, summary: Dict, gains: Dict[str, float]) -> Dict:
+    """Pay out, persist the driver and record the time for a finished race."""
+    p, laps, tier, tid, prof = setup.player, setup.laps, setup.tier, setup.track_id, setup.profile
+    if prof is not None:
+        prof.engine = summary.pop("profile", {})
     reward = payout_for_race(tier, laps, summary["incidents"], clean=(summary["incidents"] == 0))
-    reward_player(p, reward)
-    save_driver(p, d)
+    reward_player(p, reward, kind="race", ref=tid, save=False)
+    _mark(prof, "reward")
+    save_driver(p, setup.driver)
+    _mark(prof, "save")
+    # в таблицу рекордов идёт среднее время круга
+    best = get_leaderboards().record(tid, tier, p.user_id, p.name, summary["total_time_s"] / max(1, laps))
+    _mark(prof, "leaderboard")
+    if prof is not None:
+        profiling.finish(prof, user_id=p.user_id, track_id=tid, tier=tier, laps=laps,
+                         steps=summary.get("steps", 0), sim_ms=round(summary.get("sim_s", 0.0) * 1000, 3))
 
     return {
         "time_s": round(summary["total_time_s"], 2),
@@ -126,4 +166,59 @@ def run_player_race(user_id: str, name: str, track_id: Optional[str]=None, laps:
         "reward": reward,
         "penalties": summary["penalties"],
         "skill_gains": gains,
+        "track_id": tid,
+        "tier": tier,
+        "personal_best": best,
     }
+
+
+def _observe_race(summary: Dict, mode: str) -> None:
+    metrics.RACE_SIM_SECONDS.observe(summary.get("sim_s", 0.0), mode)
+    metrics.RACE_STEPS.observe(summary.get("steps", 0), mode)
+
+
+def run_player_race(user_id: str, name: str, track_id: Optional[str]=None, laps: int=1,
+                    on_event: Optional[Callable[[Dict], None]] = None) -> Dict:
+    setup = prepare_player_race(user_id, name, track_id=track_id, laps=laps, profile=profiling.begin())
+    stacks = StackProfile() if setup.profile is not None else None
+    summary, gains = run_race(setup.car, setup.track, laps=laps, driver=setup.driver, on_event=on_event,
+                              profile=stacks)
+    if stacks is not None:
+        summary["profile"] = stacks.stacks
+    _mark(setup.profile, "simulate")
+    _observe_race(summary, "thread")
+    return settle_player_race(setup, summary, gains)
+
+
+async def run_player_race_async(user_id: str, name: str, track_id: Optional[str] = None, laps: int = 1,
+                                on_event: Optional[Callable[[Dict], object]] = None,
+                                admitted: bool = False) -> Dict:
+    """Like :func:`run_player_race`, but simulates in the race process pool.
+
+    Disk work runs in the default executor; ``on_event`` is called on the
+    event loop and may be a coroutine function.  ``admitted`` means the
+    caller already reserved a place with ``RaceService.admit``; it is used
+    up by this call either way.
+    """
+    service = get_race_service()
+    # место в очереди занимаем до загрузки игрока, чтобы перегрузка отсекалась сразу
+    if not admitted:
+        service.admit()
+    loop = asyncio.get_running_loop()
+    prof = profiling.begin()
+    try:
+        setup = await loop.run_in_executor(
+            None, lambda: prepare_player_race(user_id, name, track_id=track_id, laps=laps, profile=prof)
+        )
+        job = job_for(setup.car, setup.track_id, laps, setup.driver, profile=prof is not None)
+    except BaseException:
+        service.release()
+        raise
+    summary, gains, driver = await service.run(job, on_event, admitted=True)
+    setup.driver = DriverProfile(**driver)
+    _mark(prof, "simulate")
+    _observe_race(summary, "pool")
+    result = await loop.run_in_executor(None, settle_player_race, setup, summary, gains)
+    # награду показываем только когда она записана
+    await player_saved(user_id)
+    return result
@@ -0,0 +1,174 @@
+"""Per-track best-time leaderboards.
+
+Each board is keyed by ``(track_id, tier)`` and keeps every user's best
+time in a dict plus the ``(time, user_id)`` order in sorted blocks (see
+:class:`Board`).  Recording a race costs a bisect and a shift within one
+block; a user's position costs one pass over the block sizes.  Nothing ever
+scans the player files.  Only personal bests are persisted, as
+compact JSON lines appended to ``records.log``; the log is compacted on load
+once superseded lines outnumber the live ones.
+"""
+
+import json
+import os
+import threading
+from bisect import bisect_left, insort
+from itertools import chain, islice
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+DATA_DIR = Path(os.getenv("GAME_DATA_DIR", "./data"))
+LEADERBOARD_DIR = DATA_DIR / "leaderboards"
+TOP_N = 10
+# Размер блока упорядоченного списка в Board
+BLOCK = 512
+
+
+class Board:
+    """Best time per user plus the order of ``(time, user_id)`` pairs.
+
+    The order is kept as a list of sorted blocks of at most ``block`` pairs,
+    the layout of ``sortedcontainers.SortedList``.  An insert or delete
+    bisects to its block and shifts at most ``block`` items, so its cost does
+    not grow with the board.  A position lookup adds up the sizes of the
+    blocks in front, ``n / block`` additions.
+    """
+
+    def __init__(self, block: int = BLOCK) -> None:
+        self.block = max(2, block)
+        self.best: Dict[str, Tuple[float, str]] = {}  # user_id -> (time, name)
+        self._blocks: List[List[Tuple[float, str]]] = []
+        self._maxes: List[Tuple[float, str]] = []  # последний элемент каждого блока
+
+    def submit(self, user_id: str, name: str, time_s: float) -> bool:
+        """Store the time if it beats the user's best; return whether it did."""
+        prev = self.best.get(user_id)
+        if prev is not None:
+            if time_s >= prev[0]:
+                if name != prev[1]:
+                    self.best[user_id] = (prev[0], name)
+                return False
+            self._remove((prev[0], user_id))
+        self.best[user_id] = (time_s, name)
+        self._insert((time_s, user_id))
+        return True
+
+    def _insert(self, item: Tuple[float, str]) -> None:
+        if not self._blocks:
+            self._blocks.append([item])
+            self._maxes.append(item)
+            return
+        i = min(bisect_left(self._maxes, item), len(self._blocks) - 1)
+        blk = self._blocks[i]
+        insort(blk, item)
+        self._maxes[i] = blk[-1]
+        if len(blk) > self.block:
+            half = len(blk) // 2
+            self._blocks[i:i + 1] = [blk[:half], blk[half:]]
+            self._maxes[i:i + 1] = [blk[half - 1], blk[-1]]
+
+    def _remove(self, item: Tuple[float, str]) -> None:
+        i = bisect_left(self._maxes, item)
+        blk = self._blocks[i]
+        del blk[bisect_left(blk, item)]
+        if blk:
+            self._maxes[i] = blk[-1]
+        else:
+            del self._blocks[i]
+            del self._maxes[i]
+
+    def top(self, n: int = TOP_N) -> List[Dict]:
+        return [
+            {"pos": i + 1, "user_id": uid, "name": self.best[uid][1], "time_s": t}
+            for i, (t, uid) in enumerate(islice(chain.from_iterable(self._blocks), n))
+        ]
+
+    def position(self, user_id: str) -> Optional[Dict]:
+        entry = self.best.get(user_id)
+        if entry is None:
+            return None
+        item = (entry[0], user_id)
+        i = bisect_left(self._maxes, item)
+        pos = sum(len(b) for b in self._blocks[:i]) + bisect_left(self._blocks[i], item) + 1
+        return {"pos": pos, "user_id": user_id, "name": entry[1], "time_s": entry[0]}
+
+    def __len__(self) -> int:
+        return len(self.best)
+
+
+class Leaderboards:
+    def __init__(self, root: Path = LEADERBOARD_DIR):
+        self.root = Path(root)
+        self.log_path = self.root / "records.log"
+        self._boards: Dict[Tuple[str, str], Board] = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self) -> None:
+        if not self.log_path.exists():
+            return
+        lines = 0
+        with self.log_path.open("r", encoding="utf-8") as f:
+            for raw in f:
+                try:
+                    r = json.loads(raw)
+                    self._board(r["t"], r["c"]).submit(r["u"], r["n"], float(r["s"]))
+                    lines += 1
+                except (ValueError, KeyError):
+                    continue
+        live = sum(len(b) for b in self._boards.values())
+        if lines > 2 * live:
+            self._compact()
+
+    def _compact(self) -> None:
+        tmp = self.log_path.with_suffix(".tmp")
+        with tmp.open("w", encoding="utf-8") as f:
+            for (track_id, tier), board in self._boards.items():
+                for uid, (t, name) in board.best.items():
+                    f.write(self._line(track_id, tier, uid, name, t))
+        os.replace(tmp, self.log_path)
+
+    @staticmethod
+    def _line(track_id: str, tier: str, user_id: str, name: str, time_s: float) -> str:
+        rec = {"t": track_id, "c": tier, "u": user_id, "n": name, "s": round(time_s, 3)}
+        return json.dumps(rec, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+    def _board(self, track_id: str, tier: str) -> Board:
+        key = (track_id, tier)
+        board = self._boards.get(key)
+        if board is None:
+            board = self._boards[key] = Board()
+        return board
+
+    def record(self, track_id: str, tier: str, user_id: str, name: str, time_s: float) -> bool:
+        """Submit a race time; returns ``True`` on a new personal best."""
+        time_s = round(float(time_s), 3)
+        with self._lock:
+            improved = self._board(track_id, tier).submit(str(user_id), name, time_s)
+            if improved:
+                self.root.mkdir(parents=True, exist_ok=True)
+                with self.log_path.open("a", encoding="utf-8") as f:
+                    f.write(self._line(track_id, tier, str(user_id), name, time_s))
+        return improved
+
+    def ranking(self, track_id: str, tier: str, user_id: Optional[str] = None, n: int = TOP_N) -> Dict:
+        """Return the top ``n`` entries and, if given, the user's own entry."""
+        with self._lock:
+            board = self._boards.get((track_id, tier))
+            if board is None:
+                return {"top": [], "me": None, "total": 0}
+            me = board.position(str(user_id)) if user_id is not None else None
+            return {"top": board.top(n), "me": me, "total": len(board)}
+
+
+_BOARDS: Optional[Leaderboards] = None
+_BOARDS_LOCK = threading.Lock()
+
+
+def get_leaderboards() -> Leaderboards:
+    global _BOARDS
+    if _BOARDS is None:
+        with _BOARDS_LOCK:
+            if _BOARDS is None:
+                _BOARDS = Leaderboards()
+    return _BOARDS
@@ -0,0 +1,240 @@
+"""Append-only ledger of economy transactions.
+
+Every balance change is appended as one compact JSON line.  Appends are
+buffered in memory and a background thread writes and ``fsync``s them in
+groups every ``LEDGER_FLUSH_MS`` milliseconds, so a burst of transactions
+costs one disk sync instead of one per change.  Every ``LEDGER_SNAPSHOT_EVERY``
+entries the last known balance of each user is written to a snapshot together
+with the byte offset it covers; startup replay only reads the log tail.
+
+A torn or unparseable last line left by a crash is cut off on replay, so
+new appends always start on a line boundary.  A failed write keeps its
+batch queued and is retried on the next flush.
+"""
+
+import atexit
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+DATA_DIR = Path(os.getenv("GAME_DATA_DIR", "./data"))
+LEDGER_DIR = DATA_DIR / "ledger"
+LEDGER_FLUSH_MS = int(os.getenv("LEDGER_FLUSH_MS", "50"))
+LEDGER_SNAPSHOT_EVERY = int(os.getenv("LEDGER_SNAPSHOT_EVERY", "1000"))
+
+logger = logging.getLogger(__name__)
+
+
+class Ledger:
+    def __init__(
+        self,
+        root: Path = LEDGER_DIR,
+        flush_ms: int = LEDGER_FLUSH_MS,
+        snapshot_every: int = LEDGER_SNAPSHOT_EVERY,
+    ):
+        self.root = Path(root)
+        self.log_path = self.root / "economy.log"
+        self.snapshot_path = self.root / "snapshot.json"
+        self.flush_interval = max(flush_ms, 1) / 1000.0
+        self.snapshot_every = max(snapshot_every, 1)
+        self._cond = threading.Condition()
+        self._io_lock = threading.Lock()
+        self._pending: List[str] = []
+        self._balances: Dict[str, int] = {}
+        self._seq = 0
+        self._durable_seq = 0
+        self._since_snapshot = 0
+        self._offset = 0
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+        self._replay()
+
+    # ---- startup ----
+
+    def _replay(self) -> None:
+        """Restore balances from the snapshot plus the log tail."""
+        offset = 0
+        if self.snapshot_path.exists():
+            try:
+                snap = json.loads(self.snapshot_path.read_text(encoding="utf-8"))
+                self._balances = {k: int(v) for k, v in snap.get("balances", {}).items()}
+                self._seq = int(snap.get("seq", 0))
+                offset = int(snap.get("offset", 0))
+            except Exception:
+                self._balances, self._seq, offset = {}, 0, 0
+        if self.log_path.exists():
+            with self.log_path.open("rb") as f:
+                f.seek(offset)
+                for raw in f:
+                    if not raw.endswith(b"\n"):
+                        # оборванная запись после сбоя — дальше не читаем
+                        break
+                    try:
+                        entry = json.loads(raw)
+                    except ValueError:
+                        break
+                    offset += len(raw)
+                    self._seq = max(self._seq, int(entry.get("seq", 0)))
+                    self._balances[entry["uid"]] = int(entry["balance"])
+                    self._since_snapshot += 1
+            size = self.log_path.stat().st_size
+            if size > offset:
+                # иначе следующий батч приклеится к оборванной строке
+                logger.warning("Ledger: отрезаю %d байт битого хвоста %s", size - offset, self.log_path)
+                os.truncate(self.log_path, offset)
+        self._offset = offset
+        self._durable_seq = self._seq
+
+    # ---- writes ----
+
+    def append(self, uid: str, kind: str, delta: int, balance: int, ref: Optional[str] = None) -> int:
+        """Queue a transaction and return its sequence number."""
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Ledger закрыт")
+            self._seq += 1
+            entry = {
+                "seq": self._seq,
+                "ts": round(time.time(), 3),
+                "uid": str(uid),
+                "kind": kind,
+                "delta": int(delta),
+                "balance": int(balance),
+            }
+            if ref:
+                entry["ref"] = ref
+            self._pending.append(json.dumps(entry, ensure_ascii=False, separators=(",", ":")))
+            self._balances[str(uid)] = int(balance)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="ledger-flush", daemon=True)
+                self._thread.start()
+            return self._seq
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                if self._closed and not self._pending:
+                    return
+                self._cond.wait(self.flush_interval)
+            try:
+                self._flush_pending()
+            except OSError:
+                # батч остался в очереди, повторим на следующем такте
+                logger.exception("Ledger: запись не удалась, повторю")
+
+    def _flush_pending(self) -> None:
+        with self._io_lock:
+            with self._cond:
+                if not self._pending:
+                    return
+                lines, self._pending = self._pending, []
+                last_seq = self._seq
+                balances = None
+                if self._since_snapshot + len(lines) >= self.snapshot_every:
+                    balances = dict(self._balances)
+            data = ("\n".join(lines) + "\n").encode("utf-8")
+            try:
+                self.root.mkdir(parents=True, exist_ok=True)
+                with self.log_path.open("ab") as f:
+                    if f.tell() > self._offset:
+                        # остаток прошлой неудачной записи
+                        f.truncate(self._offset)
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+            except OSError:
+                with self._cond:
+                    self._pending[:0] = lines
+                raise
+            self._offset += len(data)
+            if balances is not None:
+                try:
+                    self._write_snapshot(balances, last_seq, self._offset)
+                except OSError:
+                    # журнал уже на диске; снимок попробуем в следующий раз
+                    logger.exception("Ledger: не удалось записать снимок")
+                    balances = None
+            with self._cond:
+                self._since_snapshot = 0 if balances is not None else self._since_snapshot + len(lines)
+                self._durable_seq = last_seq
+                self._cond.notify_all()
+
+    def _write_snapshot(self, balances: Dict[str, int], seq: int, offset: int) -> None:
+        text = json.dumps({"seq": seq, "offset": offset, "balances": balances}, separators=(",", ":"))
+        fd, tmp = tempfile.mkstemp(dir=str(self.root), suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.snapshot_path)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Write pending entries now and wait until they are on disk."""
+        self._flush_pending()
+        with self._cond:
+            target = self._seq
+            return self._cond.wait_for(lambda: self._durable_seq >= target, timeout)
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        try:
+            self._flush_pending()
+        except OSError:
+            logger.exception("Ledger: не удалось дописать журнал при закрытии")
+        if self._thread is not None:
+            self._thread.join(timeout=5.0)
+
+    # ---- reads ----
+
+    def balance(self, uid: str) -> Optional[int]:
+        """Last balance recorded for the user, ``None`` if unknown."""
+        with self._cond:
+            return self._balances.get(str(uid))
+
+    def balances(self) -> Dict[str, int]:
+        with self._cond:
+            return dict(self._balances)
+
+    def reconcile(self, documents: Dict[str, int]) -> Dict[str, Dict[str, Optional[int]]]:
+        """Compare stored player balances with the ledger.
+
+        ``documents`` maps user id to the balance in the player file.  Returns
+        only the users whose balances disagree.
+        """
+        ledger = self.balances()
+        out: Dict[str, Dict[str, Optional[int]]] = {}
+        for uid, doc_balance in documents.items():
+            led = ledger.get(str(uid))
+            if led is not None and led != doc_balance:
+                out[str(uid)] = {"ledger": led, "document": doc_balance}
+        return out
+
+
+_LEDGER: Optional[Ledger] = None
+_LEDGER_LOCK = threading.Lock()
+
+
+def get_ledger() -> Ledger:
+    """Return the process-wide ledger, replaying it on first use.
+
+    The bot calls this from ``startup.prewarm``, so the replay happens in the
+    background at startup rather than inside a handler.
+    """
+    global _LEDGER
+    if _LEDGER is None:
+        with _LEDGER_LOCK:
+            if _LEDGER is None:
+                _LEDGER = Ledger()
+                atexit.register(_LEDGER.close)
+    return _LEDGER
+
+
+def record(uid: str, kind: str, delta: int, balance: int, ref: Optional[str] = None) -> int:
+    return get_ledger().append(uid, kind, delta, balance, ref)
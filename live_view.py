@@ -0,0 +1,183 @@
+"""Live race view: one message per chat, edited in place.
+
+Instead of a new message for every segment, tick and penalty, a race in
+``live`` mode shows a single status message per chat and keeps editing it.
+:class:`LiveStandings` folds race events into the current lap, segment,
+speed, gap to the leader and incident count of every driver, and
+:class:`LiveMessage` debounces the edits so a chat sees at most one per
+``LIVE_EDIT_INTERVAL_S``.  Final results still go out as new messages.
+
+``RACE_VIEW=feed`` restores the old one-message-per-event output.
+"""
+
+import asyncio
+import html
+import logging
+import os
+from typing import Callable, Dict, List, Optional, Tuple
+
+from telegram.constants import ParseMode
+
+from outbox import PRIORITY_EVENT, PRIORITY_TICK, Outbox
+
+logger = logging.getLogger("racing-bot")
+
+RACE_VIEW = os.getenv("RACE_VIEW", "live")
+LIVE_EDIT_INTERVAL_S = float(os.getenv("LIVE_EDIT_INTERVAL_S", "3.0"))
+
+
+def live_mode() -> bool:
+    return RACE_VIEW == "live"
+
+
+class LiveStandings:
+    """Running order during a race, updated from (replayed) events."""
+
+    def __init__(self, players: List[Dict]):
+        self.names = {p["user_id"]: p["name"] for p in players}
+        self.progress: Dict[str, Tuple[int, int]] = {uid: (0, 0) for uid in self.names}
+        self.finish: Dict[str, float] = {}
+        self.last_seen: Dict[str, float] = {uid: 0.0 for uid in self.names}
+        self.segment: Dict[str, str] = {}
+        self.speed: Dict[str, float] = {}
+        self.incidents: Dict[str, int] = {uid: 0 for uid in self.names}
+        self.gap: Dict[str, float] = {uid: 0.0 for uid in self.names}
+        self.laps = 0
+        # время, когда первый пилот прошёл отметку (круг, участок)
+        self._arrivals: Dict[Tuple, float] = {}
+
+    def _arrive(self, uid: str, mark: Tuple, time_s: float) -> None:
+        first = self._arrivals.setdefault(mark, time_s)
+        self.gap[uid] = time_s - first
+
+    def update(self, evt: Dict) -> None:
+        uid = evt["user_id"]
+        etype = evt.get("type")
+        if etype in ("segment_change", "segment_tick"):
+            progress = (evt["lap"], evt["segment_id"])
+            if progress != self.progress.get(uid):
+                self._arrive(uid, progress, evt["time_s"])
+            self.progress[uid] = progress
+            self.segment[uid] = evt["segment"]
+            self.speed[uid] = evt["speed"]
+            self.laps = max(self.laps, evt.get("laps", 0))
+        elif etype == "lap_complete":
+            self.progress[uid] = (evt["lap"] + 1, 0)
+            self._arrive(uid, self.progress[uid], evt["time_s"])
+        elif etype == "race_complete":
+            self.finish[uid] = evt["time_s"]
+            self._arrive(uid, ("finish",), evt["time_s"])
+        elif etype == "penalty":
+            self.incidents[uid] = self.incidents.get(uid, 0) + 1
+        if "time_s" in evt:
+            self.last_seen[uid] = evt["time_s"]
+
+    def order(self) -> List[str]:
+        def key(uid: str):
+            if uid in self.finish:
+                return (0, self.finish[uid], 0, 0)
+            lap, seg = self.progress.get(uid, (0, 0))
+            return (1, -lap, -seg, self.last_seen.get(uid, 0.0))
+
+        return sorted(self.names, key=key)
+
+    def text(self) -> str:
+        lines = ["📊 Позиции:"]
+        for pos, uid in enumerate(self.order(), 1):
+            if uid in self.finish:
+                state = f"финиш {self.finish[uid]:.2f}s"
+            else:
+                lap, seg = self.progress.get(uid, (0, 0))
+                state = f"круг {max(lap, 1)}, участок {max(seg, 1)}"
+            lines.append(f"{pos}. {html.escape(self.names[uid])} — {state}")
+        return "\n".join(lines)
+
+    def board(self, title: str) -> str:
+        """Detailed view for the live message."""
+        lines = [f"<b>{html.escape(title)}</b>"]
+        for pos, uid in enumerate(self.order(), 1):
+            if uid in self.finish:
+                parts = [f"🏁 {self.finish[uid]:.2f}s"]
+            else:
+                lap, _ = self.progress.get(uid, (0, 0))
+                laps = f"/{self.laps}" if self.laps else ""
+                parts = [
+                    f"круг {max(lap, 1)}{laps}, {html.escape(self.segment.get(uid, 'старт'))}",
+                    f"🚀{self.speed.get(uid, 0.0):.0f} км/ч",
+                    f"⏱{self.last_seen.get(uid, 0.0):.1f}s",
+                ]
+            gap = self.gap.get(uid, 0.0)
+            if pos > 1 and gap > 0.005:
+                parts.append(f"+{gap:.2f}s")
+            if self.incidents.get(uid):
+                parts.append(f"⚠️{self.incidents[uid]}")
+            lines.append(f"{pos}. {html.escape(self.names[uid])} — " + " · ".join(parts))
+        return "\n".join(lines)
+
+
+class LiveMessage:
+    """A chat message that follows ``render()`` with debounced edits.
+
+    The message is sent on the first :meth:`touch`; later touches mark it
+    dirty and at most one edit per ``interval`` is queued in the outbox.
+    :meth:`close` pushes the final state right away.
+    """
+
+    def __init__(self, outbox: Outbox, chat_id, render: Callable[[], str], interval: float = LIVE_EDIT_INTERVAL_S):
+        self.outbox = outbox
+        self.chat_id = chat_id
+        self.render = render
+        self.interval = interval
+        self.message_id: Optional[int] = None
+        self.edits = 0
+        self._last = ""
+        self._task: Optional[asyncio.Task] = None
+        self._dirty = asyncio.Event()
+        self._closing = asyncio.Event()
+
+    def touch(self) -> None:
+        self._dirty.set()
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def close(self) -> None:
+        self._closing.set()
+        self._dirty.set()
+        if self._task is not None:
+            await self._task
+
+    async def _run(self) -> None:
+        text = self.render()
+        try:
+            msg = await self.outbox.send(self.chat_id, text, priority=PRIORITY_EVENT, parse_mode=ParseMode.HTML)
+        except Exception:
+            return
+        self.message_id = getattr(msg, "message_id", None)
+        if self.message_id is None:
+            return
+        self._last = text
+        while True:
+            await self._dirty.wait()
+            if not self._closing.is_set():
+                # копим обновления, пока не пройдёт интервал
+                try:
+                    await asyncio.wait_for(self._closing.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+            self._dirty.clear()
+            await self._flush()
+            if self._closing.is_set():
+                return
+
+    async def _flush(self) -> None:
+        text = self.render()
+        if text == self._last:
+            return
+        self._last = text
+        try:
+            await self.outbox.edit(
+                self.chat_id, self.message_id, text, priority=PRIORITY_TICK, parse_mode=ParseMode.HTML
+            )
+            self.edits += 1
+        except Exception:
+            logger.warning("Live view edit in %s failed", self.chat_id, exc_info=True)
@@ -0,0 +1,280 @@
+"""End-to-end load test against :mod:`fake_bot_api`.
+
+Simulated users go through the bot the way people do:
+``/start`` → catalog → buy the first car offered → track list → pick a
+track → ``/race`` → a one-player lobby race.  Each step pushes an update
+into the fake Bot API and waits for the bot's answer in that chat, so the
+reported latency is the full path: ``getUpdates``, handlers, persistence,
+the outbox and the rate-limited ``sendMessage``.  Users pause about
+``--think`` seconds between steps, as people do; with no pause they trip
+the per-chat flood limit themselves.
+
+Spawn a bot against a throwaway data directory and run 1000 users arriving
+over a minute::
+
+    python loadtest_bot.py --spawn-bot --users 1000 --ramp 60
+
+or start the bot yourself with ``BOT_API_URL=http://127.0.0.1:8081/bot``
+and ``BOT_TOKEN=123:test`` and pass ``--port 8081``.  Races are paced in real
+time, so ``--flow start,catalog,buy,tracks,settrack`` gives a quick run
+without them.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from fake_bot_api import FakeBotAPI
+from loadtest_webhook import make_update
+
+FLOW = ("start", "catalog", "buy", "tracks", "settrack", "race", "lobby")
+_LOBBY_ID = re.compile(r"Лобби <code>([^<]+)</code>")
+
+
+class StepFailed(Exception):
+    pass
+
+
+def _buttons(evt: Dict, prefix: str) -> List[str]:
+    rows = (evt.get("reply_markup") or {}).get("inline_keyboard", [])
+    return [b["callback_data"] for row in rows for b in row if b.get("callback_data", "").startswith(prefix)]
+
+
+class SimUser:
+    def __init__(self, api: FakeBotAPI, uid: int, timeout: float, race_timeout: float, think_s: float = 0.0):
+        self.api = api
+        self.think_s = think_s
+        self.uid = uid
+        self.timeout = timeout
+        self.race_timeout = race_timeout
+        self.inbox = api.subscribe(uid)
+        self.latencies: Dict[str, float] = {}
+
+    async def ask(
+        self,
+        until: Callable[[Dict], bool],
+        text: Optional[str] = None,
+        data: Optional[str] = None,
+        timeout: Optional[float] = None,
+    ) -> Tuple[float, Dict]:
+        """Send a command or press a button; wait for a matching reply."""
+        while not self.inbox.empty():
+            self.inbox.get_nowait()
+        started = time.monotonic()
+        self.api.push_update(make_update(0, self.uid, text, data))
+        deadline = started + (timeout or self.timeout)
+        while True:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                raise StepFailed("timeout")
+            try:
+                evt = await asyncio.wait_for(self.inbox.get(), left)
+            except asyncio.TimeoutError:
+                raise StepFailed("timeout") from None
+            if evt["kind"] == "send" and evt["text"].startswith("❌"):
+                raise StepFailed(evt["text"][:80])
+            if until(evt):
+                return evt["at"] - started, evt
+
+    async def run(self, flow: List[str]) -> None:
+        car = track = None
+        sends = lambda evt: evt["kind"] == "send"
+        for i, step in enumerate(flow):
+            if i and self.think_s:
+                # живой пользователь не жмёт кнопки чаще лимита чата
+                await asyncio.sleep(random.uniform(0.5, 1.5) * self.think_s)
+            if step == "start":
+                lat, _ = await self.ask(sends, "/start")
+            elif step == "catalog":
+                lat, evt = await self.ask(lambda e: sends(e) and bool(_buttons(e, "buy:")), data="nav:catalog")
+                car = _buttons(evt, "buy:")[0]
+            elif step == "buy":
+                lat, evt = await self.ask(lambda e: sends(e) and e["text"][:1] in "✅💸🚫", data=car or "buy:?")
+                if not evt["text"].startswith("✅"):
+                    raise StepFailed(evt["text"][:80])
+            elif step == "tracks":
+                lat, evt = await self.ask(lambda e: sends(e) and bool(_buttons(e, "settrack:")), data="nav:tracks")
+                track = _buttons(evt, "settrack:")[0]
+            elif step == "settrack":
+                lat, _ = await self.ask(lambda e: sends(e) and "трасса" in e["text"], data=track or "settrack:?")
+            elif step == "race":
+                lat, _ = await self.ask(
+                    lambda e: sends(e) and "Итог" in e["text"], "/race", timeout=self.race_timeout
+                )
+            elif step == "lobby":
+                tid = (track or "settrack:").split(":", 1)[1]
+                lat, evt = await self.ask(lambda e: sends(e) and "создано" in e["text"], f"/lobby_create {tid}")
+                m = _LOBBY_ID.search(evt["text"])
+                if not m:
+                    raise StepFailed("no lobby id")
+                lid = m.group(1)
+                await self.ask(lambda e: sends(e) and f"Лобби {lid}" in e["text"], f"/lobby_join {lid}")
+                lat2, _ = await self.ask(
+                    lambda e: sends(e) and "Результаты лобби" in e["text"],
+                    f"/lobby_start {lid}",
+                    timeout=self.race_timeout,
+                )
+                lat += lat2
+            else:
+                raise ValueError(f"unknown step {step}")
+            self.latencies[step] = lat
+
+    def close(self) -> None:
+        self.api.unsubscribe(self.uid, self.inbox)
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+async def run_users(
+    api: FakeBotAPI,
+    users: int,
+    flow: List[str],
+    ramp_s: float = 0.0,
+    think_s: float = 1.0,
+    timeout: float = 30.0,
+    race_timeout: float = 900.0,
+    first_user: int = 20_000_000,
+    seed: int = 0,
+) -> Dict:
+    rnd = random.Random(seed)
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+    done = 0
+
+    async def one(uid: int) -> None:
+        nonlocal done
+        await asyncio.sleep(rnd.uniform(0, ramp_s) if ramp_s else 0)
+        user = SimUser(api, uid, timeout, race_timeout, think_s)
+        try:
+            await user.run(flow)
+            done += 1
+        except StepFailed as e:
+            step = flow[len(user.latencies)]
+            errors[step][str(e)] += 1
+        finally:
+            user.close()
+            for step, lat in user.latencies.items():
+                latencies[step].append(lat)
+
+    started = time.monotonic()
+    await asyncio.gather(*(one(first_user + i) for i in range(users)))
+    elapsed = time.monotonic() - started
+
+    steps = {}
+    for step in flow:
+        vals = sorted(latencies.get(step, []))
+        steps[step] = {
+            "ok": len(vals),
+            "errors": dict(errors.get(step, {})),
+            "p50_ms": round(_percentile(vals, 0.50) * 1000, 1),
+            "p95_ms": round(_percentile(vals, 0.95) * 1000, 1),
+            "p99_ms": round(_percentile(vals, 0.99) * 1000, 1),
+            "max_ms": round(vals[-1] * 1000, 1) if vals else 0.0,
+        }
+    return {
+        "users": users,
+        "completed": done,
+        "elapsed_s": round(elapsed, 1),
+        "steps": steps,
+        "api": api.stats(),
+    }
+
+
+def _spawn_bot(port: int) -> Tuple[subprocess.Popen, str]:
+    """Run ``run.py`` against the fake API with a throwaway data directory."""
+    root = Path(__file__).resolve().parent
+    data = tempfile.mkdtemp(prefix="loadtest-data-")
+    for sub in ("cars", "tracks"):
+        os.symlink(root / "data" / sub, Path(data) / sub)
+    env = dict(
+        os.environ,
+        BOT_TOKEN="123456:loadtest",
+        BOT_API_URL=f"http://127.0.0.1:{port}/bot",
+        BOT_MODE="polling",
+        GAME_DATA_DIR=data,
+    )
+    proc = subprocess.Popen([sys.executable, str(root / "run.py")], cwd=str(root), env=env)
+    return proc, data
+
+
+async def _main(args: argparse.Namespace) -> Dict:
+    api = FakeBotAPI(
+        chat_rate=args.chat_rate,
+        chat_burst=args.chat_burst,
+        global_rate=args.global_rate,
+        global_burst=args.global_rate,
+        latency_s=args.api_latency_ms / 1000.0,
+    )
+    port = await api.start(port=args.port)
+    proc = data = None
+    if args.spawn_bot:
+        proc, data = _spawn_bot(port)
+    try:
+        # бот готов, когда начал опрашивать getUpdates
+        deadline = time.monotonic() + args.startup_timeout
+        while not api.calls["getUpdates"]:
+            if time.monotonic() > deadline or (proc is not None and proc.poll() is not None):
+                raise SystemExit("Бот не подключился к fake Bot API")
+            await asyncio.sleep(0.1)
+        flow = [s for s in args.flow.split(",") if s]
+        return await run_users(
+            api,
+            args.users,
+            flow,
+            ramp_s=args.ramp,
+            think_s=args.think,
+            timeout=args.timeout,
+            race_timeout=args.race_timeout,
+        )
+    finally:
+        if proc is not None:
+            proc.terminate()
+            # ждём не блокируя цикл: боту при остановке ещё нужен fake API
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, proc.wait, 30)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        if data is not None:
+            shutil.rmtree(data, ignore_errors=True)
+        await api.stop()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--users", type=int, default=100)
+    ap.add_argument("--ramp", type=float, default=10.0, help="seconds over which users arrive")
+    ap.add_argument("--think", type=float, default=1.0, help="mean pause between a user's steps")
+    ap.add_argument("--flow", default=",".join(FLOW))
+    ap.add_argument("--port", type=int, default=0, help="fake Bot API port (0 = any free port)")
+    ap.add_argument("--spawn-bot", action="store_true", help="start run.py against the fake API")
+    ap.add_argument("--timeout", type=float, default=30.0, help="per-step timeout")
+    ap.add_argument("--race-timeout", type=float, default=900.0)
+    ap.add_argument("--startup-timeout", type=float, default=60.0)
+    ap.add_argument("--chat-rate", type=float, default=1.0)
+    ap.add_argument("--chat-burst", type=float, default=3.0)
+    ap.add_argument("--global-rate", type=float, default=30.0)
+    ap.add_argument("--api-latency-ms", type=float, default=0.0, help="added to every API call")
+    args = ap.parse_args(argv)
+    if not args.spawn_bot and not args.port:
+        ap.error("без --spawn-bot укажи --port, на который настроен BOT_API_URL бота")
+    report = asyncio.run(_main(args))
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""Post synthetic Telegram updates to a local webhook and report latency.
+
+Start a local Bot API and the bot in webhook mode first, e.g.::
+
+    python fake_bot_api.py --port 8081
+    BOT_MODE=webhook WEBHOOK_SECRET=s3cret BOT_API_URL=http://127.0.0.1:8081/bot python run.py
+
+then run::
+
+    python loadtest_webhook.py --users 500 --updates 20000 --concurrency 200 --secret s3cret
+
+Every simulated user sends a mix of commands and button presses, and each
+user's updates are posted in order.  The report shows throughput and
+acknowledgement latency.  The bot acknowledges an update as soon as it is
+queued, so the handlers' own latency shows up in the bot logs rather than
+here.  Replies still go to the configured Bot API server.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+import httpx
+
+# (текст команды или None, данные кнопки или None)
+DEFAULT_MIX = [
+    ("/garage", None),
+    ("/catalog", None),
+    ("/driver", None),
+    ("/help", None),
+    (None, "nav:garage"),
+    (None, "nav:catalog"),
+    (None, "cat_tier:club"),
+    (None, "nav:tracks"),
+]
+
+
+def _user(user_id: int) -> Dict:
+    return {"id": user_id, "is_bot": False, "first_name": f"Load {user_id}"}
+
+
+def make_update(update_id: int, user_id: int, text: Optional[str] = None, data: Optional[str] = None) -> Dict:
+    """Build a private-chat message update, or a callback query if ``data``."""
+    now = int(time.time())
+    chat = {"id": user_id, "type": "private"}
+    if data is None:
+        msg = {
+            "message_id": update_id,
+            "date": now,
+            "chat": chat,
+            "from": _user(user_id),
+            "text": text,
+        }
+        if text and text.startswith("/"):
+            msg["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"update_id": update_id, "message": msg}
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": _user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": update_id,
+                "date": now,
+                "chat": chat,
+                "from": {"id": 1, "is_bot": True, "first_name": "Bot"},
+                "text": "…",
+            },
+        },
+    }
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+async def run_load(
+    url: str,
+    users: int,
+    updates: int,
+    concurrency: int,
+    secret: Optional[str] = None,
+    first_user: int = 10_000_000,
+    seed: int = 0,
+) -> Dict:
+    rnd = random.Random(seed)
+    # обновления раскладываются по пользователям; внутри пользователя порядок сохраняется
+    per_user: Dict[int, List[Dict]] = {first_user + i: [] for i in range(users)}
+    ids = itertools.count(1)
+    uids = list(per_user)
+    for _ in range(updates):
+        uid = rnd.choice(uids)
+        text, data = rnd.choice(DEFAULT_MIX)
+        per_user[uid].append(make_update(next(ids), uid, text, data))
+
+    headers = {"Content-Type": "application/json"}
+    if secret:
+        headers["X-Telegram-Bot-Api-Secret-Token"] = secret
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+    slots = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(limits=limits, timeout=30.0) as client:
+
+        async def user_session(batch: List[Dict]) -> None:
+            for upd in batch:
+                async with slots:
+                    t0 = time.perf_counter()
+                    try:
+                        resp = await client.post(url, content=json.dumps(upd), headers=headers)
+                        statuses[resp.status_code] += 1
+                    except httpx.HTTPError as e:
+                        statuses[type(e).__name__] += 1
+                        continue
+                    latencies.append(time.perf_counter() - t0)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(user_session(b) for b in per_user.values() if b))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "updates": updates,
+        "users": users,
+        "concurrency": concurrency,
+        "elapsed_s": round(elapsed, 3),
+        "rps": round(updates / elapsed, 1) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(_percentile(latencies, 0.50) * 1000, 2),
+            "p95": round(_percentile(latencies, 0.95) * 1000, 2),
+            "p99": round(_percentile(latencies, 0.99) * 1000, 2),
+            "max": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+        },
+        "statuses": {str(k): v for k, v in statuses.items()},
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--url", default="http://127.0.0.1:8443/telegram")
+    ap.add_argument("--users", type=int, default=100)
+    ap.add_argument("--updates", type=int, default=5000)
+    ap.add_argument("--concurrency", type=int, default=100)
+    ap.add_argument("--secret", default=None, help="WEBHOOK_SECRET of the bot")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args(argv)
+    report = asyncio.run(
+        run_load(args.url, args.users, args.updates, args.concurrency, secret=args.secret, seed=args.seed)
+    )
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,213 @@
+import asyncio
+import heapq
+import itertools
+import os
+import threading
 import time
 import uuid
-from collections import defaultdict
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from threading import Barrier
+from pathlib import Path
 from typing import Dict, List, Optional, Callable
 
-from game_api import run_player_race
+from event_throttle import EventThrottle
+from game_api import run_player_race_async
+from race_service import get_race_service
 
-# Простые лобби в памяти процесса
-LOBBIES: Dict[str, Dict] = {}
 MAX_PLAYERS = 8
+# Время жизни лобби, таймаут бездействия и задержка закрытия после гонки
+LOBBY_TTL_S = float(os.getenv("LOBBY_TTL_S", "3600"))
+LOBBY_IDLE_S = float(os.getenv("LOBBY_IDLE_S", "900"))
+LOBBY_POST_RACE_S = float(os.getenv("LOBBY_POST_RACE_S", "60"))
+# memory — лобби живут в процессе; sqlite — общий файл для нескольких воркеров бота
+LOBBY_BACKEND = os.getenv("LOBBY_BACKEND", "memory")
+LOBBY_DB = Path(os.getenv("LOBBY_DB", str(Path(os.getenv("GAME_DATA_DIR", "./data")) / "lobbies.sqlite3")))
+LOBBY_POLL_S = float(os.getenv("LOBBY_POLL_S", "0.5"))
+
+
+class LobbyRegistry:
+    """Thread-safe in-memory lobby storage.
+
+    Lobbies are mutated both from the asyncio loop and from executor
+    threads, so every change happens under one lock.  A ``user_id -> lobby_id``
+    index makes membership lookups O(1), and players are kept in an
+    insertion-ordered dict so the first one stays the host.  Readers get
+    snapshot copies that are safe to render without holding the lock.
+
+    Each lobby also tracks when it was created and last touched; listeners
+    registered with :meth:`add_listener` are told about every change so an
+    expiry scheduler can re-check the lobby's deadline.
+    """
+
+    # Часы для дедлайнов; общий бэкенд между процессами использует time.time
+    clock = staticmethod(time.monotonic)
+
+    def __init__(self) -> None:
+        self._lock = threading.RLock()
+        self._lobbies: Dict[str, Dict] = {}
+        self._user_lobby: Dict[str, str] = {}
+        self._listeners: List[Callable[[str], None]] = []
+
+    def add_listener(self, fn: Callable[[str], None]) -> None:
+        self._listeners.append(fn)
+
+    def _changed(self, lobby_id: str) -> None:
+        for fn in self._listeners:
+            try:
+                fn(lobby_id)
+            except Exception:
+                pass
+
+    @staticmethod
+    def _snapshot(lobby: Dict) -> Dict:
+        return {
+            "track_id": lobby["track_id"],
+            "players": [dict(p) for p in lobby["players"].values()],
+        }
+
+    def create(self, track_id: str) -> str:
+        with self._lock:
+            lid = uuid.uuid4().hex[:6]
+            while lid in self._lobbies:
+                lid = uuid.uuid4().hex[:6]
+            now = self.clock()
+            self._lobbies[lid] = {
+                "track_id": track_id,
+                "players": {},
+                "created": now,
+                "active": now,
+                "racing": False,
+                "closes_at": None,
+            }
+        self._changed(lid)
+        return lid
+
+    def expires_at(self, lobby_id: str) -> Optional[float]:
+        """Monotonic deadline of the lobby, ``None`` if it no longer exists.
+
+        While a race is running only the hard TTL applies.
+        """
+        with self._lock:
+            lobby = self._lobbies.get(lobby_id)
+            if not lobby:
+                return None
+            deadline = lobby["created"] + LOBBY_TTL_S
+            if not lobby["racing"]:
+                deadline = min(deadline, lobby["active"] + LOBBY_IDLE_S)
+                if lobby["closes_at"] is not None:
+                    deadline = min(deadline, lobby["closes_at"])
+            return deadline
+
+    def set_racing(self, lobby_id: str, racing: bool) -> None:
+        with self._lock:
+            lobby = self._lobbies.get(lobby_id)
+            if not lobby:
+                raise RuntimeError("Лобби не найдено")
+            if racing and lobby["racing"]:
+                raise RuntimeError("Гонка в этом лобби уже идёт")
+            lobby["racing"] = racing
+            lobby["active"] = self.clock()
+        self._changed(lobby_id)
+
+    def close_after(self, lobby_id: str, delay: float) -> None:
+        """Schedule the lobby to close ``delay`` seconds from now."""
+        with self._lock:
+            lobby = self._lobbies.get(lobby_id)
+            if not lobby:
+                return
+            lobby["closes_at"] = self.clock() + delay
+        self._changed(lobby_id)
+
+    def close(self, lobby_id: str) -> Optional[Dict]:
+        """Remove the lobby with all its players and return its last snapshot."""
+        with self._lock:
+            lobby = self._lobbies.pop(lobby_id, None)
+            if not lobby:
+                return None
+            for uid in lobby["players"]:
+                if self._user_lobby.get(uid) == lobby_id:
+                    del self._user_lobby[uid]
+            return self._snapshot(lobby)
+
+    def get(self, lobby_id: str, default: Optional[Dict] = None) -> Optional[Dict]:
+        """Return a snapshot of the lobby or ``default``."""
+        with self._lock:
+            lobby = self._lobbies.get(lobby_id)
+            return self._snapshot(lobby) if lobby else default
+
+    def __getitem__(self, lobby_id: str) -> Dict:
+        lobby = self.get(lobby_id)
+        if lobby is None:
+            raise KeyError(lobby_id)
+        return lobby
+
+    def snapshot(self) -> Dict[str, Dict]:
+        with self._lock:
+            return {lid: self._snapshot(lobby) for lid, lobby in self._lobbies.items()}
+
+    def find_user(self, user_id: str) -> Optional[str]:
+        with self._lock:
+            return self._user_lobby.get(user_id)
+
+    def join(self, lobby_id: str, player: Dict) -> None:
+        uid = player["user_id"]
+        with self._lock:
+            lobby = self._lobbies.get(lobby_id)
+            if not lobby:
+                raise RuntimeError("Лобби не найдено")
+            other = self._user_lobby.get(uid)
+            if other and other != lobby_id:
+                raise RuntimeError(f"Сначала выйди из лобби {other}")
+            if uid in lobby["players"]:
+                return
+            if len(lobby["players"]) >= MAX_PLAYERS:
+                raise RuntimeError(f"Лобби заполнено (макс {MAX_PLAYERS})")
+            lobby["players"][uid] = dict(player)
+            lobby["active"] = self.clock()
+            self._user_lobby[uid] = lobby_id
+        self._changed(lobby_id)
+
+    def leave(self, lobby_id: str, user_id: str) -> None:
+        with self._lock:
+            lobby = self._lobbies.get(lobby_id)
+            if not lobby:
+                return
+            if lobby["players"].pop(user_id, None) is not None:
+                lobby["active"] = self.clock()
+                if self._user_lobby.get(user_id) == lobby_id:
+                    del self._user_lobby[user_id]
+            if not lobby["players"]:
+                del self._lobbies[lobby_id]
+        self._changed(lobby_id)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._lobbies.clear()
+            self._user_lobby.clear()
+
+    def __contains__(self, lobby_id: object) -> bool:
+        with self._lock:
+            return lobby_id in self._lobbies
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._lobbies)
+
+
+def _make_registry():
+    if LOBBY_BACKEND == "sqlite":
+        from lobby_store import SqliteLobbyRegistry
+
+        return SqliteLobbyRegistry(
+            LOBBY_DB,
+            max_players=MAX_PLAYERS,
+            ttl_s=LOBBY_TTL_S,
+            idle_s=LOBBY_IDLE_S,
+            poll_s=LOBBY_POLL_S,
+        )
+    return LobbyRegistry()
+
+
+# Реестр лобби: в памяти процесса или общий SQLite (LOBBY_BACKEND)
+LOBBIES = _make_registry()
 
 
 def reset_lobbies() -> None:
@@ -23,17 +221,22 @@ def reset_lobbies() -> None:
 
 def create_lobby(track_id: str) -> str:
     """Создать лобби и вернуть его ID."""
-    lid = uuid.uuid4().hex[:6]
-    LOBBIES[lid] = {"track_id": track_id, "players": []}
-    return lid
+    return LOBBIES.create(track_id)
+
+
+def get_lobby(lobby_id: str) -> Optional[Dict]:
+    """Вернуть снимок лобби (копию) или ``None``."""
+    return LOBBIES.get(lobby_id)
+
+
+def close_lobby(lobby_id: str) -> Optional[Dict]:
+    """Закрыть лобби целиком и вернуть его последний снимок."""
+    return LOBBIES.close(lobby_id)
 
 
 def find_user_lobby(user_id: str) -> Optional[str]:
     """Вернуть ID лобби, в котором состоит пользователь, если есть."""
-    for lid, info in LOBBIES.items():
-        if any(p["user_id"] == user_id for p in info["players"]):
-            return lid
-    return None
+    return LOBBIES.find_user(user_id)
 
 
 def join_lobby(
@@ -46,43 +249,33 @@ def join_lobby(
     power: float = 0.0,
     car: str = "",
 ) -> None:
-    lobby = LOBBIES.get(lobby_id)
-    if not lobby:
-        raise RuntimeError("Лобби не найдено")
-
-    other = find_user_lobby(user_id)
-    if other and other != lobby_id:
-        raise RuntimeError(f"Сначала выйди из лобби {other}")
-
-    if len(lobby["players"]) >= MAX_PLAYERS:
-        raise RuntimeError("Лобби заполнено (макс 8)")
-    if user_id not in [p["user_id"] for p in lobby["players"]]:
-        lobby["players"].append(
-            {
-                "user_id": user_id,
-                "name": name,
-                "chat_id": chat_id,
-                "mass": mass,
-                "power": power,
-                "car": car,
-            }
-        )
+    LOBBIES.join(
+        lobby_id,
+        {
+            "user_id": user_id,
+            "name": name,
+            "chat_id": chat_id,
+            "mass": mass,
+            "power": power,
+            "car": car,
+        },
+    )
 
 
 def leave_lobby(lobby_id: str, user_id: str) -> None:
-    lobby = LOBBIES.get(lobby_id)
-    if not lobby:
-        return
-    lobby["players"] = [p for p in lobby["players"] if p["user_id"] != user_id]
-    if not lobby["players"]:
-        del LOBBIES[lobby_id]
+    LOBBIES.leave(lobby_id, user_id)
 
 
-_last_tick: Dict[str, float] = defaultdict(float)
+# консольный лог: тики не чаще раза в EVENT_TICK_INTERVAL_S на гонщика
+_EVENTS = EventThrottle()
 
 
 def _log_event(evt: Dict) -> None:
-    uid = evt.get("user_id", "?")
+    for e in _EVENTS.push(evt.get("user_id", "?"), evt):
+        _print_event(e)
+
+
+def _print_event(evt: Dict) -> None:
     name = evt.get("name", "?")
     etype = evt.get("type")
     if etype == "penalty":
@@ -90,41 +283,50 @@ def _log_event(evt: Dict) -> None:
             f"🚫 {name} penalty {evt.get('severity', '')}+{evt['delta_s']:.2f}s on {evt['segment']}"
         )
     elif etype == "segment_tick":
-        now = time.time()
-        if now - _last_tick[uid] >= 20.0:
-            _last_tick[uid] = now
-            print(
-                "\n".join(
-                    [
-                        f"JustRace: {name}",
-                        f"🏎 Круг {evt['lap']}/{evt['laps']}",
-                        f"📏 Участок: {evt['segment']} (ID: {evt['segment_id']})",
-                        f"🚀 Скорость: {evt['speed']:.1f} км/ч",
-                        f"⏱ Время: {evt['time_s']:.1f} сек",
-                        f"🏁 Пройдено: {evt['distance']:.0f}/{evt['segment_length']:.0f}м",
-                    ]
-                )
+        print(
+            "\n".join(
+                [
+                    f"JustRace: {name}",
+                    f"🏎 Круг {evt['lap']}/{evt['laps']}",
+                    f"📏 Участок: {evt['segment']} (ID: {evt['segment_id']})",
+                    f"🚀 Скорость: {evt['speed']:.1f} км/ч",
+                    f"⏱ Время: {evt['time_s']:.1f} сек",
+                    f"🏁 Пройдено: {evt['distance']:.0f}/{evt['segment_length']:.0f}м",
+                ]
             )
+        )
     elif etype == "segment_change":
         print(
             f"➡️ {name}: Новый участок {evt['segment']} 🚀{evt['speed']:.1f} км/ч ⏱{evt['time_s']:.1f} сек"
         )
 
 
-def start_lobby_race(
-    lobby_id: str, laps: int = 1, *, on_event: Optional[Callable[[Dict], None]] = None
+async def _run_lobby_job(
+    players: List[Dict], track_id: str, laps: int, on_event: Optional[Callable[[Dict], None]]
 ) -> List[Dict]:
-    lobby = LOBBIES.get(lobby_id)
-    if not lobby:
-        raise RuntimeError("Лобби не найдено")
-    players = list(lobby["players"])
-    if len(players) < 2:
-        raise RuntimeError("В лобби должно быть минимум 2 игрока")
-    track_id = lobby["track_id"]
-    results: List[Dict] = []
-    barrier = Barrier(len(players))
+    """Simulate every participant on the race service.
+
+    Every driver gets a place in the service queue up front, so a busy
+    service refuses the whole race instead of some of its drivers.  All
+    drivers then race at once: each is prepared and settled in the bot
+    process and simulated in its own race worker, like a single race, so a
+    lobby takes about as long as its slowest driver while the service has
+    free workers.  Events are buffered and handed to ``on_event`` merged in
+    simulated-time order once all drivers are done.
+    """
+    service = get_race_service()
+    for admitted in range(len(players)):
+        try:
+            service.admit()
+        except BaseException:
+            for _ in range(admitted):
+                service.release()
+            raise
+    started = 0
+    pending: List = []  # (time_s, seq, notify, evt)
+    seq = itertools.count()
 
-    def _runner(p: Dict) -> Dict:
+    def _wrap(p: Dict) -> Callable[[Dict], None]:
         def wrapper(evt: Dict) -> None:
             evt = dict(evt)
             evt["user_id"] = p["user_id"]
@@ -134,18 +336,76 @@ def start_lobby_race(
             else:
                 _log_event(evt)
 
-        barrier.wait()
-        return run_player_race(
-            p["user_id"], p["name"], track_id=track_id, laps=laps, on_event=wrapper
-        )
+        return wrapper
 
-    with ThreadPoolExecutor() as pool:
-        fut_map = {pool.submit(_runner, p): p for p in players}
-        for fut in as_completed(fut_map):
-            p = fut_map[fut]
-            try:
-                res = fut.result()
-                results.append({"user_id": p["user_id"], "name": p["name"], "result": res})
-            except Exception as e:
-                results.append({"user_id": p["user_id"], "name": p["name"], "error": str(e)})
+    def _buffer(notify: Callable[[Dict], None]) -> Callable[[Dict], None]:
+        def collect(evt: Dict) -> None:
+            heapq.heappush(pending, (evt.get("time_s", 0.0), next(seq), notify, evt))
+
+        return collect
+
+    async def drive(p: Dict) -> Dict:
+        nonlocal started
+        # место в очереди переходит к гонке гонщика, даже если она упадёт
+        started += 1
+        try:
+            res = await run_player_race_async(
+                p["user_id"], p["name"], track_id=track_id, laps=laps, on_event=_buffer(_wrap(p)), admitted=True
+            )
+            return {"user_id": p["user_id"], "name": p["name"], "result": res}
+        except Exception as e:
+            return {"user_id": p["user_id"], "name": p["name"], "error": str(e)}
+
+    try:
+        results = list(await asyncio.gather(*(drive(p) for p in players)))
+    finally:
+        # при отмене не начатые гонки отдают свои места
+        for _ in range(len(players) - started):
+            service.release()
+
+    while pending:
+        _, _, notify, evt = heapq.heappop(pending)
+        notify(evt)
     return results
+
+
+async def run_lobby_race(
+    lobby_id: str, laps: int = 1, *, on_event: Optional[Callable[[Dict], None]] = None
+) -> List[Dict]:
+    """Run a lobby race on the race service and return per-driver results.
+
+    ``on_event`` is called on the event loop.  If the race fails the lobby
+    is finished right away; after a successful one the caller decides when
+    it closes with :func:`finish_lobby_race`.
+    """
+    lobby = LOBBIES.get(lobby_id)
+    if not lobby:
+        raise RuntimeError("Лобби не найдено")
+    players = lobby["players"]
+    if len(players) < 2:
+        raise RuntimeError("В лобби должно быть минимум 2 игрока")
+    LOBBIES.set_racing(lobby_id, True)
+    try:
+        return await _run_lobby_job(players, lobby["track_id"], laps, on_event)
+    except BaseException:
+        finish_lobby_race(lobby_id)
+        raise
+
+
+def finish_lobby_race(lobby_id: str, close_after: float = LOBBY_POST_RACE_S) -> None:
+    """Mark the race as over and let the lobby close after ``close_after`` s."""
+    try:
+        LOBBIES.set_racing(lobby_id, False)
+    except RuntimeError:
+        return
+    LOBBIES.close_after(lobby_id, close_after)
+
+
+def start_lobby_race(
+    lobby_id: str, laps: int = 1, *, on_event: Optional[Callable[[Dict], None]] = None
+) -> List[Dict]:
+    """Blocking wrapper around :func:`run_lobby_race` for scripts and tests."""
+    try:
+        return asyncio.run(run_lobby_race(lobby_id, laps, on_event=on_event))
+    finally:
+        finish_lobby_race(lobby_id)
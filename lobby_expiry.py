@@ -0,0 +1,97 @@
+"""Event-loop scheduler that closes stale lobbies.
+
+Deadlines live in a heap keyed by the registry's clock and a single
+``loop.call_at`` timer is armed for the earliest one.  Registry changes only
+push a new entry when they move a lobby's deadline earlier; later deadlines
+are picked up lazily when the old entry fires and the lobby turns out to be
+still alive, so a busy lobby costs one heap entry rather than one per join.
+"""
+
+import asyncio
+import heapq
+import itertools
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from lobby import LOBBIES, LobbyRegistry
+
+ExpireCallback = Callable[[str, Dict], Awaitable[None]]
+
+
+class LobbyReaper:
+    def __init__(self, registry: LobbyRegistry = LOBBIES, on_expire: Optional[ExpireCallback] = None):
+        self.registry = registry
+        self.on_expire = on_expire
+        self._heap: List[Tuple[float, int, str]] = []
+        self._scheduled: Dict[str, float] = {}
+        self._seq = itertools.count()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._timer_at = float("inf")
+
+    def attach(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Start watching the registry from ``loop``."""
+        self._loop = loop
+        self.registry.add_listener(self._on_change)
+        for lid in self.registry.snapshot():
+            self._schedule(lid)
+
+    def _on_change(self, lobby_id: str) -> None:
+        # реестр меняется и из потоков пула, поэтому переходим в цикл событий
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self._schedule(lobby_id)
+        else:
+            loop.call_soon_threadsafe(self._schedule, lobby_id)
+
+    def _schedule(self, lobby_id: str) -> None:
+        deadline = self.registry.expires_at(lobby_id)
+        if deadline is None:
+            self._scheduled.pop(lobby_id, None)
+            return
+        current = self._scheduled.get(lobby_id)
+        if current is not None and current <= deadline:
+            return
+        self._scheduled[lobby_id] = deadline
+        heapq.heappush(self._heap, (deadline, next(self._seq), lobby_id))
+        self._arm()
+
+    def _arm(self) -> None:
+        if not self._heap or self._loop is None:
+            return
+        deadline = self._heap[0][0]
+        if deadline >= self._timer_at and self._timer is not None:
+            return
+        if self._timer is not None:
+            self._timer.cancel()
+        delay = max(0.0, deadline - self.registry.clock())
+        self._timer_at = deadline
+        self._timer = self._loop.call_at(self._loop.time() + delay, self._fire)
+
+    def _fire(self) -> None:
+        self._timer = None
+        self._timer_at = float("inf")
+        now = self.registry.clock()
+        while self._heap and self._heap[0][0] <= now:
+            deadline, _, lid = heapq.heappop(self._heap)
+            if self._scheduled.get(lid) != deadline:
+                continue
+            del self._scheduled[lid]
+            actual = self.registry.expires_at(lid)
+            if actual is None:
+                continue
+            if actual > now:
+                self._schedule(lid)
+                continue
+            snapshot = self.registry.close(lid)
+            if snapshot is not None and self.on_expire is not None:
+                self._loop.create_task(self.on_expire(lid, snapshot))
+        self._arm()
+
+    def pending(self) -> int:
+        return len(self._scheduled)
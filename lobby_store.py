@@ -0,0 +1,321 @@
+"""SQLite lobby backend shared by several bot processes on one host.
+
+``SqliteLobbyRegistry`` implements the same interface as
+:class:`lobby.LobbyRegistry`, but keeps lobbies in a WAL-mode SQLite file.
+Every mutation runs in a ``BEGIN IMMEDIATE`` transaction, so capacity checks
+and the one-lobby-per-user rule hold across processes (``players.user_id``
+is the primary key).  Each change also appends a row to ``changes``; a
+poller thread watches ``PRAGMA data_version`` and forwards changes made by
+other processes to the registered listeners.  Rows this instance wrote
+itself are skipped, since their listeners were already called directly.
+
+Enable with ``LOBBY_BACKEND=sqlite`` (file path in ``LOBBY_DB``).
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS lobbies (
+    id TEXT PRIMARY KEY,
+    track_id TEXT NOT NULL,
+    created REAL NOT NULL,
+    active REAL NOT NULL,
+    racing INTEGER NOT NULL DEFAULT 0,
+    closes_at REAL
+);
+CREATE TABLE IF NOT EXISTS players (
+    user_id TEXT PRIMARY KEY,
+    lobby_id TEXT NOT NULL REFERENCES lobbies(id) ON DELETE CASCADE,
+    seq INTEGER NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS players_lobby ON players(lobby_id, seq);
+CREATE TABLE IF NOT EXISTS changes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    lobby_id TEXT NOT NULL,
+    ts REAL NOT NULL
+);
+"""
+
+# Сколько хранить журнал изменений для уведомлений других процессов
+CHANGES_KEEP_S = 3600.0
+
+
+class SqliteLobbyRegistry:
+    clock = staticmethod(time.time)
+
+    def __init__(
+        self,
+        path: Path,
+        *,
+        max_players: int,
+        ttl_s: float,
+        idle_s: float,
+        poll_s: float = 0.5,
+    ):
+        self.path = Path(path)
+        self.max_players = max_players
+        self.ttl_s = ttl_s
+        self.idle_s = idle_s
+        self.poll_s = poll_s
+        self._local = threading.local()
+        self._listeners: List[Callable[[str], None]] = []
+        self._poller: Optional[threading.Thread] = None
+        # всё до _last_change уже разослано; _own — свои записи дальше него
+        self._change_lock = threading.Lock()
+        self._last_change = 0
+        self._own: Set[int] = set()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self._conn()
+        conn.executescript(_SCHEMA)
+        row = conn.execute("SELECT COALESCE(MAX(id), 0) FROM changes").fetchone()
+        self._last_change = row[0]
+
+    # ---- connection helpers ----
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.path), timeout=30.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _tx(self) -> Iterator[sqlite3.Connection]:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        self._local.logged = None
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        if self._local.logged is not None:
+            # только после COMMIT: id откаченной записи может достаться другому процессу
+            self._skip_own(self._local.logged)
+
+    def _log_change(self, db: sqlite3.Connection, lobby_id: str) -> None:
+        cur = db.execute("INSERT INTO changes(lobby_id, ts) VALUES (?, ?)", (lobby_id, self.clock()))
+        self._local.logged = cur.lastrowid
+
+    def _skip_own(self, rowid: int) -> None:
+        """Advance past our own change ``rowid`` so the poller does not echo it."""
+        with self._change_lock:
+            if rowid <= self._last_change:
+                return
+            if rowid != self._last_change + 1:
+                # перед ней есть чужие изменения, которые поллер ещё не видел
+                self._own.add(rowid)
+                return
+            self._last_change = rowid
+            while self._last_change + 1 in self._own:
+                self._last_change += 1
+                self._own.discard(self._last_change)
+
+    # ---- notifications ----
+
+    def add_listener(self, fn: Callable[[str], None]) -> None:
+        self._listeners.append(fn)
+        if self._poller is None:
+            self._poller = threading.Thread(target=self._poll, name="lobby-store-poll", daemon=True)
+            self._poller.start()
+
+    def _changed(self, lobby_id: str) -> None:
+        for fn in self._listeners:
+            try:
+                fn(lobby_id)
+            except Exception:
+                logger.exception("Lobby listener failed for %s", lobby_id)
+
+    def _poll(self) -> None:
+        conn = self._conn()
+        version = conn.execute("PRAGMA data_version").fetchone()[0]
+        last_prune = 0.0
+        while True:
+            time.sleep(self.poll_s)
+            try:
+                current = conn.execute("PRAGMA data_version").fetchone()[0]
+                if current == version:
+                    continue
+                version = current
+                with self._change_lock:
+                    last = self._last_change
+                rows = conn.execute(
+                    "SELECT id, lobby_id FROM changes WHERE id > ? ORDER BY id", (last,)
+                ).fetchall()
+                foreign = []
+                with self._change_lock:
+                    for cid, lid in rows:
+                        if cid <= self._last_change:
+                            continue
+                        self._last_change = cid
+                        if cid in self._own:
+                            self._own.discard(cid)
+                        elif lid not in foreign:
+                            foreign.append(lid)
+                for lid in foreign:
+                    self._changed(lid)
+                now = self.clock()
+                if now - last_prune > CHANGES_KEEP_S / 4:
+                    last_prune = now
+                    with self._tx() as db:
+                        db.execute("DELETE FROM changes WHERE ts < ?", (now - CHANGES_KEEP_S,))
+            except sqlite3.Error:
+                logger.warning("Polling lobby changes in %s failed", self.path, exc_info=True)
+                continue
+
+    # ---- reads ----
+
+    def _players(self, db: sqlite3.Connection, lobby_id: str) -> List[Dict]:
+        rows = db.execute(
+            "SELECT data FROM players WHERE lobby_id = ? ORDER BY seq", (lobby_id,)
+        ).fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    def get(self, lobby_id: str, default: Optional[Dict] = None) -> Optional[Dict]:
+        db = self._conn()
+        row = db.execute("SELECT track_id FROM lobbies WHERE id = ?", (lobby_id,)).fetchone()
+        if row is None:
+            return default
+        return {"track_id": row[0], "players": self._players(db, lobby_id)}
+
+    def __getitem__(self, lobby_id: str) -> Dict:
+        lobby = self.get(lobby_id)
+        if lobby is None:
+            raise KeyError(lobby_id)
+        return lobby
+
+    def snapshot(self) -> Dict[str, Dict]:
+        db = self._conn()
+        out: Dict[str, Dict] = {
+            lid: {"track_id": tid, "players": []}
+            for lid, tid in db.execute("SELECT id, track_id FROM lobbies")
+        }
+        for lid, data in db.execute("SELECT lobby_id, data FROM players ORDER BY lobby_id, seq"):
+            if lid in out:
+                out[lid]["players"].append(json.loads(data))
+        return out
+
+    def find_user(self, user_id: str) -> Optional[str]:
+        row = self._conn().execute("SELECT lobby_id FROM players WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] if row else None
+
+    def expires_at(self, lobby_id: str) -> Optional[float]:
+        row = self._conn().execute(
+            "SELECT created, active, racing, closes_at FROM lobbies WHERE id = ?", (lobby_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        created, active, racing, closes_at = row
+        deadline = created + self.ttl_s
+        if not racing:
+            deadline = min(deadline, active + self.idle_s)
+            if closes_at is not None:
+                deadline = min(deadline, closes_at)
+        return deadline
+
+    def __contains__(self, lobby_id: object) -> bool:
+        return self._conn().execute("SELECT 1 FROM lobbies WHERE id = ?", (lobby_id,)).fetchone() is not None
+
+    def __len__(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM lobbies").fetchone()[0]
+
+    # ---- writes ----
+
+    def create(self, track_id: str) -> str:
+        now = self.clock()
+        with self._tx() as db:
+            lid = uuid.uuid4().hex[:6]
+            while db.execute("SELECT 1 FROM lobbies WHERE id = ?", (lid,)).fetchone():
+                lid = uuid.uuid4().hex[:6]
+            db.execute(
+                "INSERT INTO lobbies(id, track_id, created, active) VALUES (?, ?, ?, ?)",
+                (lid, track_id, now, now),
+            )
+            self._log_change(db, lid)
+        self._changed(lid)
+        return lid
+
+    def join(self, lobby_id: str, player: Dict) -> None:
+        uid = player["user_id"]
+        with self._tx() as db:
+            if not db.execute("SELECT 1 FROM lobbies WHERE id = ?", (lobby_id,)).fetchone():
+                raise RuntimeError("Лобби не найдено")
+            row = db.execute("SELECT lobby_id FROM players WHERE user_id = ?", (uid,)).fetchone()
+            if row:
+                if row[0] != lobby_id:
+                    raise RuntimeError(f"Сначала выйди из лобби {row[0]}")
+                return
+            count, last = db.execute(
+                "SELECT COUNT(*), COALESCE(MAX(seq), 0) FROM players WHERE lobby_id = ?", (lobby_id,)
+            ).fetchone()
+            if count >= self.max_players:
+                raise RuntimeError(f"Лобби заполнено (макс {self.max_players})")
+            db.execute(
+                "INSERT INTO players(user_id, lobby_id, seq, data) VALUES (?, ?, ?, ?)",
+                (uid, lobby_id, last + 1, json.dumps(player, ensure_ascii=False)),
+            )
+            db.execute("UPDATE lobbies SET active = ? WHERE id = ?", (self.clock(), lobby_id))
+            self._log_change(db, lobby_id)
+        self._changed(lobby_id)
+
+    def leave(self, lobby_id: str, user_id: str) -> None:
+        with self._tx() as db:
+            cur = db.execute("DELETE FROM players WHERE lobby_id = ? AND user_id = ?", (lobby_id, user_id))
+            if cur.rowcount:
+                db.execute("UPDATE lobbies SET active = ? WHERE id = ?", (self.clock(), lobby_id))
+            left = db.execute("SELECT COUNT(*) FROM players WHERE lobby_id = ?", (lobby_id,)).fetchone()[0]
+            if not left:
+                db.execute("DELETE FROM lobbies WHERE id = ?", (lobby_id,))
+            self._log_change(db, lobby_id)
+        self._changed(lobby_id)
+
+    def set_racing(self, lobby_id: str, racing: bool) -> None:
+        with self._tx() as db:
+            row = db.execute("SELECT racing FROM lobbies WHERE id = ?", (lobby_id,)).fetchone()
+            if row is None:
+                raise RuntimeError("Лобби не найдено")
+            if racing and row[0]:
+                raise RuntimeError("Гонка в этом лобби уже идёт")
+            db.execute(
+                "UPDATE lobbies SET racing = ?, active = ? WHERE id = ?",
+                (int(racing), self.clock(), lobby_id),
+            )
+            self._log_change(db, lobby_id)
+        self._changed(lobby_id)
+
+    def close_after(self, lobby_id: str, delay: float) -> None:
+        with self._tx() as db:
+            db.execute("UPDATE lobbies SET closes_at = ? WHERE id = ?", (self.clock() + delay, lobby_id))
+            self._log_change(db, lobby_id)
+        self._changed(lobby_id)
+
+    def close(self, lobby_id: str) -> Optional[Dict]:
+        with self._tx() as db:
+            row = db.execute("SELECT track_id FROM lobbies WHERE id = ?", (lobby_id,)).fetchone()
+            if row is None:
+                return None
+            snap = {"track_id": row[0], "players": self._players(db, lobby_id)}
+            db.execute("DELETE FROM players WHERE lobby_id = ?", (lobby_id,))
+            db.execute("DELETE FROM lobbies WHERE id = ?", (lobby_id,))
+            self._log_change(db, lobby_id)
+        return snap
+
+    def clear(self) -> None:
+        with self._tx() as db:
+            db.execute("DELETE FROM players")
+            db.execute("DELETE FROM lobbies")
@@ -0,0 +1,206 @@
+"""Performance-bucketed matchmaking queue.
+
+Waiting players are grouped by ``(track_id, tier)``.  Inside a bucket they
+are kept in a list sorted by performance index, so the candidates close to a
+player are found with two ``bisect`` calls instead of a scan.  The accepted
+index window starts narrow and widens with the time since enqueue; a
+background :meth:`MatchQueue.tick` re-tries every waiting ticket so wider
+windows and partial lobbies form even when nobody new arrives.
+"""
+
+import itertools
+import os
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from lobby import MAX_PLAYERS, close_lobby, create_lobby, join_lobby
+
+MM_MIN_PLAYERS = int(os.getenv("MM_MIN_PLAYERS", "2"))
+# Сколько секунд ждать полного лобби, прежде чем собирать неполное
+MM_FILL_WAIT_S = float(os.getenv("MM_FILL_WAIT_S", "15"))
+MM_BASE_WINDOW = float(os.getenv("MM_BASE_WINDOW", "0.05"))
+MM_WIDEN_PER_S = float(os.getenv("MM_WIDEN_PER_S", "0.02"))
+MM_MAX_WINDOW = float(os.getenv("MM_MAX_WINDOW", "1.0"))
+
+
+def performance_index(power: float, mass: float, tire_grip: float) -> float:
+    """Power-to-weight (kW per tonne) scaled by tyre grip."""
+    if mass <= 0:
+        return 0.0
+    return power / mass * 1000.0 * max(tire_grip, 0.0)
+
+
+@dataclass
+class Ticket:
+    user_id: str
+    name: str
+    chat_id: str
+    track_id: str
+    tier: str
+    pi: float
+    car: str = ""
+    mass: float = 0.0
+    power: float = 0.0
+    enqueued_at: float = field(default_factory=time.monotonic)
+    seq: int = 0
+
+    @property
+    def key(self) -> Tuple[float, int, str]:
+        return (self.pi, self.seq, self.user_id)
+
+
+@dataclass
+class Match:
+    track_id: str
+    tier: str
+    tickets: List[Ticket]
+    lobby_id: Optional[str] = None
+
+
+class _Bucket:
+    def __init__(self) -> None:
+        self.order: List[Tuple[float, int, str]] = []
+        self.tickets: Dict[str, Ticket] = {}
+
+    def add(self, t: Ticket) -> None:
+        self.tickets[t.user_id] = t
+        insort(self.order, t.key)
+
+    def remove(self, uid: str) -> Optional[Ticket]:
+        t = self.tickets.pop(uid, None)
+        if t is not None:
+            i = bisect_left(self.order, t.key)
+            if i < len(self.order) and self.order[i] == t.key:
+                del self.order[i]
+        return t
+
+
+class MatchQueue:
+    def __init__(self, lobby_size: int = MAX_PLAYERS, min_players: int = MM_MIN_PLAYERS):
+        self.lobby_size = lobby_size
+        self.min_players = max(2, min(min_players, lobby_size))
+        self._lock = threading.Lock()
+        self._buckets: Dict[Tuple[str, str], _Bucket] = {}
+        self._user_bucket: Dict[str, Tuple[str, str]] = {}
+        self._seq = itertools.count()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._user_bucket)
+
+    def is_queued(self, user_id: str) -> bool:
+        with self._lock:
+            return user_id in self._user_bucket
+
+    def window(self, ticket: Ticket, now: float) -> float:
+        """Relative index tolerance after the ticket's wait so far."""
+        wait = max(0.0, now - ticket.enqueued_at)
+        return min(MM_BASE_WINDOW + MM_WIDEN_PER_S * wait, MM_MAX_WINDOW)
+
+    def enqueue(self, ticket: Ticket, now: Optional[float] = None) -> Optional[Match]:
+        """Queue a player and return a match if one forms right away."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if ticket.user_id in self._user_bucket:
+                raise RuntimeError("Ты уже в очереди подбора")
+            ticket.seq = next(self._seq)
+            ticket.enqueued_at = now
+            bucket = self._add(ticket)
+            return self._try_match(bucket, ticket, now)
+
+    def requeue(self, tickets: List[Ticket]) -> None:
+        """Put matched tickets back, keeping their place and wait time."""
+        with self._lock:
+            for t in tickets:
+                if t.user_id not in self._user_bucket:
+                    self._add(t)
+
+    def _add(self, ticket: Ticket) -> _Bucket:
+        key = (ticket.track_id, ticket.tier)
+        bucket = self._buckets.setdefault(key, _Bucket())
+        bucket.add(ticket)
+        self._user_bucket[ticket.user_id] = key
+        return bucket
+
+    def dequeue(self, user_id: str) -> bool:
+        with self._lock:
+            key = self._user_bucket.pop(user_id, None)
+            if key is None:
+                return False
+            bucket = self._buckets[key]
+            bucket.remove(user_id)
+            if not bucket.tickets:
+                del self._buckets[key]
+            return True
+
+    def _try_match(self, bucket: _Bucket, anchor: Ticket, now: float) -> Optional[Match]:
+        w = self.window(anchor, now)
+        lo = bisect_left(bucket.order, (anchor.pi * (1.0 - w),))
+        hi = bisect_right(bucket.order, (anchor.pi * (1.0 + w), float("inf")))
+        if hi - lo < self.min_players:
+            return None
+        waited = now - anchor.enqueued_at
+        if hi - lo < self.lobby_size and waited < MM_FILL_WAIT_S:
+            return None
+        if hi - lo > self.lobby_size:
+            # берём соседей, ближайших по индексу к якорю
+            i = bisect_left(bucket.order, anchor.key)
+            lo = max(lo, min(i - self.lobby_size // 2, hi - self.lobby_size))
+            hi = lo + self.lobby_size
+        picked = [bucket.tickets[uid] for _, _, uid in bucket.order[lo:hi]]
+        for t in picked:
+            bucket.remove(t.user_id)
+            self._user_bucket.pop(t.user_id, None)
+        if not bucket.tickets:
+            self._buckets.pop((anchor.track_id, anchor.tier), None)
+        return Match(anchor.track_id, anchor.tier, picked)
+
+    def tick(self, now: Optional[float] = None) -> List[Match]:
+        """Retry matching for every waiting ticket.
+
+        Each bucket is walked in arrival order, so the longest waiters anchor
+        first, and a ticket that cannot match yet does not hold back the
+        ones behind it.
+        """
+        now = time.monotonic() if now is None else now
+        matches: List[Match] = []
+        with self._lock:
+            for bucket in list(self._buckets.values()):
+                # порядок вставки в dict — порядок прихода
+                for ticket in list(bucket.tickets.values()):
+                    if ticket.user_id not in bucket.tickets:
+                        continue
+                    m = self._try_match(bucket, ticket, now)
+                    if m:
+                        matches.append(m)
+                    if not bucket.tickets:
+                        break
+        return matches
+
+
+def form_lobby(match: Match, queue: Optional[MatchQueue] = None) -> str:
+    """Create a lobby for a match and put every matched player into it.
+
+    If a player cannot join (already in another lobby, say), the lobby is
+    closed again, the error is re-raised and everyone else goes back to
+    ``queue`` with their original wait time.
+    """
+    queue = MATCH_QUEUE if queue is None else queue
+    lid = create_lobby(match.track_id)
+    for i, t in enumerate(match.tickets):
+        try:
+            join_lobby(
+                lid, t.user_id, t.name, chat_id=t.chat_id, mass=t.mass, power=t.power, car=t.car
+            )
+        except Exception:
+            close_lobby(lid)
+            queue.requeue(match.tickets[:i] + match.tickets[i + 1:])
+            raise
+    match.lobby_id = lid
+    return lid
+
+
+MATCH_QUEUE = MatchQueue()
@@ -0,0 +1,272 @@
+"""Process metrics in the Prometheus text format.
+
+Metrics are off unless one of these is set:
+
+* ``METRICS_PORT`` — serve ``/metrics`` over HTTP on ``METRICS_LISTEN``;
+* ``METRICS_FILE`` — rewrite the file every ``METRICS_DUMP_S`` seconds and
+  at exit;
+* ``METRICS=1`` — collect only, e.g. for :func:`render` in a debugger.
+
+When disabled, every ``inc``/``observe`` returns after one flag check, so
+the instrumentation can stay in hot paths.  The metrics live at module
+level below; callers import them and record values directly.  No client
+library is required.
+"""
+
+import atexit
+import os
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence, Tuple
+
+if TYPE_CHECKING:
+    from http.server import ThreadingHTTPServer
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+METRICS_FILE = os.getenv("METRICS_FILE")
+METRICS_DUMP_S = float(os.getenv("METRICS_DUMP_S", "15"))
+# Больше сочетаний меток не заводим: остальное попадает в "other"
+METRICS_MAX_SERIES = int(os.getenv("METRICS_MAX_SERIES", "200"))
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_enabled = bool(METRICS_PORT or METRICS_FILE or os.getenv("METRICS") == "1")
+_REGISTRY: List["_Metric"] = []
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def set_enabled(value: bool) -> None:
+    global _enabled
+    _enabled = value
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt(value: float) -> str:
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), max_series: int = METRICS_MAX_SERIES):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.max_series = max(1, max_series)
+        self._lock = threading.Lock()
+        self._series: Dict[Tuple[str, ...], object] = {}
+        _REGISTRY.append(self)
+
+    def _key(self, values: Sequence[object]) -> Tuple[str, ...]:
+        # вызывается под self._lock
+        key = tuple(str(v) for v in values)
+        if len(key) != len(self.labels):
+            raise ValueError(f"{self.name}: ожидаются метки {self.labels}")
+        if key not in self._series and len(self._series) >= self.max_series:
+            key = ("other",) * len(self.labels)
+        return key
+
+    def _label_str(self, key: Tuple[str, ...], extra: str = "") -> str:
+        parts = [f'{n}="{_escape(v)}"' for n, v in zip(self.labels, key)]
+        if extra:
+            parts.append(extra)
+        return "{" + ",".join(parts) + "}" if parts else ""
+
+    def reset(self) -> None:
+        with self._lock:
+            self._series.clear()
+
+    @abstractmethod
+    def render(self) -> List[str]:
+        """Exposition lines of every series, without the HELP/TYPE header."""
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels: object, amount: float = 1.0) -> None:
+        if not _enabled:
+            return
+        with self._lock:
+            key = self._key(labels)
+            self._series[key] = self._series.get(key, 0.0) + amount
+
+    def value(self, *labels: object) -> float:
+        with self._lock:
+            return float(self._series.get(tuple(str(v) for v in labels), 0.0))
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._series.items())
+        return [f"{self.name}{self._label_str(k)} {_fmt(v)}" for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+        max_series: int = METRICS_MAX_SERIES,
+    ):
+        super().__init__(name, help, labels, max_series)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels: object) -> None:
+        if not _enabled:
+            return
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            key = self._key(labels)
+            series = self._series.get(key)
+            if series is None:
+                # счётчики по корзинам (последняя — +Inf), сумма, количество
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, *labels: object) -> int:
+        with self._lock:
+            series = self._series.get(tuple(str(v) for v in labels))
+            return series[2] if series else 0
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((k, ([*s[0]], s[1], s[2])) for k, s in self._series.items())
+        out = []
+        for key, (counts, total, n) in items:
+            acc = 0
+            for bound, c in zip(self.buckets, counts):
+                acc += c
+                le = 'le="%s"' % _fmt(bound)
+                out.append(f"{self.name}_bucket{self._label_str(key, le)} {acc}")
+            le = 'le="+Inf"'
+            out.append(f"{self.name}_bucket{self._label_str(key, le)} {n}")
+            out.append(f"{self.name}_sum{self._label_str(key)} {_fmt(total)}")
+            out.append(f"{self.name}_count{self._label_str(key)} {n}")
+        return out
+
+
+def render() -> str:
+    lines = []
+    for metric in _REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def dump(path) -> None:
+    """Atomically write the current metrics to ``path``."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=str(path.parent), suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(render())
+    os.replace(tmp, path)
+
+
+def _handler():
+    # http.server тянет за собой email и прочее; нужен только с METRICS_PORT
+    from http.server import BaseHTTPRequestHandler
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            if self.path.split("?", 1)[0] not in ("/metrics", "/"):
+                self.send_error(404)
+                return
+            body = render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args) -> None:
+            pass
+
+    return Handler
+
+
+_server: Optional["ThreadingHTTPServer"] = None
+_dumper: Optional[threading.Thread] = None
+
+
+def serve(port: int, listen: str = METRICS_LISTEN) -> "ThreadingHTTPServer":
+    """Serve ``/metrics`` from a daemon thread."""
+    global _server
+    if _server is None:
+        from http.server import ThreadingHTTPServer
+
+        _server = ThreadingHTTPServer((listen, port), _handler())
+        _server.daemon_threads = True
+        threading.Thread(target=_server.serve_forever, name="metrics-http", daemon=True).start()
+    return _server
+
+
+def start() -> None:
+    """Start the exporters configured through the environment."""
+    global _dumper
+    if METRICS_PORT:
+        serve(METRICS_PORT)
+    if METRICS_FILE and _dumper is None:
+        stop = threading.Event()
+
+        def loop() -> None:
+            while not stop.wait(METRICS_DUMP_S):
+                dump(METRICS_FILE)
+
+        _dumper = threading.Thread(target=loop, name="metrics-dump", daemon=True)
+        _dumper.start()
+        atexit.register(lambda: (stop.set(), dump(METRICS_FILE)))
+
+
+# ---- метрики бота ----
+
+UPDATE_SECONDS = Histogram(
+    "bot_update_seconds", "Time spent in handlers per update.", ("kind", "name")
+)
+UPDATE_WAIT_SECONDS = Histogram(
+    "bot_update_wait_seconds", "Time an update waited for its user's previous update and a free slot."
+)
+RACE_SIM_SECONDS = Histogram(
+    "race_sim_seconds", "Wall time of one race simulation.", ("mode",)
+)
+RACE_STEPS = Histogram(
+    "race_steps", "Engine steps per simulated race.", ("mode",),
+    buckets=(100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000),
+)
+RACE_QUEUE_WAIT_SECONDS = Histogram(
+    "race_queue_wait_seconds", "Time a race waited for a scheduler slot."
+)
+PLAYER_READ_SECONDS = Histogram(
+    "player_store_read_seconds", "Time to read a player file on a cache miss."
+)
+PLAYER_WRITE_SECONDS = Histogram(
+    "player_store_write_seconds", "Time to write and fsync one player file."
+)
+PLAYER_LOOKUPS = Counter(
+    "player_store_lookups_total", "Player lookups by cache result.", ("result",)
+)
+OUTBOX_MESSAGES = Counter(
+    "outbox_messages_total", "Outgoing Telegram calls by kind and result.", ("kind", "result")
+)
+STARTUP_SECONDS = Histogram(
+    "bot_startup_seconds", "Duration of each startup and warm-up phase.", ("phase",)
+)
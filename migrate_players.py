@@ -0,0 +1,127 @@
+"""Upgrade every player file in ``USERS_DIR`` to the current schema.
+
+The directory is streamed with ``os.scandir`` and files are handed to a
+thread pool through a bounded window of in-flight jobs, so memory stays flat
+regardless of the number of players.  Files already at
+``PLAYER_SCHEMA_VERSION`` are left untouched, which makes an interrupted run
+safe to restart: the second pass only rewrites what is still outdated.
+
+Run it while the bot is stopped::
+
+    python migrate_players.py --workers 8 --report data/migration_report.json
+"""
+
+import argparse
+import json
+import os
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from economy_v1 import USERS_DIR, PLAYER_SCHEMA_VERSION, PlayerSchemaTooNew, _atomic_write, player_from_data
+
+# Сколько имён проблемных файлов сохранять в отчёте
+REPORT_SAMPLE_LIMIT = 1000
+
+
+def _iter_player_files(root: Path) -> Iterator[Path]:
+    with os.scandir(root) as it:
+        for entry in it:
+            if entry.is_file() and entry.name.endswith(".json"):
+                yield Path(entry.path)
+
+
+def migrate_file(path: Path, dry_run: bool = False) -> Tuple[str, Optional[str]]:
+    """Migrate one file and return ``(status, error)``.
+
+    ``status`` is one of ``current``, ``migrated``, ``newer`` (written by a
+    newer release, left alone), ``corrupt`` or ``error``.
+    """
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError) as e:
+        return "corrupt", str(e)
+    if not isinstance(data, dict):
+        return "corrupt", "not a JSON object"
+    if data.get("schema_version") == PLAYER_SCHEMA_VERSION:
+        return "current", None
+    try:
+        player = player_from_data(data, name=data.get("name") or path.stem)
+    except PlayerSchemaTooNew as e:
+        return "newer", str(e)
+    except Exception as e:
+        return "error", f"{type(e).__name__}: {e}"
+    if not dry_run:
+        _atomic_write(path, player.to_json())
+    return "migrated", None
+
+
+def migrate_all(
+    root: Path = USERS_DIR, workers: int = 4, dry_run: bool = False, progress_every: int = 1000
+) -> Dict:
+    """Walk ``root`` once and migrate every outdated player file."""
+    counts: Counter = Counter()
+    problems: Dict[str, List[Dict[str, str]]] = {"corrupt": [], "newer": [], "error": []}
+    started = time.time()
+    window = max(1, workers) * 4
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        inflight: Dict[Future, Path] = {}
+        next_report = [progress_every]
+
+        def _collect(done: Set[Future]) -> None:
+            for fut in done:
+                path = inflight.pop(fut)
+                try:
+                    status, err = fut.result()
+                except Exception as e:
+                    status, err = "error", f"{type(e).__name__}: {e}"
+                counts[status] += 1
+                if err and len(problems[status]) < REPORT_SAMPLE_LIMIT:
+                    problems[status].append({"file": path.name, "error": err})
+            total = sum(counts.values())
+            if progress_every and total >= next_report[0]:
+                next_report[0] = total + progress_every
+                print(f"... {total} files, {dict(counts)}")
+
+        for path in _iter_player_files(root):
+            if len(inflight) >= window:
+                done, _ = wait(inflight, return_when=FIRST_COMPLETED)
+                _collect(done)
+            inflight[pool.submit(migrate_file, path, dry_run)] = path
+        while inflight:
+            done, _ = wait(inflight, return_when=FIRST_COMPLETED)
+            _collect(done)
+    return {
+        "schema_version": PLAYER_SCHEMA_VERSION,
+        "root": str(root),
+        "dry_run": dry_run,
+        "started": started,
+        "elapsed_s": round(time.time() - started, 3),
+        "total": sum(counts.values()),
+        "counts": dict(counts),
+        "corrupt": problems["corrupt"],
+        "newer": problems["newer"],
+        "errors": problems["error"],
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Migrate player files to the current schema.")
+    ap.add_argument("--root", type=Path, default=USERS_DIR, help="directory with player files")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 4)
+    ap.add_argument("--report", type=Path, default=None, help="where to write the JSON report")
+    ap.add_argument("--dry-run", action="store_true", help="only count files that need migration")
+    args = ap.parse_args(argv)
+
+    report = migrate_all(args.root, workers=args.workers, dry_run=args.dry_run)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.report:
+        _atomic_write(args.report, text)
+    print(text)
+    return 1 if report["counts"].get("error") else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,6 +1,7 @@
 from dataclasses import dataclass, asdict
 from typing import List, Optional, Dict, Tuple, Callable
-import random, json
+from pathlib import Path
+import random, json, time
 
 from config_v2 import (
     USE_ROLLING_RESISTANCE, C_RR, K_LAT, ERROR_RATE_BASE, TIME_PENALTY_RANGE, DT_MAX,
@@ -48,6 +49,11 @@ class Track:
         self.segments = segments
         self.total_length = sum(s.length for s in segments)
 
+def load_track(path: Path) -> Track:
+    data = json.loads(path.read_text(encoding="utf-8"))
+    segs = [TrackSegment(**s) for s in data["segments"]]
+    return Track(data.get("id", path.stem), data.get("name", path.stem), segs)
+
 @dataclass
 class DriverProfile:
     id: str
@@ -113,7 +119,8 @@ class RaceEngine:
                  driver: Optional[DriverProfile] = None,
                  use_rr: bool = USE_ROLLING_RESISTANCE, c_rr: float = C_RR, k_lat: float = K_LAT,
                  seed: Optional[int] = 42,
-                 on_event: Optional[Callable[[Dict], None]] = None):
+                 on_event: Optional[Callable[[Dict], None]] = None,
+                 profile=None):
         self.car = car
         self.track = track
         self.laps = laps
@@ -128,6 +135,11 @@ class RaceEngine:
         # Время последнего события сегмента. Нужен для регулярных "тиков"
         # чтобы не зависеть от длины сегмента и не спамить сообщениями.
         self._last_seg_evt_time = 0.0
+        # для метрик: шаги и процессорное время последнего run()
+        self.steps = 0
+        self.sim_s = 0.0
+        # profiling.StackProfile; без него горячий путь не трогаем
+        self.profile = profile
 
     @property
     def current_segment(self) -> TrackSegment:
@@ -262,8 +274,21 @@ class RaceEngine:
             self._last_seg_evt_time = self.state.total_time
 
     def run(self, dt: float = 0.1):
+        if self.profile is not None:
+            # таймеры ставятся на экземпляр: step() вызывает уже обёртки
+            self.profile.instrument(self)
+            self.profile.wrap("run", self._run)(dt)
+        else:
+            self._run(dt)
+
+    def _run(self, dt: float):
+        started = time.perf_counter()
+        steps = 0
         while not self.state.is_finished:
             self.step(dt)
+            steps += 1
+        self.steps += steps
+        self.sim_s += time.perf_counter() - started
 
     def race_summary(self) -> Dict:
         km = self.track.total_length * self.laps / 1000.0
@@ -273,14 +298,14 @@ class RaceEngine:
             "incidents": self.state.incidents,
             "clean_corners": self.state.clean_corners,
             "penalties": self.state.penalties,
+            "steps": self.steps,
+            "sim_s": self.sim_s,
         }
 
-def run_race(car: Car, track: Track, laps: int, driver: DriverProfile,
-             dt: float = 0.1, seed: int = 42,
-             on_event: Optional[Callable[[Dict], None]] = None) -> Tuple[Dict, Dict[str, float]]:
-    eng = RaceEngine(car, track, laps, driver=driver, seed=seed, on_event=on_event)
-    eng.run(dt=dt)
+def finish_race(eng: RaceEngine, on_event: Optional[Callable[[Dict], None]] = None) -> Tuple[Dict, Dict[str, float]]:
+    """Summarize a finished engine and apply driver progression."""
     summary = eng.race_summary()
+    driver = eng.driver
     gains = driver.update_after_race(km_driven=summary["km"],
                                      incidents=summary["incidents"],
                                      clean_corners=summary["clean_corners"])
@@ -289,3 +314,11 @@ def run_race(car: Car, track: Track, laps: int, driver: DriverProfile,
             if dv > 0.0:
                 on_event({"type": "skill_up", "skill": k, "delta": dv, "new": getattr(driver, k)})
     return summary, gains
+
+def run_race(car: Car, track: Track, laps: int, driver: DriverProfile,
+             dt: float = 0.1, seed: int = 42,
+             on_event: Optional[Callable[[Dict], None]] = None,
+             profile=None) -> Tuple[Dict, Dict[str, float]]:
+    eng = RaceEngine(car, track, laps, driver=driver, seed=seed, on_event=on_event, profile=profile)
+    eng.run(dt=dt)
+    return finish_race(eng, on_event=on_event)
@@ -0,0 +1,416 @@
+"""Rate-limited outgoing message scheduler.
+
+Telegram allows roughly one message per second in a chat and about thirty
+per second overall; bursts above that are answered with ``RetryAfter`` and
+messages get dropped.  :class:`Outbox` queues every outgoing message and a
+single dispatcher task sends them while respecting a token bucket per chat
+and a global one.
+
+Within a chat, messages leave by priority class (results before regular
+events before live ticks) and in FIFO order inside a class.  Messages sent
+with a ``coalesce`` key replace a still-queued message with the same key,
+so a slow chat receives the latest tick instead of a backlog of stale ones.
+``RetryAfter`` pauses only the affected chat; network errors are retried a
+few times with backoff.
+
+The outbox only needs an object with an async ``send_message`` method, so it
+runs unchanged against a fake Bot API in tests.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+import warnings
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from telegram.error import BadRequest, NetworkError, RetryAfter
+
+import metrics
+
+logger = logging.getLogger("racing-bot")
+
+PRIORITY_RESULT = 0
+PRIORITY_EVENT = 1
+PRIORITY_TICK = 2
+
+# Лимиты Telegram: ~1 сообщение/с в чат и ~30/с на бота
+OUTBOX_CHAT_RATE = float(os.getenv("OUTBOX_CHAT_RATE", "1.0"))
+OUTBOX_CHAT_BURST = float(os.getenv("OUTBOX_CHAT_BURST", "3"))
+OUTBOX_GLOBAL_RATE = float(os.getenv("OUTBOX_GLOBAL_RATE", "25"))
+OUTBOX_GLOBAL_BURST = float(os.getenv("OUTBOX_GLOBAL_BURST", "25"))
+OUTBOX_MAX_RETRIES = int(os.getenv("OUTBOX_MAX_RETRIES", "3"))
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = max(rate, 1e-6)
+        self.burst = max(burst, 1.0)
+        self.tokens = self.burst
+        self.updated = now
+
+    def _refill(self, now: float) -> None:
+        if now > self.updated:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Seconds until one token is available."""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1.0 else (1.0 - self.tokens) / self.rate
+
+    def full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.burst
+
+    def take(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1.0
+
+
+@dataclass
+class _Outgoing:
+    chat_id: Any
+    text: str
+    kwargs: Dict[str, Any]
+    priority: int
+    seq: int
+    future: asyncio.Future
+    coalesce: Optional[str] = None
+    message_id: Optional[int] = None  # задан — редактируем это сообщение
+    attempts: int = 0
+
+
+@dataclass
+class _Chat:
+    bucket: TokenBucket
+    queue: List[Tuple[int, int, _Outgoing]] = field(default_factory=list)
+    pending: Dict[str, _Outgoing] = field(default_factory=dict)  # coalesce key -> queued message
+    busy: bool = False
+    paused_until: float = 0.0
+    ready_at: Optional[float] = None
+
+
+def _retry_seconds(exc: RetryAfter) -> float:
+    with warnings.catch_warnings():
+        # PTB 22 предупреждает, что int скоро станет timedelta; поддерживаем оба
+        warnings.simplefilter("ignore")
+        value = exc.retry_after
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    return float(value)
+
+
+def _consume(fut: asyncio.Future) -> None:
+    # отправку без ожидания результата не считаем «потерянным» исключением
+    if not fut.cancelled():
+        fut.exception()
+
+
+@dataclass
+class FanOut:
+    """Outcome of :meth:`Outbox.broadcast`, one entry per distinct chat."""
+
+    sent: Dict[Any, Any] = field(default_factory=dict)
+    failed: Dict[Any, BaseException] = field(default_factory=dict)
+
+
+class Outbox:
+    def __init__(
+        self,
+        bot,
+        *,
+        chat_rate: float = OUTBOX_CHAT_RATE,
+        chat_burst: float = OUTBOX_CHAT_BURST,
+        global_rate: float = OUTBOX_GLOBAL_RATE,
+        global_burst: float = OUTBOX_GLOBAL_BURST,
+        max_retries: int = OUTBOX_MAX_RETRIES,
+        clock=time.monotonic,
+    ):
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.clock = clock
+        self._global = TokenBucket(global_rate, global_burst, clock())
+        self._chats: Dict[Any, _Chat] = {}
+        self._ready: List[Tuple[float, int, Any]] = []  # (ready_at, seq, chat_id), lazily pruned
+        self._seq = itertools.count()
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._inflight: Set[asyncio.Task] = set()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.sent = 0
+        self.coalesced = 0
+        self.retried = 0
+
+    # ---- public API ----
+
+    def send(
+        self,
+        chat_id: Any,
+        text: str,
+        *,
+        priority: int = PRIORITY_EVENT,
+        coalesce: Optional[str] = None,
+        **kwargs: Any,
+    ) -> asyncio.Future:
+        """Queue a message and return a future with the sent ``Message``.
+
+        Must be called on the event loop.  With ``coalesce`` set, a queued
+        message with the same key in this chat is replaced in place and its
+        future is returned instead.
+        """
+        return self._enqueue(chat_id, text, priority, coalesce, kwargs)
+
+    def edit(
+        self,
+        chat_id: Any,
+        message_id: int,
+        text: str,
+        *,
+        priority: int = PRIORITY_TICK,
+        coalesce: Optional[str] = None,
+        **kwargs: Any,
+    ) -> asyncio.Future:
+        """Queue an edit of an already sent message; same rules as :meth:`send`."""
+        return self._enqueue(chat_id, text, priority, coalesce, kwargs, message_id)
+
+    def broadcast(
+        self,
+        chat_ids: Iterable[Any],
+        text: str,
+        *,
+        priority: int = PRIORITY_EVENT,
+        **kwargs: Any,
+    ) -> asyncio.Future:
+        """Send ``text`` to every distinct chat in ``chat_ids`` at once.
+
+        Chats shared by several recipients get one message.  Deliveries are
+        independent: a blocked or failing chat only ends up in
+        :attr:`FanOut.failed`.  The returned future resolves to a
+        :class:`FanOut` when every chat has been tried; awaiting it is
+        optional.
+        """
+        chats = list(dict.fromkeys(chat_ids))
+        futures = [self.send(chat_id, text, priority=priority, **kwargs) for chat_id in chats]
+        return asyncio.ensure_future(self._collect(chats, futures))
+
+    @staticmethod
+    async def _collect(chats: List[Any], futures: List[asyncio.Future]) -> FanOut:
+        res = FanOut()
+        outcomes = await asyncio.gather(*futures, return_exceptions=True)
+        for chat_id, outcome in zip(chats, outcomes):
+            if isinstance(outcome, BaseException):
+                res.failed[chat_id] = outcome
+            else:
+                res.sent[chat_id] = outcome
+        return res
+
+    def queued(self, chat_id: Any = None) -> int:
+        if chat_id is not None:
+            chat = self._chats.get(chat_id)
+            return len(chat.queue) if chat else 0
+        return sum(len(c.queue) for c in self._chats.values())
+
+    async def drain(self) -> None:
+        """Wait until every queued message has been sent or has failed."""
+        while any(c.queue or c.busy for c in self._chats.values()):
+            await asyncio.sleep(0.01)
+
+    async def stop(self) -> None:
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    # ---- internals ----
+
+    def _enqueue(
+        self,
+        chat_id: Any,
+        text: str,
+        priority: int,
+        coalesce: Optional[str],
+        kwargs: Dict[str, Any],
+        message_id: Optional[int] = None,
+    ) -> asyncio.Future:
+        self._ensure_started()
+        chat = self._chat(chat_id)
+        if coalesce is not None:
+            queued = chat.pending.get(coalesce)
+            if queued is not None:
+                queued.text = text
+                queued.kwargs = kwargs
+                self.coalesced += 1
+                return queued.future
+        fut = self.loop.create_future()
+        fut.add_done_callback(_consume)
+        item = _Outgoing(chat_id, text, kwargs, priority, next(self._seq), fut, coalesce, message_id)
+        if coalesce is not None:
+            chat.pending[coalesce] = item
+        heapq.heappush(chat.queue, (priority, item.seq, item))
+        self._schedule(chat_id, chat)
+        return fut
+
+    def _ensure_started(self) -> None:
+        if self._task is None or self._task.done():
+            self.loop = asyncio.get_running_loop()
+            self._wake = asyncio.Event()
+            self._task = self.loop.create_task(self._dispatch())
+
+    def _chat(self, chat_id: Any) -> _Chat:
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = _Chat(TokenBucket(self.chat_rate, self.chat_burst, self.clock()))
+        return chat
+
+    def _schedule(self, chat_id: Any, chat: _Chat) -> None:
+        if chat.busy or not chat.queue:
+            chat.ready_at = None
+            return
+        now = self.clock()
+        at = max(now + chat.bucket.delay(now), chat.paused_until)
+        if chat.ready_at is not None and chat.ready_at <= at:
+            return
+        chat.ready_at = at
+        heapq.heappush(self._ready, (at, next(self._seq), chat_id))
+        self._wake.set()
+
+    async def _sleep(self, delay: float) -> None:
+        self._wake.clear()
+        try:
+            await asyncio.wait_for(self._wake.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _dispatch(self) -> None:
+        while True:
+            if not self._ready:
+                self._collect_idle()
+                self._wake.clear()
+                await self._wake.wait()
+                continue
+            at, _, chat_id = self._ready[0]
+            chat = self._chats.get(chat_id)
+            if chat is None or chat.ready_at != at or chat.busy or not chat.queue:
+                heapq.heappop(self._ready)
+                continue
+            now = self.clock()
+            wait = max(at - now, self._global.delay(now))
+            if wait > 0:
+                await self._sleep(wait)
+                continue
+            heapq.heappop(self._ready)
+            chat.ready_at = None
+            _, _, item = heapq.heappop(chat.queue)
+            if item.coalesce is not None and chat.pending.get(item.coalesce) is item:
+                del chat.pending[item.coalesce]
+            if item.future.done():
+                self._schedule(chat_id, chat)
+                continue
+            self._global.take(now)
+            chat.bucket.take(now)
+            chat.busy = True
+            task = self.loop.create_task(self._deliver(chat, item))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _deliver(self, chat: _Chat, item: _Outgoing) -> None:
+        kind = "send" if item.message_id is None else "edit"
+        try:
+            if item.message_id is None:
+                msg = await self.bot.send_message(item.chat_id, item.text, **item.kwargs)
+            else:
+                msg = await self.bot.edit_message_text(
+                    item.text, chat_id=item.chat_id, message_id=item.message_id, **item.kwargs
+                )
+        except RetryAfter as e:
+            pause = _retry_seconds(e)
+            chat.paused_until = self.clock() + pause
+            self._requeue(chat, item)
+            metrics.OUTBOX_MESSAGES.inc(kind, "flood")
+            logger.warning("Flood limit in chat %s, pausing %.1fs", item.chat_id, pause)
+        except BadRequest as e:
+            if item.message_id is not None and "not modified" in str(e).lower():
+                self.sent += 1
+                metrics.OUTBOX_MESSAGES.inc(kind, "unchanged")
+                item.future.set_result(None)
+            else:
+                # BadRequest наследует NetworkError, но повтор тут не поможет
+                self._fail(item, e)
+        except NetworkError as e:
+            item.attempts += 1
+            if item.attempts > self.max_retries:
+                self._fail(item, e)
+            else:
+                chat.paused_until = self.clock() + 0.5 * 2 ** item.attempts
+                self._requeue(chat, item)
+                metrics.OUTBOX_MESSAGES.inc(kind, "retry")
+        except Exception as e:
+            self._fail(item, e)
+        else:
+            self.sent += 1
+            metrics.OUTBOX_MESSAGES.inc(kind, "sent")
+            if not item.future.done():
+                item.future.set_result(msg)
+        finally:
+            chat.busy = False
+            self._schedule(item.chat_id, chat)
+
+    def _fail(self, item: _Outgoing, exc: BaseException) -> None:
+        logger.warning("Message to %s dropped: %s", item.chat_id, exc)
+        metrics.OUTBOX_MESSAGES.inc("send" if item.message_id is None else "edit", "failed")
+        if not item.future.done():
+            item.future.set_exception(exc)
+
+    def _collect_idle(self) -> None:
+        now = self.clock()
+        for chat_id in [
+            cid
+            for cid, c in self._chats.items()
+            if not c.queue and not c.busy and c.paused_until <= now and c.bucket.full(now)
+        ]:
+            del self._chats[chat_id]
+
+    def _requeue(self, chat: _Chat, item: _Outgoing) -> None:
+        self.retried += 1
+        if item.coalesce is not None:
+            newer = chat.pending.get(item.coalesce)
+            if newer is not None:
+                # уже есть более свежая версия — старую не повторяем
+                newer.future.add_done_callback(lambda f: _chain(f, item.future))
+                return
+            chat.pending[item.coalesce] = item
+        heapq.heappush(chat.queue, (item.priority, item.seq, item))
+
+
+def _chain(src: asyncio.Future, dst: asyncio.Future) -> None:
+    if dst.done():
+        return
+    if src.cancelled():
+        dst.cancel()
+    elif src.exception() is not None:
+        dst.set_exception(src.exception())
+    else:
+        dst.set_result(src.result())
+
+
+_OUTBOX: Optional[Outbox] = None
+
+
+def get_outbox(bot) -> Outbox:
+    """Outbox for ``bot`` on the running loop, created on first use."""
+    global _OUTBOX
+    loop = asyncio.get_running_loop()
+    ob = _OUTBOX
+    if ob is None or ob.bot is not bot or (ob.loop is not None and ob.loop is not loop):
+        ob = _OUTBOX = Outbox(bot)
+    return ob
@@ -0,0 +1,294 @@
+"""Write-behind cache of player documents.
+
+Bot handlers run on the event loop, and ``save_player`` ``fsync``s the
+player file, so every disk sync used to stall all other updates.  Once
+installed with :func:`install_player_store`, :func:`economy_v1.load_player`
+and :func:`economy_v1.save_player` go through :class:`PlayerStore`:
+
+* reads are served from memory; a cached player is reused while its file
+  still has the inode, mtime and size we last saw, so changes made by
+  another bot process are picked up.  The event loop never checks that
+  itself: a player validated less than ``PLAYER_RECHECK_S`` ago is served
+  as is, an older one is re-checked in the default executor;
+* saves serialize the player and queue the snapshot for a single
+  ``player-io`` thread.  Saves of the same user made while a write is
+  pending are coalesced into one write, and every save returns a future that
+  completes once that state (or a later one) is on disk.
+
+Async code uses :func:`aload_player`, which never touches the disk on the
+loop, and awaits :func:`player_saved` before confirming money changes.
+"""
+
+import asyncio
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+import economy_v1
+import metrics
+from economy_v1 import Player
+
+logger = logging.getLogger("racing-bot")
+
+PLAYER_CACHE_MAX = int(os.getenv("PLAYER_CACHE_MAX", "10000"))
+# Как долго доверять закэшированному игроку без проверки файла, секунд
+PLAYER_RECHECK_S = float(os.getenv("PLAYER_RECHECK_S", "2"))
+
+Signature = Optional[Tuple[int, int, int]]
+
+
+def _file_signature(uid: str) -> Signature:
+    """``(inode, mtime_ns, size)`` of the player file, ``None`` if missing.
+
+    Files are replaced atomically, so every write gets a new inode.
+    """
+    try:
+        st = os.stat(economy_v1._user_path(uid))
+    except OSError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+@dataclass
+class _Entry:
+    player: Player
+    signature: Signature
+    checked: float = 0.0  # time.monotonic() последней сверки с файлом
+
+
+class PlayerStore:
+    def __init__(self, max_cached: int = PLAYER_CACHE_MAX, recheck_s: float = PLAYER_RECHECK_S):
+        self.max_cached = max(1, max_cached)
+        self.recheck_s = recheck_s
+        self._lock = threading.Lock()
+        self._cache: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._pending: Dict[str, Tuple[str, Future]] = {}
+        # пишущиеся сейчас игроки и future их записи
+        self._writing: Dict[str, Future] = {}
+        self._io = ThreadPoolExecutor(max_workers=1, thread_name_prefix="player-io")
+        self._flushing = False
+        self._closed = False
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.coalesced = 0
+        self.batches = 0
+
+    # ---- reads ----
+
+    def _cached(self, uid: str, signature: Signature) -> Optional[Player]:
+        # вызывается под self._lock
+        entry = self._cache.get(uid)
+        if entry is None:
+            return None
+        if uid not in self._pending and uid not in self._writing:
+            if entry.signature != signature:
+                return None
+            entry.checked = time.monotonic()
+        self._cache.move_to_end(uid)
+        return entry.player
+
+    def _trusted(self, uid: str) -> Optional[Player]:
+        """Cached player that needs no file check: dirty or validated recently."""
+        with self._lock:
+            entry = self._cache.get(uid)
+            if entry is None:
+                return None
+            dirty = uid in self._pending or uid in self._writing
+            if not dirty and time.monotonic() - entry.checked >= self.recheck_s:
+                return None
+            self._cache.move_to_end(uid)
+            self.hits += 1
+        metrics.PLAYER_LOOKUPS.inc("hit")
+        return entry.player
+
+    def _dirty(self, uid: str) -> bool:
+        with self._lock:
+            return uid in self._pending or uid in self._writing
+
+    def peek(self, uid: str) -> Optional[Player]:
+        """Return the cached player if it is still current, without reading it."""
+        signature = None if self._dirty(uid) else _file_signature(uid)
+        with self._lock:
+            p = self._cached(uid, signature)
+            if p is not None:
+                self.hits += 1
+        if p is not None:
+            metrics.PLAYER_LOOKUPS.inc("hit")
+        return p
+
+    def load(self, uid: str, name: str) -> Player:
+        """Blocking load for worker threads; reads the file on a cache miss."""
+        p = self.peek(uid)
+        if p is not None:
+            return p
+        started = time.perf_counter()
+        p = economy_v1._read_player(uid, name)
+        signature = _file_signature(uid)
+        metrics.PLAYER_READ_SECONDS.observe(time.perf_counter() - started)
+        metrics.PLAYER_LOOKUPS.inc("miss")
+        with self._lock:
+            self.misses += 1
+            # параллельная загрузка или сохранение успели раньше — их объект главнее
+            cur = self._cached(uid, signature)
+            if cur is not None:
+                return cur
+            self._remember(uid, p, signature)
+        return p
+
+    async def get(self, uid: str, name: str) -> Player:
+        p = self._trusted(uid)
+        if p is not None:
+            return p
+        # сверка с файлом (stat) и чтение — только вне цикла событий
+        return await asyncio.get_running_loop().run_in_executor(None, self.load, uid, name)
+
+    def _remember(self, uid: str, p: Player, signature: Signature) -> None:
+        self._cache[uid] = _Entry(p, signature, time.monotonic())
+        self._cache.move_to_end(uid)
+        if len(self._cache) <= self.max_cached:
+            return
+        for old in list(self._cache):
+            if len(self._cache) <= self.max_cached:
+                break
+            # несохранённых игроков не вытесняем
+            if old != uid and old not in self._pending and old not in self._writing:
+                del self._cache[old]
+
+    # ---- writes ----
+
+    def save(self, p: Player) -> Future:
+        """Queue ``p`` for writing and return a future for its durability."""
+        text = p.to_json()
+        uid = p.user_id
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Хранилище игроков закрыто")
+            prev = self._pending.get(uid)
+            if prev is not None:
+                fut = prev[1]
+                self.coalesced += 1
+            else:
+                fut = Future()
+            self._pending[uid] = (text, fut)
+            entry = self._cache.get(uid)
+            self._remember(uid, p, entry.signature if entry is not None else None)
+            if not self._flushing:
+                self._flushing = True
+                self._io.submit(self._flush)
+        return fut
+
+    def _flush(self) -> None:
+        while True:
+            with self._lock:
+                if not self._pending:
+                    self._flushing = False
+                    return
+                # всё, что накопилось за время прошлой записи, уходит одной пачкой
+                batch, self._pending = self._pending, {}
+                self._writing.update({uid: fut for uid, (_, fut) in batch.items()})
+            self.batches += 1
+            for uid, (text, fut) in batch.items():
+                started = time.perf_counter()
+                try:
+                    economy_v1._atomic_write(economy_v1._user_path(uid), text)
+                    metrics.PLAYER_WRITE_SECONDS.observe(time.perf_counter() - started)
+                except Exception as e:
+                    logger.exception("Saving player %s failed", uid)
+                    with self._lock:
+                        self._writing.pop(uid, None)
+                    fut.set_exception(e)
+                    continue
+                signature = _file_signature(uid)
+                with self._lock:
+                    self._writing.pop(uid, None)
+                    entry = self._cache.get(uid)
+                    if entry is not None and uid not in self._pending:
+                        entry.signature = signature
+                        entry.checked = time.monotonic()
+                    self.writes += 1
+                fut.set_result(None)
+
+    def saved(self, uid: str) -> Future:
+        """Future that completes once every save of ``uid`` so far is on disk."""
+        with self._lock:
+            pending = self._pending.get(uid)
+            if pending is not None:
+                # ожидающая запись включает и всё, что пишется сейчас
+                return pending[1]
+            fut = self._writing.get(uid)
+        if fut is None:
+            fut = Future()
+            fut.set_result(None)
+        return fut
+
+    def flush(self, timeout: Optional[float] = None) -> None:
+        """Block until everything saved so far is on disk."""
+        # I/O-поток один: пустая задача выполнится после текущей пачки записей
+        self._io.submit(lambda: None).result(timeout)
+
+    async def aflush(self) -> None:
+        await asyncio.get_running_loop().run_in_executor(None, self.flush)
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+        self._io.shutdown(wait=True)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "cached": len(self._cache),
+                "pending": len(self._pending) + len(self._writing),
+                "hits": self.hits,
+                "misses": self.misses,
+                "writes": self.writes,
+                "coalesced": self.coalesced,
+                "batches": self.batches,
+            }
+
+
+_STORE: Optional[PlayerStore] = None
+_STORE_LOCK = threading.Lock()
+
+
+def get_player_store() -> PlayerStore:
+    global _STORE
+    if _STORE is None:
+        with _STORE_LOCK:
+            if _STORE is None:
+                _STORE = PlayerStore()
+                atexit.register(_STORE.close)
+    return _STORE
+
+
+def install_player_store() -> PlayerStore:
+    """Make ``economy_v1`` load and save players through the shared store."""
+    store = get_player_store()
+    economy_v1.use_player_store(store)
+    return store
+
+
+async def aload_player(uid: str, name: str) -> Player:
+    """Load a player without blocking the event loop on disk reads."""
+    store = economy_v1.player_store()
+    if store is not None:
+        return await store.get(uid, name)
+    return await asyncio.get_running_loop().run_in_executor(None, economy_v1.load_player, uid, name)
+
+
+async def player_saved(uid: str) -> None:
+    """Wait until everything saved for ``uid`` so far is on disk.
+
+    Handlers await this before confirming a purchase or reward; a failed
+    write raises here.  Without a store saves are synchronous already.
+    """
+    store = economy_v1.player_store()
+    if store is not None:
+        await asyncio.wrap_future(store.saved(uid))
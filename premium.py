@@ -1,13 +1,118 @@
+import logging
 import os
+import threading
+from datetime import date
 from pathlib import Path
+from typing import Dict, Iterable, Optional, Set, Tuple
 
 DATA_DIR = Path(os.getenv("GAME_DATA_DIR", "./data"))
 PREMIUM_FILE = DATA_DIR / "premium.txt"
 
+logger = logging.getLogger(__name__)
+
+
+def _parse_line(line: str) -> Optional[Tuple[str, Optional[date]]]:
+    """Parse ``<user_id> [YYYY-MM-DD]`` into id and optional expiry date.
+
+    A line whose date does not parse is skipped: reading it as "no expiry"
+    would turn a typo into unlimited premium.
+    """
+    line = line.split("#", 1)[0].strip()
+    if not line:
+        return None
+    parts = line.split()
+    uid = parts[0]
+    expires: Optional[date] = None
+    if len(parts) > 1:
+        try:
+            expires = date.fromisoformat(parts[1])
+        except ValueError:
+            logger.warning("premium.txt: bad expiry date %r for %s, line skipped", parts[1], uid)
+            return None
+    return uid, expires
+
+
+class PremiumRegistry:
+    """In-memory premium membership set backed by ``premium.txt``.
+
+    The file is parsed once and re-read only when its mtime, size or inode
+    changes, so membership checks on the race path cost a ``stat`` call and a
+    set lookup.
+    """
+
+    def __init__(self, path: Path = PREMIUM_FILE):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._sig: Optional[Tuple[int, int, int]] = None
+        self._members: Dict[str, Optional[date]] = {}
+
+    def _signature(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            st = self.path.stat()
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _refresh(self) -> Dict[str, Optional[date]]:
+        sig = self._signature()
+        if sig == self._sig:
+            return self._members
+        with self._lock:
+            if sig == self._sig:
+                return self._members
+            members: Dict[str, Optional[date]] = {}
+            if sig is not None:
+                try:
+                    content = self.path.read_text(encoding="utf-8")
+                except FileNotFoundError:
+                    content = ""
+                for line in content.splitlines():
+                    parsed = _parse_line(line)
+                    if parsed:
+                        members[parsed[0]] = parsed[1]
+            self._members = members
+            self._sig = sig
+            return members
+
+    def reload(self) -> None:
+        """Force the next lookup to re-read the file."""
+        with self._lock:
+            self._sig = None
+            self._members = {}
+
+    def expires(self, user_id: str) -> Optional[date]:
+        """Return the expiry date of a membership, ``None`` if unlimited."""
+        return self._refresh().get(str(user_id))
+
+    def is_premium(self, user_id: str, today: Optional[date] = None) -> bool:
+        members = self._refresh()
+        uid = str(user_id)
+        if uid not in members:
+            return False
+        expires = members[uid]
+        return expires is None or expires >= (today or date.today())
+
+    def premium_many(self, user_ids: Iterable[str], today: Optional[date] = None) -> Set[str]:
+        """Return the subset of ``user_ids`` with an active membership."""
+        members = self._refresh()
+        today = today or date.today()
+        out: Set[str] = set()
+        for user_id in user_ids:
+            uid = str(user_id)
+            if uid in members:
+                expires = members[uid]
+                if expires is None or expires >= today:
+                    out.add(uid)
+        return out
+
+
+REGISTRY = PremiumRegistry()
+
+
 def is_premium(user_id: str) -> bool:
-    try:
-        content = PREMIUM_FILE.read_text(encoding="utf-8")
-    except FileNotFoundError:
-        return False
-    ids = {line.strip() for line in content.splitlines() if line.strip()}
-    return str(user_id) in ids
+    return REGISTRY.is_premium(user_id)
+
+
+def premium_many(user_ids: Iterable[str]) -> Set[str]:
+    """Batch membership check for lobby and matchmaking code."""
+    return REGISTRY.premium_many(user_ids)
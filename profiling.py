@@ -0,0 +1,195 @@
+"""Opt-in profiling of player races.
+
+``RACE_PROFILE`` is the share of races to profile: ``1`` profiles every
+race, ``0.01`` one race in a hundred, ``0`` (the default) none.
+:func:`set_sample_rate` changes it at runtime.
+
+A profiled race records
+
+* the phases of ``run_player_race``: ``load_player``, ``load_car``,
+  ``apply_upgrades``, ``load_track``, ``daily_limit``, ``simulate``,
+  ``reward``, ``save`` and ``leaderboard``;
+* calls, total and self time of ``RaceEngine.run``, ``step``,
+  ``_step_straight``, ``_step_corner``, ``_maybe_error`` and ``_notify``
+  per call stack, measured in the process that ran the simulation.
+
+Each record is kept in :func:`recent` and, with ``RACE_PROFILE_LOG`` set,
+appended to that file as a JSON line.  Self times are also summed per
+stack into folded stacks (``race;simulate;run;step 1234`` in
+microseconds), the input format of ``flamegraph.pl`` and speedscope.
+:func:`folded` returns them, and with ``RACE_PROFILE_STACKS`` set they are
+written there at exit.
+
+An unprofiled race pays one attribute check in ``RaceEngine.run``.  The
+timers are installed on the engine instance only when a profile is
+attached, so ``step`` itself is untouched.
+"""
+
+import atexit
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+RACE_PROFILE = float(os.getenv("RACE_PROFILE", "0") or 0)
+RACE_PROFILE_LOG = os.getenv("RACE_PROFILE_LOG")
+RACE_PROFILE_STACKS = os.getenv("RACE_PROFILE_STACKS")
+RACE_PROFILE_KEEP = int(os.getenv("RACE_PROFILE_KEEP", "100"))
+
+HOT_PATHS = ("step", "_step_straight", "_step_corner", "_maybe_error", "_notify")
+
+_rate = RACE_PROFILE
+_lock = threading.Lock()
+_recent: Deque[Dict] = deque(maxlen=max(1, RACE_PROFILE_KEEP))
+_folded: Dict[str, int] = {}
+_atexit_registered = False
+
+
+def sample_rate() -> float:
+    return _rate
+
+
+def set_sample_rate(rate: float) -> None:
+    global _rate
+    _rate = max(0.0, min(1.0, rate))
+
+
+class StackProfile:
+    """Calls, total and self nanoseconds per call stack of wrapped methods."""
+
+    def __init__(self) -> None:
+        # "run;step;_step_corner" -> [вызовы, всего нс, собственное нс]
+        self.stacks: Dict[str, List[int]] = {}
+        self._frames: List[List[Any]] = []
+
+    def wrap(self, name: str, fn: Callable) -> Callable:
+        frames = self._frames
+        stacks = self.stacks
+        clock = time.perf_counter_ns
+
+        def timed(*args, **kwargs):
+            parent = frames[-1] if frames else None
+            frame = [parent[0] + ";" + name if parent else name, 0]
+            frames.append(frame)
+            started = clock()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                took = clock() - started
+                frames.pop()
+                if parent is not None:
+                    parent[1] += took
+                rec = stacks.get(frame[0])
+                if rec is None:
+                    rec = stacks[frame[0]] = [0, 0, 0]
+                rec[0] += 1
+                rec[1] += took
+                rec[2] += took - frame[1]
+
+        return timed
+
+    def instrument(self, obj: Any, names=HOT_PATHS) -> None:
+        """Shadow ``obj``'s methods with timed wrappers on the instance."""
+        for name in names:
+            setattr(obj, name, self.wrap(name, getattr(obj, name)))
+
+
+class RaceProfile:
+    """Phase timings of one player race plus the engine's stacks."""
+
+    def __init__(self) -> None:
+        self.started = self._last = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+        self.engine: Dict[str, List[int]] = {}
+
+    def mark(self, phase: str) -> None:
+        """Attribute the time since the previous mark to ``phase``."""
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + now - self._last
+        self._last = now
+
+
+def begin() -> Optional[RaceProfile]:
+    """A new profile if this race is sampled, else ``None``."""
+    if not _rate:
+        return None
+    if _rate < 1.0 and random.random() >= _rate:
+        return None
+    return RaceProfile()
+
+
+def finish(prof: RaceProfile, **info: Any) -> Dict:
+    """Store the record of a finished race and add it to the folded stacks."""
+    hot: Dict[str, Dict[str, float]] = {}
+    for stack, (calls, total, own) in prof.engine.items():
+        h = hot.setdefault(stack.rsplit(";", 1)[-1], {"calls": 0, "total_ms": 0, "self_ms": 0})
+        h["calls"] += calls
+        h["total_ms"] += total
+        h["self_ms"] += own
+    for h in hot.values():
+        h["total_ms"] = round(h["total_ms"] / 1e6, 3)
+        h["self_ms"] = round(h["self_ms"] / 1e6, 3)
+    record = dict(
+        info,
+        at=round(time.time(), 3),
+        total_ms=round((prof._last - prof.started) * 1000, 3),
+        phases_ms={k: round(v * 1000, 3) for k, v in prof.phases.items()},
+        hot_paths=hot,
+    )
+
+    folded: Dict[str, int] = {}
+    for phase, took in prof.phases.items():
+        folded[f"race;{phase}"] = int(took * 1e6)
+    engine_us = sum(total for stack, (_, total, _) in prof.engine.items() if ";" not in stack) // 1000
+    if "race;simulate" in folded:
+        # в simulate остаётся только время вне движка: очередь, IPC, доставка событий
+        folded["race;simulate"] = max(0, folded["race;simulate"] - engine_us)
+    for stack, (_, _, own) in prof.engine.items():
+        folded[f"race;simulate;{stack}"] = own // 1000
+
+    with _lock:
+        _recent.append(record)
+        for stack, us in folded.items():
+            _folded[stack] = _folded.get(stack, 0) + us
+        if RACE_PROFILE_LOG:
+            with open(RACE_PROFILE_LOG, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        if RACE_PROFILE_STACKS:
+            _register_dump()
+    return record
+
+
+def recent() -> List[Dict]:
+    with _lock:
+        return list(_recent)
+
+
+def folded() -> str:
+    """Aggregated self time per stack, one ``stack microseconds`` line each."""
+    with _lock:
+        items = sorted(_folded.items())
+    return "".join(f"{stack} {us}\n" for stack, us in items if us > 0)
+
+
+def dump_stacks(path) -> None:
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(folded(), encoding="utf-8")
+
+
+def reset() -> None:
+    with _lock:
+        _recent.clear()
+        _folded.clear()
+
+
+def _register_dump() -> None:
+    # вызывается под _lock
+    global _atexit_registered
+    if not _atexit_registered:
+        _atexit_registered = True
+        atexit.register(lambda: dump_stacks(RACE_PROFILE_STACKS))
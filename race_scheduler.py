@@ -0,0 +1,192 @@
+"""Admission control for races.
+
+Every race, solo or lobby, needs a slot from :class:`RaceScheduler` before
+it starts.  At most ``RACE_CONCURRENCY`` races run at once; the rest wait in
+a bounded queue ordered by priority (premium first) and arrival, and are
+told their position whenever it changes.  A user can hold only one slot or
+queue place at a time.
+"""
+
+import asyncio
+import itertools
+import os
+import time
+from bisect import bisect_left, insort
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import AsyncIterator, Callable, Deque, Iterable, List, Optional, Set, Tuple
+
+import metrics
+
+RACE_CONCURRENCY = int(os.getenv("RACE_CONCURRENCY", "16"))
+RACE_QUEUE_MAX = int(os.getenv("RACE_QUEUE_MAX", "200"))
+
+PositionCallback = Callable[[int], object]
+
+
+class RaceAlreadyActive(RuntimeError):
+    """The user already has a running or queued race."""
+
+
+class RaceQueueFull(RuntimeError):
+    """The waiting queue reached ``RACE_QUEUE_MAX``."""
+
+
+@dataclass
+class _Waiter:
+    key: Tuple[int, int]  # (0 для премиума / 1 для остальных, порядковый номер)
+    users: Tuple[str, ...]
+    future: asyncio.Future
+    enqueued: float
+    on_position: Optional[PositionCallback] = None
+    position: int = 0
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return self.key < other.key
+
+
+@dataclass
+class SchedulerMetrics:
+    active: int
+    queued: int
+    admitted: int
+    rejected: int
+    wait_avg_s: float
+    wait_p95_s: float
+    wait_max_s: float
+
+
+class RaceScheduler:
+    def __init__(self, limit: int = RACE_CONCURRENCY, max_queue: int = RACE_QUEUE_MAX, clock=time.monotonic):
+        self.limit = max(1, limit)
+        self.max_queue = max(0, max_queue)
+        self.clock = clock
+        self._active = 0
+        self._users: Set[str] = set()
+        self._waiting: List[_Waiter] = []  # отсортирован по key
+        self._seq = itertools.count()
+        self._waits: Deque[float] = deque(maxlen=1000)
+        self.admitted = 0
+        self.rejected = 0
+
+    def is_busy(self, user_id: str) -> bool:
+        return user_id in self._users
+
+    @asynccontextmanager
+    async def slot(
+        self,
+        users: Iterable[str],
+        *,
+        premium: bool = False,
+        on_position: Optional[PositionCallback] = None,
+    ) -> AsyncIterator[None]:
+        """Hold a race slot for ``users`` for the duration of the block.
+
+        Raises :class:`RaceAlreadyActive` if any of the users already has a
+        race running or queued and :class:`RaceQueueFull` if the race would
+        have to wait in a full queue.  ``on_position`` is called with the
+        1-based queue position while waiting.
+        """
+        users = tuple(dict.fromkeys(users))
+        if any(u in self._users for u in users):
+            self.rejected += 1
+            raise RaceAlreadyActive("У тебя уже есть активная гонка или место в очереди")
+        if self._active < self.limit and not self._waiting:
+            self._admit(users, 0.0)
+        else:
+            await self._wait(users, premium, on_position)
+        try:
+            yield
+        finally:
+            self._release(users)
+
+    async def _wait(self, users: Tuple[str, ...], premium: bool, on_position: Optional[PositionCallback]) -> None:
+        if len(self._waiting) >= self.max_queue:
+            self.rejected += 1
+            raise RaceQueueFull("Очередь гонок заполнена, попробуй через минуту.")
+        waiter = _Waiter(
+            key=(0 if premium else 1, next(self._seq)),
+            users=users,
+            future=asyncio.get_running_loop().create_future(),
+            enqueued=self.clock(),
+            on_position=on_position,
+        )
+        insort(self._waiting, waiter)
+        self._users.update(users)
+        self._notify_positions(bisect_left(self._waiting, waiter))
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # слот уже выдан — возвращаем его
+                self._release(users)
+            else:
+                self._drop(waiter)
+            raise
+
+    def _admit(self, users: Tuple[str, ...], waited: float) -> None:
+        self._active += 1
+        self._users.update(users)
+        self.admitted += 1
+        self._waits.append(waited)
+        metrics.RACE_QUEUE_WAIT_SECONDS.observe(waited)
+
+    def _drop(self, waiter: _Waiter) -> None:
+        i = bisect_left(self._waiting, waiter)
+        if i < len(self._waiting) and self._waiting[i] is waiter:
+            del self._waiting[i]
+            self._users.difference_update(waiter.users)
+            self._notify_positions(i)
+
+    def _release(self, users: Tuple[str, ...]) -> None:
+        self._active -= 1
+        self._users.difference_update(users)
+        admitted = 0
+        while self._waiting and self._active < self.limit:
+            waiter = self._waiting.pop(0)
+            if waiter.future.done():
+                self._users.difference_update(waiter.users)
+                continue
+            self._admit(waiter.users, self.clock() - waiter.enqueued)
+            waiter.future.set_result(None)
+            admitted += 1
+        if admitted:
+            self._notify_positions(0)
+
+    def _notify_positions(self, start: int) -> None:
+        for i in range(start, len(self._waiting)):
+            waiter = self._waiting[i]
+            if waiter.position == i + 1 or waiter.on_position is None:
+                waiter.position = i + 1
+                continue
+            waiter.position = i + 1
+            try:
+                res = waiter.on_position(i + 1)
+                if asyncio.iscoroutine(res):
+                    asyncio.get_running_loop().create_task(res)
+            except Exception:
+                pass
+
+    def metrics(self) -> SchedulerMetrics:
+        waits = sorted(self._waits)
+        n = len(waits)
+        return SchedulerMetrics(
+            active=self._active,
+            queued=len(self._waiting),
+            admitted=self.admitted,
+            rejected=self.rejected,
+            wait_avg_s=sum(waits) / n if n else 0.0,
+            wait_p95_s=waits[min(n - 1, int(n * 0.95))] if n else 0.0,
+            wait_max_s=waits[-1] if n else 0.0,
+        )
+
+
+_SCHEDULER: Optional[RaceScheduler] = None
+
+
+def get_race_scheduler() -> RaceScheduler:
+    global _SCHEDULER
+    if _SCHEDULER is None:
+        _SCHEDULER = RaceScheduler()
+    return _SCHEDULER
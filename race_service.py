@@ -0,0 +1,293 @@
+"""Multi-core race simulation service.
+
+Race physics is pure CPU work, so running it in threads of the bot process
+caps all races at one core.  ``RaceService`` keeps a warm
+``ProcessPoolExecutor`` whose workers preload every track at startup and
+receive small picklable :class:`RaceJob` descriptions.  Engine events travel
+back over one multiprocessing queue tagged with the job id; a reader thread
+hands them to the asyncio loop, where each job's events are consumed in
+order by its own callback.
+
+Loading players, paying rewards and saving stay in the bot process, so the
+ledger and leaderboards keep a single writer.
+"""
+
+import asyncio
+import inspect
+import itertools
+import logging
+import os
+import threading
+from concurrent.futures import BrokenExecutor
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, Optional, Tuple, Union
+
+from models_v2 import Car, DriverProfile, RaceEngine, Track, finish_race, load_track
+from profiling import StackProfile
+
+if TYPE_CHECKING:
+    from concurrent.futures import ProcessPoolExecutor
+
+DATA_DIR = Path(os.getenv("GAME_DATA_DIR", "./data"))
+RACE_PROCESSES = int(os.getenv("RACE_PROCESSES", "0")) or (os.cpu_count() or 1)
+RACE_QUEUE_LIMIT = int(os.getenv("RACE_QUEUE_LIMIT", "0")) or RACE_PROCESSES * 8
+RACE_MP_START = os.getenv("RACE_MP_START", "spawn")
+
+logger = logging.getLogger(__name__)
+
+EventCallback = Callable[[Dict], Union[None, Awaitable[None]]]
+
+
+class RaceServiceBusy(RuntimeError):
+    """Raised when the service refuses a job because its queue is full."""
+
+
+@dataclass
+class RaceJob:
+    car: Dict[str, Any]
+    track_id: str
+    laps: int
+    driver: Dict[str, Any]
+    seed: int = 42
+    dt: float = 0.1
+    profile: bool = False
+
+
+# ---- worker side ----
+
+_TRACKS: Dict[str, Track] = {}
+_EVENTS = None
+
+
+def _init_worker(data_dir: str, events) -> None:
+    global _EVENTS
+    _EVENTS = events
+    for p in Path(data_dir, "tracks").glob("*.json"):
+        try:
+            _TRACKS[p.stem] = load_track(p)
+        except Exception:
+            continue
+
+
+def _warmup() -> int:
+    return len(_TRACKS)
+
+
+def _simulate(job_id: int, job: RaceJob, data_dir: str) -> Tuple[Dict, Dict[str, float], Dict]:
+    track = _TRACKS.get(job.track_id)
+    if track is None:
+        track = _TRACKS[job.track_id] = load_track(Path(data_dir, "tracks", f"{job.track_id}.json"))
+
+    def emit(evt: Dict) -> None:
+        _EVENTS.put((job_id, evt))
+
+    try:
+        driver = DriverProfile(**job.driver)
+        stacks = StackProfile() if job.profile else None
+        eng = RaceEngine(Car(**job.car), track, job.laps, driver=driver, seed=job.seed, on_event=emit, profile=stacks)
+        eng.run(dt=job.dt)
+        summary, gains = finish_race(eng, on_event=emit)
+        if stacks is not None:
+            summary["profile"] = stacks.stacks
+        return summary, gains, asdict(driver)
+    finally:
+        _EVENTS.put((job_id, None))
+
+
+# ---- bot process side ----
+
+
+class RaceService:
+    def __init__(
+        self,
+        workers: int = RACE_PROCESSES,
+        max_pending: int = RACE_QUEUE_LIMIT,
+        data_dir: Path = DATA_DIR,
+    ):
+        self.workers = max(1, workers)
+        self.max_pending = max(1, max_pending)
+        self.data_dir = str(data_dir)
+        self._events = None
+        self._pool: Optional["ProcessPoolExecutor"] = None
+        self._reader: Optional[threading.Thread] = None
+        self._routes: Dict[int, Tuple[asyncio.AbstractEventLoop, asyncio.Queue]] = {}
+        self._ids = itertools.count(1)
+        self._pending = 0
+        self._accepting = False
+        self._idle: Optional[asyncio.Event] = None
+        self._start_lock = threading.Lock()
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def start(self) -> None:
+        """Spawn the worker processes and preload tracks in each of them."""
+        with self._start_lock:
+            if self._pool is not None:
+                return
+            # multiprocessing грузим только здесь: импорт модуля остаётся дешёвым
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+
+            ctx = multiprocessing.get_context(RACE_MP_START)
+            self._events = ctx.Queue()
+            pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=ctx,
+                initializer=_init_worker,
+                initargs=(self.data_dir, self._events),
+            )
+            for fut in [pool.submit(_warmup) for _ in range(self.workers)]:
+                fut.result()
+            self._reader = threading.Thread(
+                target=self._read_events, args=(self._events,), name="race-events", daemon=True
+            )
+            self._reader.start()
+            self._pool = pool
+            self._accepting = True
+
+    def _discard_pool(self, pool: Optional["ProcessPoolExecutor"]) -> None:
+        """Forget a broken pool so that the next job starts a fresh one."""
+        with self._start_lock:
+            if pool is None or self._pool is not pool:
+                return
+            self._pool = None
+            events, self._events = self._events, None
+            self._reader = None
+        logger.error("Race worker pool is broken, a new one starts with the next job")
+        pool.shutdown(wait=False, cancel_futures=True)
+        if events is not None:
+            # останавливаем поток чтения старой очереди
+            events.put(None)
+
+    def _read_events(self, events) -> None:
+        while True:
+            item = events.get()
+            if item is None:
+                return
+            job_id, evt = item
+            route = self._routes.get(job_id)
+            if route is None:
+                continue
+            loop, queue = route
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, evt)
+            except RuntimeError:
+                # цикл событий уже закрыт
+                self._routes.pop(job_id, None)
+
+    def admit(self) -> None:
+        """Reserve a place for one job or raise :class:`RaceServiceBusy`.
+
+        The place counts towards ``max_pending`` until the job finishes.  A
+        caller that does not go on to ``run(..., admitted=True)`` must hand it
+        back with :meth:`release`.
+        """
+        if self._pool is not None and not self._accepting:
+            raise RaceServiceBusy("Сервис гонок останавливается, попробуй позже.")
+        if self._pending >= self.max_pending:
+            raise RaceServiceBusy("Сервер гонок перегружен, попробуй через минуту.")
+        self._pending += 1
+        if self._idle is None:
+            self._idle = asyncio.Event()
+        self._idle.clear()
+
+    def release(self) -> None:
+        """Give back a place taken by :meth:`admit`."""
+        self._pending -= 1
+        if self._pending == 0 and self._idle is not None:
+            self._idle.set()
+
+    def _job_done(self, queue: asyncio.Queue) -> Callable[[asyncio.Future], None]:
+        def done(fut: asyncio.Future) -> None:
+            self.release()
+            if fut.cancelled() or fut.exception() is not None:
+                # воркер мог упасть, не отправив маркер конца событий
+                queue.put_nowait(None)
+
+        return done
+
+    async def run(
+        self, job: RaceJob, on_event: Optional[EventCallback] = None, *, admitted: bool = False
+    ) -> Tuple[Dict, Dict[str, float], Dict]:
+        """Simulate ``job`` in a worker and feed its events to ``on_event``.
+
+        ``on_event`` runs on the event loop and may be a coroutine function;
+        events are delivered one at a time in engine order.  Returns the
+        race summary, skill gains and the updated driver profile once both
+        the simulation and event delivery are complete.  ``admitted`` means
+        the caller already holds a place from :meth:`admit`.
+        """
+        if not admitted:
+            self.admit()
+        loop = asyncio.get_running_loop()
+        job_id = next(self._ids)
+        queue: asyncio.Queue = asyncio.Queue()
+        self._routes[job_id] = (loop, queue)
+        pool = self._pool
+        try:
+            if pool is None:
+                await loop.run_in_executor(None, self.start)
+                pool = self._pool
+            fut = asyncio.wrap_future(pool.submit(_simulate, job_id, job, self.data_dir))
+        except BaseException as e:
+            self._routes.pop(job_id, None)
+            self.release()
+            if isinstance(e, BrokenExecutor):
+                self._discard_pool(pool)
+            raise
+        try:
+            fut.add_done_callback(self._job_done(queue))
+            while True:
+                evt = await queue.get()
+                if evt is None:
+                    break
+                if on_event is not None:
+                    try:
+                        res = on_event(evt)
+                        if inspect.isawaitable(res):
+                            await res
+                    except Exception:
+                        logger.exception("Race event callback failed for job %s", job_id)
+            try:
+                return await fut
+            except BrokenExecutor:
+                # воркер умер: следующая гонка поднимет новый пул
+                self._discard_pool(pool)
+                raise
+        finally:
+            self._routes.pop(job_id, None)
+
+    async def shutdown(self, timeout: Optional[float] = 30.0) -> None:
+        """Stop accepting jobs, let running ones finish and stop the workers."""
+        self._accepting = False
+        if self._pending and self._idle is not None:
+            try:
+                await asyncio.wait_for(self._idle.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        pool, self._pool = self._pool, None
+        if pool is not None:
+            await asyncio.get_running_loop().run_in_executor(None, pool.shutdown)
+        if self._events is not None:
+            self._events.put(None)
+        if self._reader is not None:
+            self._reader.join(timeout=5.0)
+
+
+_SERVICE: Optional[RaceService] = None
+
+
+def get_race_service() -> RaceService:
+    global _SERVICE
+    if _SERVICE is None:
+        _SERVICE = RaceService()
+    return _SERVICE
+
+
+def job_for(
+    car: Car, track_id: str, laps: int, driver: DriverProfile, seed: int = 42, profile: bool = False
+) -> RaceJob:
+    return RaceJob(car=asdict(car), track_id=track_id, laps=laps, driver=asdict(driver), seed=seed, profile=profile)
@@ -1,5 +1,8 @@
 """Entry point for launching the Telegram racing bot."""
 
+# Засекаем старт до тяжёлых импортов, чтобы видеть их в отчёте о запуске
+import startup  # noqa: F401
+
 # Load variables from a local `.env` file *before* importing the bot module so
 # that configuration like ``BOT_TOKEN`` is available during import.
 from dotenv import load_dotenv
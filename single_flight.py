@@ -0,0 +1,105 @@
+"""Per-user single-flight execution of expensive or mutating operations.
+
+People double-tap buttons and resend ``/race``.  Because each user's updates
+are handled one after another (see :mod:`update_processor`), the second tap
+is usually processed right after the first one finishes, so overlap alone
+does not catch it.  :class:`SingleFlight` therefore keeps the outcome of
+an operation for ``SINGLE_FLIGHT_WINDOW_S`` seconds after it finishes.  A
+request with the same ``(user, key)`` that arrives while the operation runs
+or within that window gets the same result and ``shared=True`` instead of
+running the operation again.
+
+An *exclusive* operation (a race) also refuses to start while another
+exclusive operation of that user is in flight, raising
+:class:`OperationInProgress`.  A repeat of a running exclusive operation is
+refused the same way instead of waiting for it: a race may release the
+user's turn (:func:`update_processor.release_turn`) and keep replaying
+for minutes, and the repeat must not hold that turn meanwhile.
+
+The operation runs as its own task: a caller that is cancelled does not
+cancel the work the others are waiting for.
+"""
+
+import asyncio
+import os
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+SINGLE_FLIGHT_WINDOW_S = float(os.getenv("SINGLE_FLIGHT_WINDOW_S", "2"))
+
+
+class OperationInProgress(RuntimeError):
+    """Raised when an exclusive operation of the same user is already running."""
+
+
+class SingleFlight:
+    def __init__(self, window_s: float = SINGLE_FLIGHT_WINDOW_S):
+        self.window_s = window_s
+        self._flights: Dict[Tuple[str, str], asyncio.Future] = {}
+        self._exclusive: Dict[str, str] = {}
+        self.started = 0
+        self.shared = 0
+
+    def active(self, user_id: str) -> Optional[str]:
+        """Key of the exclusive operation ``user_id`` is running, if any."""
+        return self._exclusive.get(user_id)
+
+    def in_flight(self, user_id: str, key: str) -> bool:
+        """True while the operation runs or its result is still being shared."""
+        return (user_id, key) in self._flights
+
+    async def run(
+        self,
+        user_id: str,
+        key: str,
+        fn: Callable[[], Awaitable[Any]],
+        *,
+        exclusive: bool = False,
+    ) -> Tuple[Any, bool]:
+        """Run ``fn()`` once for ``(user_id, key)`` and return ``(result, shared)``.
+
+        ``shared`` is True when the result came from an earlier identical
+        request; the caller should not repeat its side effects (messages).
+        Exceptions of ``fn`` reach every caller that shares it.
+        """
+        k = (user_id, key)
+        fut = self._flights.get(k)
+        if fut is not None and exclusive and not fut.done():
+            raise OperationInProgress("Подожди, предыдущая операция ещё выполняется.")
+        if fut is not None:
+            self.shared += 1
+            return await asyncio.shield(fut), True
+        if exclusive and user_id in self._exclusive:
+            raise OperationInProgress("Подожди, предыдущая операция ещё выполняется.")
+
+        task = asyncio.ensure_future(fn())
+        self._flights[k] = task
+        self.started += 1
+        if exclusive:
+            self._exclusive[user_id] = key
+        task.add_done_callback(lambda t: self._finished(k, t, exclusive))
+        return await asyncio.shield(task), False
+
+    def _finished(self, k: Tuple[str, str], task: asyncio.Future, exclusive: bool) -> None:
+        if exclusive and self._exclusive.get(k[0]) == k[1]:
+            del self._exclusive[k[0]]
+        if not task.cancelled():
+            # результат уже получил первый вызов; не даём asyncio ругаться
+            task.exception()
+        if self.window_s > 0 and not task.cancelled():
+            asyncio.get_running_loop().call_later(self.window_s, self._forget, k, task)
+        else:
+            self._forget(k, task)
+
+    def _forget(self, k: Tuple[str, str], task: asyncio.Future) -> None:
+        if self._flights.get(k) is task:
+            del self._flights[k]
+
+
+_FLIGHTS: Optional[SingleFlight] = None
+
+
+def get_single_flight() -> SingleFlight:
+    global _FLIGHTS
+    if _FLIGHTS is None:
+        _FLIGHTS = SingleFlight()
+    return _FLIGHTS
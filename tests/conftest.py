@@ -0,0 +1,15 @@
+import os, sys
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+import pytest
+
+import ledger
+
+
+@pytest.fixture(autouse=True)
+def _tmp_ledger(tmp_path_factory, monkeypatch):
+    # тесты экономики не пишут в журнал из data/
+    led = ledger.Ledger(tmp_path_factory.mktemp("ledger"))
+    monkeypatch.setattr(ledger, "_LEDGER", led)
+    yield led
+    led.close()
@@ -0,0 +1,105 @@
+import os, sys
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+import json
+
+
+def _car(path, cid, price):
+    path.write_text(json.dumps({"id": cid, "name": cid, "price": price, "tier": "starter"}), encoding="utf-8")
+
+
+def test_catalog_cache_checks_only_the_directory(tmp_path, monkeypatch):
+    # другие тесты перезагружают economy_v1 — берём текущий модуль
+    import economy_v1 as eco
+
+    monkeypatch.setattr(eco, "CARS_DIR", tmp_path)
+    monkeypatch.setattr(eco, "_DIR_CACHE", {})
+    _car(tmp_path / "a.json", "a", 100)
+    cat = eco.list_catalog()
+    assert set(cat["cars"]) == {"a"}
+    stats = []
+    real_stat = os.stat
+    monkeypatch.setattr(eco.os, "stat", lambda p, *a, **k: stats.append(str(p)) or real_stat(p, *a, **k))
+    monkeypatch.setattr(eco, "CATALOG_RECHECK_S", 3600.0)
+    _car(tmp_path / "b.json", "b", 200)
+    # в пределах интервала диск не трогаем вовсе
+    assert eco.list_catalog() is cat and stats == []
+    monkeypatch.setattr(eco, "CATALOG_RECHECK_S", 0.0)
+    # каталог изменился (новый файл) — stat самой папки и перечитывание, без stat каждого файла
+    fresh = eco.list_catalog()
+    assert set(fresh["cars"]) == {"a", "b"}
+    assert stats[0] == str(tmp_path) and not any(s.endswith(".json") for s in stats)
+    del stats[:]
+    assert eco.list_catalog() is fresh and stats == [str(tmp_path)]
+    # правка на месте не меняет mtime папки — для неё есть reload_catalog
+    _car(tmp_path / "a.json", "a", 150)
+    eco.reload_catalog()
+    assert eco.list_catalog()["cars"]["a"]["price"] == 150
+
+
+def _doc(driver, **kw):
+    import economy_v1 as eco
+
+    doc = {"user_id": "1", "name": "P", "driver": driver, "upgrades": {},
+           "schema_version": eco.PLAYER_SCHEMA_VERSION}
+    doc.update(kw)
+    return doc
+
+
+def _driver(**kw):
+    d = {"id": "1", "name": "Pilot", "braking": 71, "consistency": 72, "stress": 73,
+         "throttle": 74, "cornering": 75, "starts": 76, "xp": 1.5}
+    d.update(kw)
+    return d
+
+
+def test_driver_profile_is_parsed_only_on_access():
+    import economy_v1 as eco
+
+    # битый профиль не мешает загрузить игрока, пока к нему не обращаются
+    broken = eco.player_from_data(_doc({"bogus": 1}))
+    assert broken.balance == eco.DEFAULT_START_BALANCE
+    p = eco.player_from_data(_doc(_driver()))
+    assert p._driver_obj is None
+    d = p.driver_profile()
+    assert d.cornering == 75 and p.driver_profile() is d
+
+
+def test_player_json_is_compact_and_round_trips():
+    import economy_v1 as eco
+
+    p = eco.player_from_data(_doc(_driver(), name="Пилот"))
+    d = p.driver_profile()
+    d.xp = 9.0
+    text = p.to_json()
+    assert ", " not in text and '": ' not in text and "Пилот" in text
+    again = eco.player_from_data(json.loads(text))
+    assert again.to_dict() == p.to_dict()
+    # изменённый профиль сериализуется из объекта, а не из старого словаря
+    assert again.driver_profile().xp == 9.0
+
+
+def test_legacy_driver_json_file_is_migrated_on_read(tmp_path, monkeypatch):
+    import economy_v1 as eco
+
+    monkeypatch.setattr(eco, "USERS_DIR", tmp_path)
+    legacy = {"user_id": "5", "name": "Old", "balance": 300, "garage": [], "upgrades": {},
+              "driver_json": json.dumps(_driver(id="5"))}
+    (tmp_path / "5.json").write_text(json.dumps(legacy), encoding="utf-8")
+    p = eco._read_player("5", "Old")
+    assert p.schema_version == eco.PLAYER_SCHEMA_VERSION and p.balance == 300
+    assert p.driver_profile().braking == 71
+    data = json.loads(p.to_json())
+    assert "driver_json" not in data and data["driver"]["id"] == "5"
+
+
+def test_driver_json_is_a_read_only_view():
+    import pytest
+    import economy_v1 as eco
+
+    p = eco.player_from_data(_doc(_driver()))
+    assert json.loads(p.driver_json) == _driver()
+    with pytest.raises(AttributeError):
+        p.driver_json = "{}"
+    assert "driver_json" not in p.to_dict()
+    assert eco.Player(user_id="2", name="N").driver_json is None
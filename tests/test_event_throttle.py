@@ -0,0 +1,84 @@
+import os, sys
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+import asyncio
+
+from event_throttle import EventThrottle, Pacer, playback_duration
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _tick(t):
+    return {"type": "segment_tick", "time_s": t}
+
+
+def test_ticks_are_rate_limited_and_coalesced_to_latest():
+    clock = Clock()
+    th = EventThrottle({"segment_tick": 20.0}, clock=clock)
+    assert th.push("u1", _tick(0)) == [_tick(0)]
+    clock.now = 5
+    assert th.push("u1", _tick(7.5)) == []
+    clock.now = 10
+    assert th.push("u1", _tick(15)) == []
+    # другой гонщик не ждёт чужого лимита
+    assert th.push("u2", _tick(15)) == [_tick(15)]
+    clock.now = 21
+    change = {"type": "segment_change", "time_s": 16}
+    # придержанный тик уходит со следующим событием потока, и только свежий
+    assert th.push("u1", change) == [_tick(15), change]
+    assert th.dropped == 1
+
+
+def test_critical_events_always_pass_and_finish_drops_pending():
+    clock = Clock()
+    th = EventThrottle({"segment_tick": 20.0, "penalty": 20.0}, clock=clock)
+    th.push("u1", _tick(0))
+    th.push("u1", _tick(7.5))
+    penalties = [{"type": "penalty", "time_s": t} for t in (8, 9, 10)]
+    for p in penalties:
+        assert th.push("u1", p) == [p]
+    lap = {"type": "lap_complete", "time_s": 11}
+    done = {"type": "race_complete", "time_s": 12}
+    assert th.push("u1", lap) == [lap]
+    assert th.push("u1", done) == [done]
+    assert len(th) == 0
+    clock.now = 100
+    # после финиша устаревший тик не всплывает
+    assert th.push("u1", {"type": "segment_change", "time_s": 0}) == [{"type": "segment_change", "time_s": 0}]
+
+
+def test_per_stream_state_is_bounded():
+    th = EventThrottle({"segment_tick": 20.0}, max_keys=3, clock=Clock())
+    for uid in range(10):
+        th.push(uid, _tick(0))
+    assert len(th) == 3
+    th.push(7, _tick(1))
+    th.push(10, _tick(0))
+    # 7 недавно использовался, выпадает самый старый — 8
+    assert th.push(7, _tick(2)) == []
+    assert th.push(8, _tick(2)) == [_tick(2)]
+    th.end(7)
+    assert len(th) == 2
+
+
+def test_pacer_follows_sim_time_with_capped_gaps():
+    events = [{"time_s": 0.0}, {"time_s": 0.02}, {"time_s": 10.0}, {"type": "skill_up"}]
+    assert abs(playback_duration(events, speed=1.0, max_gap=0.03) - 0.05) < 1e-9
+    assert abs(playback_duration(events, speed=2.0, max_gap=0.03) - 0.04) < 1e-9
+
+    async def main():
+        pacer = Pacer(speed=1.0, max_gap=0.03)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        for evt in events:
+            await pacer.wait(evt)
+        return loop.time() - started
+
+    took = asyncio.run(main())
+    assert 0.045 <= took < 0.5
@@ -0,0 +1,74 @@
+import os, sys
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+import asyncio
+
+from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest, RetryAfter
+
+from fake_bot_api import FakeBotAPI
+from loadtest_webhook import make_update
+
+
+def _run(chat_burst, body):
+    async def main():
+        api = FakeBotAPI(chat_rate=1.0, chat_burst=chat_burst)
+        port = await api.start()
+        bot = Bot("123:test", base_url=f"http://127.0.0.1:{port}/bot")
+        try:
+            async with bot:
+                return await body(api, bot)
+        finally:
+            await api.stop()
+
+    return asyncio.run(main())
+
+
+def test_bot_sends_and_edits_through_fake_api():
+    async def body(api, bot):
+        inbox = api.subscribe(7)
+        kb = InlineKeyboardMarkup([[InlineKeyboardButton("Гараж", callback_data="nav:garage")]])
+        msg = await bot.send_message(7, "Привет", reply_markup=kb)
+        await bot.edit_message_text("Пока", chat_id=7, message_id=msg.message_id)
+        try:
+            await bot.edit_message_text("Пока", chat_id=7, message_id=msg.message_id)
+            raise AssertionError("expected BadRequest")
+        except BadRequest as e:
+            assert "not modified" in str(e)
+        return [inbox.get_nowait(), inbox.get_nowait()], inbox.empty()
+
+    (sent, edited), empty = _run(5, body)
+    assert sent["kind"] == "send" and sent["text"] == "Привет"
+    assert sent["reply_markup"]["inline_keyboard"][0][0]["callback_data"] == "nav:garage"
+    assert edited["kind"] == "edit" and edited["text"] == "Пока"
+    assert empty
+
+
+def test_per_chat_flood_limit_answers_retry_after():
+    async def body(api, bot):
+        await bot.send_message(9, "1")
+        await bot.send_message(9, "2")
+        try:
+            await bot.send_message(9, "3")
+        except RetryAfter:
+            return api.stats()
+        raise AssertionError("expected RetryAfter")
+
+    stats = _run(2, body)
+    assert stats["rate_limited"] == 1
+    assert stats["calls"]["sendMessage"] == 3
+
+
+def test_get_updates_long_poll_wakes_on_push():
+    async def body(api, bot):
+        poll = asyncio.ensure_future(bot.get_updates(timeout=5))
+        await asyncio.sleep(0.05)
+        api.push_update(make_update(0, 11, "/start"))
+        updates = await asyncio.wait_for(poll, 2)
+        again = await bot.get_updates(offset=updates[-1].update_id + 1, timeout=0)
+        return updates, again
+
+    updates, again = _run(3, body)
+    assert [u.message.text for u in updates] == ["/start"]
+    assert updates[0].effective_user.id == 11
+    assert again == ()
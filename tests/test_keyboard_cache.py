@@ -0,0 +1,31 @@
+import os, sys
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+import copy
+
+from bot_kb import catalog_kb, main_menu_kb, tracks_kb
+from economy_v1 import list_catalog, list_tracks
+
+
+def test_catalog_keyboard_cached_until_catalog_changes():
+    cat = list_catalog()
+    assert list_catalog() is cat
+    kb = catalog_kb(cat, tier="starter", page=1)
+    assert catalog_kb(cat, tier="starter", page=1) is kb
+    assert catalog_kb(cat, tier="sport", page=1) is not kb
+
+    changed = copy.deepcopy(cat)
+    starters = [c for c, item in changed["cars"].items() if item.get("tier") == "starter"]
+    cid = min(starters, key=lambda c: changed["cars"][c]["price"])
+    changed["cars"][cid]["name"] = "Новая машина"
+    kb2 = catalog_kb(changed, tier="starter", page=1)
+    assert kb2 is not kb
+    labels = [btn.text for row in kb2.inline_keyboard for btn in row]
+    assert any(label.startswith("Новая машина") for label in labels)
+
+
+def test_static_keyboards_are_reused():
+    assert main_menu_kb() is main_menu_kb()
+    assert tracks_kb() is tracks_kb()
+    labels = [btn.text for row in tracks_kb().inline_keyboard for btn in row]
+    assert set(list_tracks().values()) & set(labels)
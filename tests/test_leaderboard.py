@@ -0,0 +1,52 @@
+import os, sys, random
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from leaderboard import Board, Leaderboards
+
+
+def test_record_keeps_personal_best(tmp_path):
+    boards = Leaderboards(tmp_path)
+    assert boards.record("t1", "club", "u1", "Anna", 61.2) is True
+    assert boards.record("t1", "club", "u1", "Anna", 65.0) is False
+    assert boards.record("t1", "club", "u2", "Boris", 60.0) is True
+    assert boards.record("t1", "club", "u1", "Anna K", 59.5) is True
+    # другой класс — другая таблица
+    assert boards.record("t1", "starter", "u2", "Boris", 70.0) is True
+
+    r = boards.ranking("t1", "club", "u2")
+    assert [(e["user_id"], e["time_s"]) for e in r["top"]] == [("u1", 59.5), ("u2", 60.0)]
+    assert r["top"][0]["name"] == "Anna K"
+    assert r["me"]["pos"] == 2 and r["total"] == 2
+    assert boards.ranking("t2", "club", "u1") == {"top": [], "me": None, "total": 0}
+
+    again = Leaderboards(tmp_path)
+    assert again.ranking("t1", "club", "u1")["me"]["time_s"] == 59.5
+
+
+def test_blocked_order_matches_sorted_list():
+    rnd = random.Random(7)
+    board = Board(block=4)
+    best = {}
+    for _ in range(500):
+        uid = f"u{rnd.randrange(60)}"
+        t = round(rnd.uniform(50, 90), 3)
+        assert board.submit(uid, uid, t) == (uid not in best or t < best[uid])
+        best[uid] = min(t, best.get(uid, t))
+    expected = sorted((t, uid) for uid, t in best.items())
+    assert [(e["time_s"], e["user_id"]) for e in board.top(len(best))] == expected
+    for pos, (t, uid) in enumerate(expected, 1):
+        assert board.position(uid)["pos"] == pos
+    assert len(board) == len(best) and all(len(b) <= 4 for b in board._blocks)
+
+
+def test_records_log_is_compacted_on_load(tmp_path):
+    boards = Leaderboards(tmp_path)
+    for i in range(10):
+        boards.record("t1", "club", "u1", "Anna", 100.0 - i)
+    boards.record("t1", "club", "u2", "Boris", 95.0)
+    log = tmp_path / "records.log"
+    assert len(log.read_text(encoding="utf-8").splitlines()) == 11
+
+    again = Leaderboards(tmp_path)
+    assert len(log.read_text(encoding="utf-8").splitlines()) == 2
+    assert again.ranking("t1", "club", "u1")["me"]["time_s"] == 91.0
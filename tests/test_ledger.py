@@ -0,0 +1,139 @@
+import os, sys, json
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+import pytest
+
+from ledger import Ledger
+
+
+def _entries(path):
+    return [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+
+
+def test_replay_restores_balances(tmp_path):
+    led = Ledger(tmp_path, flush_ms=1)
+    led.append("u1", "race", 100, 100)
+    led.append("u2", "bonus", 50, 50)
+    led.append("u1", "buy_car", -30, 70, ref="lada_2107")
+    assert led.flush(timeout=5)
+    led.close()
+
+    again = Ledger(tmp_path)
+    assert again.balances() == {"u1": 70, "u2": 50}
+    assert again.append("u2", "race", 5, 55) == 4
+    assert again.reconcile({"u1": 70, "u2": 40}) == {"u2": {"ledger": 55, "document": 40}}
+    again.close()
+
+
+def test_torn_tail_is_cut_before_new_appends(tmp_path):
+    led = Ledger(tmp_path, flush_ms=1)
+    led.append("u1", "race", 100, 100)
+    led.close()
+    with (tmp_path / "economy.log").open("ab") as f:
+        f.write(b'{"seq":2,"uid":"u1","bal')
+
+    again = Ledger(tmp_path, flush_ms=1)
+    assert again.balances() == {"u1": 100}
+    again.append("u1", "race", 10, 110)
+    again.close()
+    assert [e["seq"] for e in _entries(tmp_path / "economy.log")] == [1, 2]
+    assert Ledger(tmp_path).balances() == {"u1": 110}
+
+
+def test_snapshot_plus_tail(tmp_path):
+    led = Ledger(tmp_path, flush_ms=1, snapshot_every=2)
+    led.append("u1", "race", 10, 10)
+    led.append("u2", "race", 20, 20)
+    assert led.flush(timeout=5)
+    snap = json.loads((tmp_path / "snapshot.json").read_text(encoding="utf-8"))
+    assert snap["balances"] == {"u1": 10, "u2": 20}
+    assert snap["offset"] == (tmp_path / "economy.log").stat().st_size
+    led.append("u1", "race", 5, 15)
+    led.close()
+
+    again = Ledger(tmp_path, snapshot_every=2)
+    assert again.balances() == {"u1": 15, "u2": 20}
+    assert again._seq == 3
+    again.close()
+
+
+def _flaky_fsync(monkeypatch, failures=1):
+    import ledger as ledger_mod
+
+    real_fsync = os.fsync
+    calls = []
+
+    def fsync(fd):
+        calls.append(fd)
+        if len(calls) <= failures:
+            raise OSError("диск отвалился")
+        real_fsync(fd)
+
+    monkeypatch.setattr(ledger_mod.os, "fsync", fsync)
+    return calls
+
+
+def test_failed_flush_keeps_batch(tmp_path, monkeypatch):
+    led = Ledger(tmp_path, flush_ms=60_000)
+    _flaky_fsync(monkeypatch)
+    led.append("u1", "race", 100, 100)
+    with pytest.raises(OSError):
+        led.flush(timeout=5)
+    assert led.flush(timeout=5)
+    led.close()
+    # недописанный батч не задваивается
+    assert [e["seq"] for e in _entries(tmp_path / "economy.log")] == [1]
+
+
+def test_flush_thread_survives_errors(tmp_path, monkeypatch):
+    led = Ledger(tmp_path, flush_ms=1)
+    calls = _flaky_fsync(monkeypatch, failures=2)
+    led.append("u1", "race", 100, 100)
+    with led._cond:
+        assert led._cond.wait_for(lambda: led._durable_seq >= 1, 5)
+    led.append("u1", "race", 1, 101)
+    led.close()
+    assert len(calls) >= 3
+    assert [e["seq"] for e in _entries(tmp_path / "economy.log")] == [1, 2]
+
+
+def test_money_is_recorded_only_after_the_player_is_saved(tmp_path, monkeypatch, _tmp_ledger):
+    from concurrent.futures import Future
+
+    # другие тесты перезагружают economy_v1 — берём текущий модуль
+    import economy_v1 as eco
+
+    monkeypatch.setattr(eco, "USERS_DIR", tmp_path)
+    monkeypatch.setattr(eco, "_STORE", None)
+    p = eco.Player(user_id="m1", name="M")
+    real_write = eco._atomic_write
+
+    def broken_write(path, text):
+        raise OSError("диск полон")
+
+    monkeypatch.setattr(eco, "_atomic_write", broken_write)
+    with pytest.raises(OSError):
+        eco.reward_player(p, 500, kind="race", ref="t1")
+    # сохранение не удалось — в журнале ничего, проводка ждёт следующего сохранения
+    assert _tmp_ledger.balance("m1") is None
+    monkeypatch.setattr(eco, "_atomic_write", real_write)
+    eco.save_player(p)
+    assert _tmp_ledger.balance("m1") == p.balance and not p._txns
+
+    class Store:
+        def __init__(self):
+            self.futures = []
+
+        def save(self, player):
+            self.futures.append(Future())
+            return self.futures[-1]
+
+    store = Store()
+    monkeypatch.setattr(eco, "_STORE", store)
+    eco.reward_player(p, 100, kind="bonus")
+    assert _tmp_ledger.balance("m1") == p.balance - 100
+    store.futures[0].set_exception(OSError("запись не удалась"))
+    assert _tmp_ledger.balance("m1") == p.balance - 100 and len(p._txns) == 1
+    eco.save_player(p)
+    store.futures[1].set_result(None)
+    assert _tmp_ledger.balance("m1") == p.balance and not p._txns
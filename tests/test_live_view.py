@@ -0,0 +1,67 @@
+import os, sys
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+import asyncio
+
+from live_view import LiveMessage, LiveStandings
+from outbox import Outbox
+
+
+def _seg(uid, seg_id, t, lap=1):
+    return {
+        "type": "segment_change",
+        "user_id": uid,
+        "segment": f"S{seg_id}",
+        "segment_id": seg_id,
+        "lap": lap,
+        "laps": 2,
+        "time_s": t,
+        "speed": 100.0,
+    }
+
+
+def test_standings_gap_and_incidents():
+    st = LiveStandings([{"user_id": "a", "name": "A"}, {"user_id": "b", "name": "B"}])
+    st.update(_seg("a", 2, 10.0))
+    st.update(_seg("b", 2, 11.5))
+    st.update({"type": "penalty", "user_id": "b", "segment": "S2", "delta_s": 1.0, "time_s": 12.0})
+    st.update(_seg("a", 3, 20.0))
+    assert st.order() == ["a", "b"]
+    assert abs(st.gap["b"] - 1.5) < 1e-9
+    board = st.board("Race")
+    assert "+1.50s" in board and "⚠️1" in board
+
+
+def test_live_message_edits_are_debounced():
+    class Msg:
+        message_id = 42
+
+    class FakeBot:
+        def __init__(self):
+            self.sent, self.edits = [], []
+
+        async def send_message(self, chat_id, text, parse_mode=None, reply_markup=None):
+            self.sent.append(text)
+            return Msg()
+
+        async def edit_message_text(self, text, chat_id=None, message_id=None, parse_mode=None):
+            self.edits.append((message_id, text))
+            return Msg()
+
+    bot = FakeBot()
+
+    async def main():
+        ob = Outbox(bot, chat_rate=1000, chat_burst=100, global_rate=1000, global_burst=100)
+        state = {"n": 0}
+        view = LiveMessage(ob, 1, lambda: f"n={state['n']}", interval=0.05)
+        for i in range(50):
+            state["n"] = i
+            view.touch()
+            await asyncio.sleep(0.002)
+        await view.close()
+        await ob.stop()
+
+    asyncio.run(main())
+    assert len(bot.sent) == 1
+    assert 1 <= len(bot.edits) < 10
+    assert bot.edits[-1] == (42, "n=49")
@@ -5,6 +5,7 @@ import lobby
 import bot_lobby
 import bot
 import asyncio
+from race_service import RaceService
 
 
 def test_lobby_create_join_start(monkeypatch):
@@ -14,8 +15,13 @@ def test_lobby_create_join_start(monkeypatch):
     lobby.join_lobby(lid, "u2", "B", chat_id="c1", mass=900, power=110)
 
     events = []
+    service = RaceService(workers=1, max_pending=2)
+    monkeypatch.setattr(lobby, "get_race_service", lambda: service)
 
-    def fake_run(uid, name, track_id=None, laps=1, on_event=None):
+    async def fake_run(uid, name, track_id=None, laps=1, on_event=None, admitted=False):
+        # каждому гонщику место в сервисе выдано заранее
+        assert admitted and service.pending > 0
+        service.release()
         if on_event:
             on_event({"type": "penalty", "segment": "S", "delta_s": 1.0})
             on_event(
@@ -33,8 +39,9 @@ def test_lobby_create_join_start(monkeypatch):
             )
         return {"time_s": 1.23, "incidents": 0, "reward": 0}
 
-    monkeypatch.setattr(lobby, "run_player_race", fake_run)
+    monkeypatch.setattr(lobby, "run_player_race_async", fake_run)
     res = lobby.start_lobby_race(lid, laps=1, on_event=events.append)
+    assert service.pending == 0
     assert {r["user_id"] for r in res} == {"u1", "u2"}
     penalties = [e for e in events if e["type"] == "penalty"]
     assert len(penalties) == 2
@@ -65,13 +72,22 @@ def test_group_receives_only_results(monkeypatch):
     lobby.join_lobby(lid, "u1", "A", chat_id="10", mass=1000, power=100)
     lobby.join_lobby(lid, "u2", "B", chat_id="10", mass=900, power=110)
 
-    def fake_start_lobby_race(_, on_event=None):
+    async def fake_run_lobby_race(_, on_event=None):
         return [
             {"user_id": "u1", "name": "A", "result": {"time_s": 1.0}},
             {"user_id": "u2", "name": "B", "result": {"time_s": 2.0}},
         ]
 
-    monkeypatch.setattr(bot_lobby, "start_lobby_race", fake_start_lobby_race)
+    monkeypatch.setattr(bot_lobby, "run_lobby_race", fake_run_lobby_race)
+    busy_during_playback = []
+    play = bot_lobby.play_lobby_events
+
+    async def recording_play(*a, **k):
+        # повтор идёт уже без слота планировщика
+        busy_during_playback.append(bot_lobby.get_race_scheduler().is_busy("u1"))
+        await play(*a, **k)
+
+    monkeypatch.setattr(bot_lobby, "play_lobby_events", recording_play)
 
     sent = []
 
@@ -98,6 +114,7 @@ def test_group_receives_only_results(monkeypatch):
     assert set(chat_ids[:2]) == {"u1", "u2"}
     # Final results only to group chat
     assert chat_ids[2] == 10
+    assert busy_during_playback == [False]
 
 def test_join_twice_forbidden():
     lobby.reset_lobbies()
@@ -149,13 +166,66 @@ def test_race_blocked_when_in_lobby(monkeypatch):
 
     called = False
 
-    def fake_run(*a, **k):
+    async def fake_run(*a, **k):
         nonlocal called
         called = True
         return {}
 
-    monkeypatch.setattr(bot, "run_player_race", fake_run)
+    monkeypatch.setattr(bot, "run_player_race_async", fake_run)
 
     asyncio.run(bot.race(FakeUpdate(), None))
     assert called is False
     assert any("лобби" in m for m in messages)
+
+
+def test_busy_race_service_refuses_the_whole_lobby(monkeypatch):
+    lobby.reset_lobbies()
+    lid = lobby.create_lobby("track1")
+    for uid in ("u1", "u2", "u3"):
+        lobby.join_lobby(lid, uid, uid, chat_id="c")
+    service = RaceService(workers=1, max_pending=2)
+    monkeypatch.setattr(lobby, "get_race_service", lambda: service)
+
+    async def never_run(*a, **k):
+        raise AssertionError("гонка не должна начаться")
+
+    monkeypatch.setattr(lobby, "run_player_race_async", never_run)
+    with pytest.raises(RuntimeError):
+        lobby.start_lobby_race(lid)
+    # уже выданные места вернулись, лобби снова можно запустить
+    assert service.pending == 0
+    lobby.LOBBIES.set_racing(lid, True)
+    lobby.reset_lobbies()
+
+
+def test_lobby_drivers_race_in_parallel(monkeypatch):
+    lobby.reset_lobbies()
+    lid = lobby.create_lobby("track1")
+    for uid in ("u1", "u2", "u3"):
+        lobby.join_lobby(lid, uid, uid, chat_id="c")
+    service = RaceService(workers=3, max_pending=3)
+    monkeypatch.setattr(lobby, "get_race_service", lambda: service)
+    running = []
+    peak = []
+
+    async def fake_run(uid, name, track_id=None, laps=1, on_event=None, admitted=False):
+        running.append(uid)
+        peak.append(len(running))
+        await asyncio.sleep(0.01)
+        on_event({"type": "segment_change", "time_s": {"u1": 3.0, "u2": 1.0, "u3": 2.0}[uid]})
+        running.remove(uid)
+        service.release()
+        if uid == "u2":
+            raise RuntimeError("нет машины")
+        return {"time_s": 1.0}
+
+    monkeypatch.setattr(lobby, "run_player_race_async", fake_run)
+    events = []
+    res = lobby.start_lobby_race(lid, on_event=events.append)
+    # все гонщики в симуляции одновременно, результаты — в порядке лобби
+    assert max(peak) == 3
+    assert [r["user_id"] for r in res] == ["u1", "u2", "u3"]
+    assert res[1]["error"] == "нет машины" and "result" in res[0]
+    assert [e["user_id"] for e in events] == ["u2", "u3", "u1"]
+    assert service.pending == 0
+    lobby.reset_lobbies()
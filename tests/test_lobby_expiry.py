@@ -0,0 +1,120 @@
+import os, sys
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+import asyncio
+import threading
+
+import lobby
+from lobby import LobbyRegistry
+from lobby_expiry import LobbyReaper
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _setup(monkeypatch):
+    monkeypatch.setattr(lobby, "LOBBY_TTL_S", 100.0)
+    monkeypatch.setattr(lobby, "LOBBY_IDLE_S", 30.0)
+    clock = Clock()
+    reg = LobbyRegistry()
+    reg.clock = clock
+    expired = []
+
+    async def on_expire(lid, snapshot):
+        expired.append((lid, [p["user_id"] for p in snapshot["players"]]))
+
+    return clock, reg, LobbyReaper(reg, on_expire), expired
+
+
+def _player(uid):
+    return {"user_id": uid, "name": uid, "chat_id": "c"}
+
+
+def test_idle_lobby_closes_and_busy_one_is_rescheduled_lazily(monkeypatch):
+    clock, reg, reaper, expired = _setup(monkeypatch)
+
+    async def main():
+        reaper.attach(asyncio.get_running_loop())
+        a = reg.create("t")
+        b = reg.create("t")
+        reg.join(a, _player("u1"))
+        clock.now = 10
+        reg.join(b, _player("u2"))
+        # дедлайн «b» сдвинулся позже — новой записи в куче нет
+        assert len(reaper._heap) == 2 and reaper.pending() == 2
+        assert reaper._timer_at == 30
+        clock.now = 31
+        reaper._fire()
+        await asyncio.sleep(0)
+        assert expired == [(a, ["u1"])]
+        assert a not in reg and b in reg
+        # «b» ещё жив: его перепланировали на настоящий дедлайн
+        assert [e[0] for e in reaper._heap] == [40] and reaper._timer_at == 40
+        return b
+
+    b = asyncio.run(main())
+    assert reg.find_user("u1") is None and reg.find_user("u2") == b
+
+
+def test_racing_and_closes_at_transitions(monkeypatch):
+    clock, reg, reaper, expired = _setup(monkeypatch)
+
+    async def main():
+        reaper.attach(asyncio.get_running_loop())
+        lid = reg.create("t")
+        reg.join(lid, _player("u1"))
+        clock.now = 5
+        reg.set_racing(lid, True)
+        # во время гонки действует только TTL
+        assert reg.expires_at(lid) == 100
+        clock.now = 31
+        reaper._fire()
+        assert lid in reg and reaper._scheduled[lid] == 100
+        clock.now = 50
+        reg.set_racing(lid, False)
+        assert reaper._scheduled[lid] == 80
+        reg.close_after(lid, 10)
+        assert reaper._scheduled[lid] == 60 and reaper._timer_at == 60
+        clock.now = 60
+        reaper._fire()
+        await asyncio.sleep(0)
+        assert expired == [(lid, ["u1"])]
+        # устаревшие записи (80, 100) просто пропускаются
+        clock.now = 101
+        reaper._fire()
+        await asyncio.sleep(0)
+        assert reaper._heap == [] and reaper.pending() == 0
+        assert len(expired) == 1
+
+    asyncio.run(main())
+
+
+def test_removed_lobby_is_forgotten_and_thread_changes_reach_the_loop(monkeypatch):
+    clock, reg, reaper, expired = _setup(monkeypatch)
+
+    async def main():
+        reaper.attach(asyncio.get_running_loop())
+        gone = reg.create("t")
+        reg.join(gone, _player("u1"))
+        reg.leave(gone, "u1")
+        assert reaper.pending() == 0
+        kept = reg.create("t")
+        clock.now = 20
+        # изменения из потока пула доходят до цикла через call_soon_threadsafe
+        t = threading.Thread(target=reg.close_after, args=(kept, 1))
+        t.start()
+        t.join()
+        assert reaper._scheduled[kept] == 30
+        await asyncio.sleep(0)
+        assert reaper._scheduled[kept] == 21
+        clock.now = 30
+        reaper._fire()
+        await asyncio.sleep(0)
+        assert expired == [(kept, [])]
+
+    asyncio.run(main())
@@ -0,0 +1,105 @@
+import os, sys, pytest
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+import threading
+
+from lobby import MAX_PLAYERS, LobbyRegistry
+
+
+def _player(uid):
+    return {"user_id": uid, "name": uid, "chat_id": "c"}
+
+
+def _race(n, fn):
+    """Run ``fn(i)`` in ``n`` threads released at once; return what they raised."""
+    barrier = threading.Barrier(n)
+    errors = []
+
+    def worker(i):
+        barrier.wait()
+        try:
+            fn(i)
+        except RuntimeError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return errors
+
+
+def test_user_index_follows_join_leave_and_close():
+    reg = LobbyRegistry()
+    a, b = reg.create("t1"), reg.create("t2")
+    reg.join(a, _player("u1"))
+    reg.join(b, _player("u2"))
+    reg.join(b, _player("u3"))
+    # поиск идёт по индексу, а не перебором лобби
+    assert reg._user_lobby == {"u1": a, "u2": b, "u3": b}
+    assert reg.find_user("u2") == b and reg.find_user("nobody") is None
+    reg.leave(b, "u2")
+    assert reg.find_user("u2") is None
+    reg.close(b)
+    assert reg._user_lobby == {"u1": a}
+    reg.leave(a, "u1")
+    assert reg._user_lobby == {} and len(reg) == 0
+
+
+def test_concurrent_joins_keep_one_lobby_per_user():
+    reg = LobbyRegistry()
+    lids = [reg.create("t") for _ in range(8)]
+    errors = _race(8, lambda i: reg.join(lids[i], _player("u1")))
+    assert len(errors) == 7
+    lid = reg.find_user("u1")
+    assert [l for l in lids if any(p["user_id"] == "u1" for p in reg[l]["players"])] == [lid]
+
+
+def test_concurrent_joins_respect_capacity():
+    reg = LobbyRegistry()
+    lid = reg.create("t")
+    errors = _race(MAX_PLAYERS + 4, lambda i: reg.join(lid, _player(f"u{i}")))
+    assert len(errors) == 4
+    players = reg[lid]["players"]
+    assert len(players) == MAX_PLAYERS
+    assert {p["user_id"] for p in players} == {u for u, l in reg._user_lobby.items() if l == lid}
+    # повторный вход участника не занимает второе место
+    reg.join(lid, _player(players[0]["user_id"]))
+    assert len(reg[lid]["players"]) == MAX_PLAYERS
+
+
+def test_listeners_hear_every_change_and_failures_are_contained():
+    reg = LobbyRegistry()
+    seen = []
+
+    def broken(lid):
+        raise ValueError("сломался")
+
+    reg.add_listener(broken)
+    reg.add_listener(seen.append)
+    lid = reg.create("t")
+    reg.join(lid, _player("u1"))
+    reg.set_racing(lid, True)
+    reg.set_racing(lid, False)
+    reg.close_after(lid, 5)
+    reg.leave(lid, "u1")
+    assert seen == [lid] * 6
+    # отказ не меняет ничего и никого не оповещает
+    with pytest.raises(RuntimeError):
+        reg.join("missing", _player("u2"))
+    assert len(seen) == 6
+
+
+def test_snapshots_are_isolated_copies():
+    reg = LobbyRegistry()
+    lid = reg.create("t")
+    player = _player("u1")
+    reg.join(lid, player)
+    player["name"] = "changed"
+    snap = reg[lid]
+    snap["players"][0]["name"] = "hacked"
+    snap["players"].append(_player("ghost"))
+    reg.snapshot()[lid]["track_id"] = "other"
+    assert reg.get(lid) == {"track_id": "t", "players": [_player("u1")]}
+    assert reg.get("missing", {}) == {} and "racing" not in reg[lid]
@@ -0,0 +1,135 @@
+import os, sys, pytest
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+import sqlite3
+import threading
+import time
+
+from lobby_store import SqliteLobbyRegistry
+
+
+def _open(path, **kw):
+    opts = dict(max_players=2, ttl_s=100.0, idle_s=30.0, poll_s=0.01)
+    opts.update(kw)
+    return SqliteLobbyRegistry(path, **opts)
+
+
+def _player(uid):
+    return {"user_id": uid, "name": uid, "chat_id": "c"}
+
+
+def _changes(path):
+    with sqlite3.connect(str(path)) as conn:
+        return conn.execute("SELECT COUNT(*) FROM changes").fetchone()[0]
+
+
+def test_rules_hold_across_instances(tmp_path):
+    db = tmp_path / "lobbies.sqlite3"
+    a, b = _open(db), _open(db)
+    lid = a.create("t1")
+    b.join(lid, _player("u1"))
+    assert a.find_user("u1") == lid
+    other = b.create("t2")
+    with pytest.raises(RuntimeError):
+        a.join(other, _player("u1"))
+    a.join(lid, _player("u2"))
+    with pytest.raises(RuntimeError):
+        b.join(lid, _player("u3"))
+    # порядок игроков общий: первым остаётся хост
+    assert [p["user_id"] for p in b[lid]["players"]] == ["u1", "u2"]
+    assert set(a.snapshot()) == {lid, other}
+    with pytest.raises(KeyError):
+        b["missing"]
+
+
+def test_failed_mutations_roll_back_and_log_nothing(tmp_path):
+    db = tmp_path / "lobbies.sqlite3"
+    a, b = _open(db), _open(db)
+    lid = a.create("t1")
+    a.join(lid, _player("u1"))
+    a.join(lid, _player("u2"))
+    before = _changes(db)
+    with pytest.raises(RuntimeError):
+        b.join(lid, _player("u3"))
+    with pytest.raises(RuntimeError):
+        b.set_racing("missing", True)
+    b.set_racing(lid, True)
+    with pytest.raises(RuntimeError):
+        a.set_racing(lid, True)
+    assert _changes(db) == before + 1
+    assert b.find_user("u3") is None
+    # последний вышедший игрок удаляет лобби в той же транзакции
+    a.leave(lid, "u1")
+    b.leave(lid, "u2")
+    assert lid not in a and len(b) == 0
+
+
+def test_expiry_uses_shared_deadlines(tmp_path):
+    db = tmp_path / "lobbies.sqlite3"
+    now = [1000.0]
+    a, b = _open(db), _open(db)
+    a.clock = b.clock = lambda: now[0]
+    lid = a.create("t1")
+    assert b.expires_at(lid) == 1030.0
+    now[0] = 1010.0
+    b.set_racing(lid, True)
+    assert a.expires_at(lid) == 1100.0
+    b.set_racing(lid, False)
+    a.close_after(lid, 5)
+    assert b.expires_at(lid) == 1015.0
+    snap = b.close(lid)
+    assert snap == {"track_id": "t1", "players": []}
+    assert a.expires_at(lid) is None and a.close(lid) is None
+
+
+def test_poller_forwards_changes_from_another_instance(tmp_path):
+    db = tmp_path / "lobbies.sqlite3"
+    a, b = _open(db), _open(db)
+    seen = []
+    got = threading.Event()
+
+    def listener(lid):
+        seen.append(lid)
+        got.set()
+
+    b.add_listener(listener)
+    # дать поллеру запомнить исходный data_version
+    time.sleep(0.05)
+    lid = a.create("t1")
+    assert got.wait(5.0)
+    assert lid in seen
+    got.clear()
+    a.join(lid, _player("u1"))
+    assert got.wait(5.0)
+    # журнал изменений не переигрывается заново
+    assert b._last_change == _changes(db)
+
+
+def test_own_changes_are_not_echoed_by_the_poller(tmp_path):
+    db = tmp_path / "lobbies.sqlite3"
+    a, b = _open(db), _open(db)
+    seen = []
+    b.add_listener(seen.append)
+    time.sleep(0.05)
+    own = b.create("t1")
+    b.join(own, _player("u1"))
+    assert seen == [own, own]
+    other = a.create("t2")
+    deadline = time.monotonic() + 5.0
+    while other not in seen and time.monotonic() < deadline:
+        time.sleep(0.01)
+    # свои записи пришли только напрямую, чужая — через поллер
+    assert seen == [own, own, other]
+    assert b._last_change == _changes(db) and not b._own
+
+
+def test_failing_listener_is_logged(tmp_path, caplog):
+    reg = _open(tmp_path / "lobbies.sqlite3")
+
+    def broken(lid):
+        raise ValueError("сломался")
+
+    reg._listeners.append(broken)
+    with caplog.at_level("ERROR", logger="lobby_store"):
+        reg.create("t1")
+    assert "Lobby listener failed" in caplog.text
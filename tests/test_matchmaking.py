@@ -0,0 +1,62 @@
+import os, sys, pytest
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+import lobby
+from matchmaking import MM_FILL_WAIT_S, MatchQueue, Ticket, form_lobby
+
+
+def _ticket(uid, pi, track="t1", tier="A"):
+    return Ticket(user_id=uid, name=uid, chat_id="c" + uid, track_id=track, tier=tier, pi=pi)
+
+
+def test_waiting_ticket_matches_once_its_window_widens():
+    q = MatchQueue(lobby_size=2, min_players=2)
+    assert q.enqueue(_ticket("a", 100.0), now=0.0) is None
+    # у новичка окно ещё узкое: 100 не входит в его ±5%
+    assert q.enqueue(_ticket("b", 110.0), now=1.0) is None
+    assert q.tick(now=2.0) == []
+    # через 3 с ожидания окно «a» — 11%, полное лобби собирается задолго до MM_FILL_WAIT_S
+    (m,) = q.tick(now=3.0)
+    assert {t.user_id for t in m.tickets} == {"a", "b"}
+    assert len(q) == 0
+
+
+def test_partial_lobby_forms_after_fill_wait():
+    q = MatchQueue(lobby_size=4, min_players=2)
+    q.enqueue(_ticket("a", 100.0), now=0.0)
+    q.enqueue(_ticket("b", 101.0), now=0.0)
+    assert q.tick(now=MM_FILL_WAIT_S - 1) == []
+    (m,) = q.tick(now=MM_FILL_WAIT_S)
+    assert len(m.tickets) == 2
+
+
+def test_young_tickets_are_not_starved_by_old_unmatched_ones():
+    q = MatchQueue(lobby_size=2, min_players=2)
+    # 300 старых одиночек, каждый на своей трассе — им не с кем играть
+    for i in range(300):
+        q.enqueue(_ticket(f"old{i}", 100.0, track=f"solo{i}"), now=0.0)
+    q.enqueue(_ticket("a", 100.0), now=100.0)
+    q.enqueue(_ticket("b", 110.0), now=101.0)
+    (m,) = q.tick(now=104.0)
+    assert {t.user_id for t in m.tickets} == {"a", "b"}
+    assert len(q) == 300
+
+
+def test_failed_form_lobby_requeues_others_and_closes_lobby():
+    lobby.reset_lobbies()
+    busy = lobby.create_lobby("elsewhere")
+    lobby.join_lobby(busy, "u2", "u2", chat_id="c")
+    q = MatchQueue(lobby_size=3, min_players=2)
+    for uid, at in (("u1", 0.0), ("u2", 1.0)):
+        q.enqueue(_ticket(uid, 100.0), now=at)
+    m = q.enqueue(_ticket("u3", 100.0), now=2.0)
+    assert m is not None and len(q) == 0
+    with pytest.raises(RuntimeError):
+        form_lobby(m, q)
+    # недособранное лобби закрыто, остальные вернулись со своим временем ожидания
+    assert lobby.find_user_lobby("u1") is None
+    assert [l for l in lobby.LOBBIES.snapshot().values() if l["track_id"] == "t1"] == []
+    assert q.is_queued("u1") and q.is_queued("u3") and not q.is_queued("u2")
+    (again,) = q.tick(now=MM_FILL_WAIT_S)
+    assert [t.user_id for t in again.tickets] == ["u1", "u3"]
+    lobby.reset_lobbies()
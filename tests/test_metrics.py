@@ -0,0 +1,70 @@
+import os, sys, pytest
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+import asyncio
+import urllib.request
+
+import metrics
+from loadtest_webhook import make_update
+from telegram import Update
+from update_processor import PerUserUpdateProcessor
+
+
+def test_disabled_metrics_record_nothing():
+    metrics.set_enabled(False)
+    h = metrics.Histogram("test_disabled_seconds", "test")
+    h.observe(0.5)
+    assert h.count() == 0
+
+
+def test_histogram_and_counter_render_prometheus_text():
+    metrics.set_enabled(True)
+    try:
+        h = metrics.Histogram("test_latency_seconds", "Test latency.", ("name",), buckets=(0.1, 1.0), max_series=2)
+        h.observe(0.05, "a")
+        h.observe(0.5, "a")
+        h.observe(5.0, "b")
+        h.observe(0.05, "c")  # третья серия сверх лимита уходит в "other"
+        c = metrics.Counter("test_events_total", "Test events.", ("kind",))
+        c.inc("x")
+        c.inc("x", amount=2)
+        text = metrics.render()
+    finally:
+        metrics.set_enabled(False)
+    assert "# TYPE test_latency_seconds histogram" in text
+    assert 'test_latency_seconds_bucket{name="a",le="0.1"} 1' in text
+    assert 'test_latency_seconds_bucket{name="a",le="1"} 2' in text
+    assert 'test_latency_seconds_bucket{name="a",le="+Inf"} 2' in text
+    assert 'test_latency_seconds_count{name="b"} 1' in text
+    assert 'test_latency_seconds_count{name="other"} 1' in text
+    assert 'test_events_total{kind="x"} 3' in text
+
+
+def test_update_latency_by_command_and_http_endpoint():
+    metrics.set_enabled(True)
+    metrics.UPDATE_SECONDS.reset()
+    proc = PerUserUpdateProcessor(concurrency=4)
+
+    async def handler():
+        await asyncio.sleep(0.01)
+
+    async def main():
+        for i, (text, data) in enumerate([("/garage", None), ("/garage@RaceBot", None), (None, "buy:lada")]):
+            upd = Update.de_json(make_update(i + 1, 5, text, data), None)
+            await proc.process_update(upd, handler())
+
+    try:
+        asyncio.run(main())
+        server = metrics.serve(0)
+        port = server.server_address[1]
+        body = urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics").read().decode()
+    finally:
+        metrics.set_enabled(False)
+    assert metrics.UPDATE_SECONDS.count("command", "garage") == 2
+    assert metrics.UPDATE_SECONDS.count("callback", "buy") == 1
+    assert 'bot_update_seconds_count{kind="command",name="garage"} 2' in body
+
+
+def test_metric_base_requires_render():
+    with pytest.raises(TypeError):
+        metrics._Metric("x_total", "нет render")
@@ -0,0 +1,78 @@
+import os, sys, json, importlib
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+import pytest
+
+import economy_v1
+import migrate_players
+
+
+def _write(path, data):
+    path.write_text(json.dumps(data), encoding="utf-8")
+
+
+def _legacy(uid):
+    return {
+        "user_id": uid,
+        "name": "Old",
+        "balance": 500,
+        "garage": ["lada_2107"],
+        "upgrades": {"lada_2107": ["engine"], "vaz": 2, "golf": {"level": 1, "parts": ["ecu"]}},
+        "driver_json": json.dumps({"skill": 1.5}),
+    }
+
+
+def test_legacy_document_is_migrated():
+    data = _legacy("1")
+    assert economy_v1.migrate_player_data(data) is True
+    assert data["schema_version"] == economy_v1.PLAYER_SCHEMA_VERSION
+    assert data["upgrades"]["lada_2107"] == {"level": 0, "parts": ["engine"], "custom_done": False}
+    assert data["upgrades"]["vaz"]["level"] == 2
+    assert data["upgrades"]["golf"] == {"level": 1, "parts": ["ecu"], "custom_done": False}
+    assert data["driver"] == {"skill": 1.5} and "driver_json" not in data
+    assert economy_v1.migrate_player_data(data) is False
+
+
+def test_corrupt_file_is_quarantined(tmp_path, monkeypatch):
+    monkeypatch.setattr(economy_v1, "USERS_DIR", tmp_path)
+    (tmp_path / "7.json").write_text("{oops", encoding="utf-8")
+    p = economy_v1._read_player("7", "New")
+    assert p.balance == economy_v1.DEFAULT_START_BALANCE
+    assert [f.name.split("-")[0] for f in tmp_path.glob("7.json.corrupt-*")] == ["7.json.corrupt"]
+
+
+def test_newer_schema_is_refused_not_reset(tmp_path, monkeypatch):
+    monkeypatch.setattr(economy_v1, "USERS_DIR", tmp_path)
+    newer = dict(_legacy("8"), schema_version=economy_v1.PLAYER_SCHEMA_VERSION + 1, balance=99_999)
+    _write(tmp_path / "8.json", newer)
+    with pytest.raises(economy_v1.PlayerSchemaTooNew):
+        economy_v1._read_player("8", "Old")
+    # файл на месте и не изменён
+    assert json.loads((tmp_path / "8.json").read_text(encoding="utf-8")) == newer
+    assert not list(tmp_path.glob("*.corrupt-*"))
+
+
+def test_migration_command_dry_run_and_report(tmp_path, capsys):
+    # другие тесты перезагружают economy_v1; берём его текущие классы
+    importlib.reload(migrate_players)
+    users = tmp_path / "users"
+    users.mkdir()
+    _write(users / "1.json", _legacy("1"))
+    _write(users / "2.json", dict(_legacy("2"), schema_version=migrate_players.PLAYER_SCHEMA_VERSION + 1))
+    (users / "3.json").write_text("{oops", encoding="utf-8")
+    before = {f.name: f.read_text(encoding="utf-8") for f in users.iterdir()}
+
+    assert migrate_players.main(["--root", str(users), "--workers", "2", "--dry-run"]) == 0
+    report = json.loads(capsys.readouterr().out)
+    assert report["dry_run"] is True
+    assert report["counts"] == {"migrated": 1, "newer": 1, "corrupt": 1}
+    assert {f.name: f.read_text(encoding="utf-8") for f in users.iterdir()} == before
+
+    out = tmp_path / "report.json"
+    assert migrate_players.main(["--root", str(users), "--report", str(out)]) == 0
+    capsys.readouterr()
+    assert json.loads(out.read_text(encoding="utf-8"))["counts"]["migrated"] == 1
+    assert json.loads((users / "1.json").read_text(encoding="utf-8"))["schema_version"] == economy_v1.PLAYER_SCHEMA_VERSION
+    # повторный запуск ничего не переписывает
+    migrate_players.main(["--root", str(users)])
+    assert json.loads(capsys.readouterr().out)["counts"]["current"] == 1
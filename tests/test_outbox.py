@@ -0,0 +1,109 @@
+import os, sys
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+import asyncio
+import time
+from datetime import timedelta
+
+from telegram.error import RetryAfter
+
+from outbox import Outbox, PRIORITY_EVENT, PRIORITY_RESULT, PRIORITY_TICK
+
+
+class FakeBot:
+    def __init__(self, fail_with=None):
+        self.sent = []
+        self.fail_with = list(fail_with or [])
+
+    async def send_message(self, chat_id, text, parse_mode=None, reply_markup=None):
+        if self.fail_with:
+            raise self.fail_with.pop(0)
+        self.sent.append((chat_id, text, time.monotonic()))
+        return len(self.sent)
+
+
+def test_results_overtake_ticks_and_ticks_coalesce():
+    bot = FakeBot()
+
+    async def main():
+        ob = Outbox(bot, chat_rate=50, chat_burst=1, global_rate=1000, global_burst=100)
+        ob.send(1, "start")
+        ob.send(1, "tick 1", priority=PRIORITY_TICK, coalesce="tick")
+        ob.send(1, "tick 2", priority=PRIORITY_TICK, coalesce="tick")
+        ob.send(1, "lap", priority=PRIORITY_EVENT)
+        res = ob.send(1, "finish", priority=PRIORITY_RESULT)
+        await res
+        await ob.drain()
+        await ob.stop()
+        return ob
+
+    ob = asyncio.run(main())
+    assert [t for _, t, _ in bot.sent] == ["finish", "start", "lap", "tick 2"]
+    assert ob.coalesced == 1
+
+
+def test_chat_rate_is_respected_per_chat():
+    bot = FakeBot()
+
+    async def main():
+        ob = Outbox(bot, chat_rate=20, chat_burst=1, global_rate=1000, global_burst=100)
+        for i in range(4):
+            ob.send("a", f"a{i}")
+            ob.send("b", f"b{i}")
+        await ob.drain()
+        await ob.stop()
+
+    asyncio.run(main())
+    a_times = [ts for cid, _, ts in bot.sent if cid == "a"]
+    assert len(a_times) == 4 and len(bot.sent) == 8
+    # 1 сообщение сразу, затем по одному раз в 50 мс
+    assert a_times[-1] - a_times[0] >= 0.14
+
+
+def test_retry_after_pauses_chat_and_resends():
+    bot = FakeBot(fail_with=[RetryAfter(timedelta(milliseconds=100))])
+
+    async def main():
+        ob = Outbox(bot, chat_rate=100, chat_burst=5, global_rate=1000, global_burst=100)
+        started = time.monotonic()
+        fut = ob.send(7, "hello")
+        other = ob.send(8, "other chat")
+        assert await other == 1
+        assert await fut == 2
+        await ob.stop()
+        return time.monotonic() - started, ob
+
+    elapsed, ob = asyncio.run(main())
+    assert [t for _, t, _ in bot.sent] == ["other chat", "hello"]
+    assert elapsed >= 0.1
+    assert ob.retried == 1
+
+
+def test_broadcast_dedupes_runs_concurrently_and_isolates_failures():
+    class SlowBot:
+        def __init__(self):
+            self.sent = []
+
+        async def send_message(self, chat_id, text, parse_mode=None, reply_markup=None):
+            await asyncio.sleep(0.05)
+            if chat_id == "blocked":
+                raise RuntimeError("bot was blocked by the user")
+            self.sent.append(chat_id)
+            return chat_id
+
+    bot = SlowBot()
+
+    async def main():
+        ob = Outbox(bot, chat_rate=1, chat_burst=1, global_rate=1000, global_burst=100)
+        started = time.monotonic()
+        fan = await ob.broadcast([1, 2, "blocked", 2, 3, 1, 4, 5, 6, 7], "lobby")
+        elapsed = time.monotonic() - started
+        await ob.stop()
+        return fan, elapsed
+
+    fan, elapsed = asyncio.run(main())
+    assert sorted(bot.sent) == [1, 2, 3, 4, 5, 6, 7]
+    assert set(fan.sent) == {1, 2, 3, 4, 5, 6, 7}
+    assert list(fan.failed) == ["blocked"]
+    # 8 чатов за одно время ответа, а не за восемь
+    assert elapsed < 0.2
@@ -0,0 +1,121 @@
+import os, sys
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+import asyncio
+import json
+
+import economy_v1
+from player_store import PlayerStore, aload_player, player_saved
+
+
+def _read(tmp_path, uid):
+    return json.loads((tmp_path / f"{uid}.json").read_text(encoding="utf-8"))
+
+
+def test_saves_are_coalesced_and_durable(tmp_path, monkeypatch):
+    monkeypatch.setattr(economy_v1, "USERS_DIR", tmp_path)
+    store = PlayerStore()
+    p = store.load("1", "Tester")
+    assert store.load("1", "Tester") is p
+
+    futures = []
+    for i in range(50):
+        p.balance = i
+        futures.append(store.save(p))
+    store.flush()
+    assert all(f.done() and f.exception() is None for f in futures)
+    assert _read(tmp_path, "1")["balance"] == 49
+    assert store.writes < 50
+    assert store.writes + store.coalesced == 50
+    assert store.load("1", "Tester") is p
+    store.close()
+
+
+def test_external_change_invalidates_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(economy_v1, "USERS_DIR", tmp_path)
+    store = PlayerStore()
+    p = store.load("2", "Tester")
+    other = economy_v1.player_from_data(_read(tmp_path, "2"))
+    other.balance = 777
+    # так файл меняет другой процесс бота
+    economy_v1._atomic_write(tmp_path / "2.json", other.to_json())
+    fresh = store.load("2", "Tester")
+    assert fresh is not p and fresh.balance == 777
+    store.close()
+
+
+def test_async_facade_routes_economy_through_store(tmp_path, monkeypatch):
+    monkeypatch.setattr(economy_v1, "USERS_DIR", tmp_path)
+    store = PlayerStore()
+    economy_v1.use_player_store(store)
+    try:
+        async def main():
+            p = await aload_player("3", "Tester")
+            assert await aload_player("3", "Tester") is p
+            p.balance = 123
+            store.save(p)
+            await player_saved("3")
+            assert _read(tmp_path, "3")["balance"] == 123
+            # функции экономики сохраняют через то же хранилище
+            economy_v1.set_current_track(p, "brands_hatch")
+            assert economy_v1.load_player("3", "Tester") is p
+
+        asyncio.run(main())
+        store.flush()
+        assert _read(tmp_path, "3")["current_track"] == "brands_hatch"
+    finally:
+        economy_v1.use_player_store(None)
+        store.close()
+
+
+def test_cached_reads_stat_nothing_on_the_loop_within_recheck(tmp_path, monkeypatch):
+    import player_store
+    monkeypatch.setattr(economy_v1, "USERS_DIR", tmp_path)
+    store = PlayerStore(recheck_s=60.0)
+    p = store.load("4", "Tester")
+    calls = []
+    real = player_store._file_signature
+    monkeypatch.setattr(player_store, "_file_signature", lambda uid: calls.append(uid) or real(uid))
+
+    async def main():
+        assert await store.get("4", "Tester") is p
+        assert await store.get("4", "Tester") is p
+        store.recheck_s = 0.0
+        # устаревшая запись сверяется с файлом, но уже в пуле потоков
+        assert await store.get("4", "Tester") is p
+
+    asyncio.run(main())
+    assert calls == ["4"]
+    store.close()
+
+
+def test_player_saved_waits_for_the_write_and_reports_failure(tmp_path, monkeypatch):
+    monkeypatch.setattr(economy_v1, "USERS_DIR", tmp_path)
+    store = PlayerStore()
+    economy_v1.use_player_store(store)
+    try:
+        p = store.load("5", "Tester")
+        store.flush()
+
+        def broken(path, text):
+            raise OSError("диск заполнен")
+
+        async def main():
+            p.balance = 10
+            store.save(p)
+            await player_saved("5")
+            assert _read(tmp_path, "5")["balance"] == 10
+            monkeypatch.setattr(economy_v1, "_atomic_write", broken)
+            p.balance = 20
+            store.save(p)
+            try:
+                await player_saved("5")
+            except OSError:
+                return True
+            return False
+
+        assert asyncio.run(main())
+        assert _read(tmp_path, "5")["balance"] == 10
+    finally:
+        economy_v1.use_player_store(None)
+        store.close()
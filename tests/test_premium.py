@@ -14,3 +14,46 @@ def test_premium_unlimited_races(tmp_path, monkeypatch):
     p = economy_v1.load_player("42", "Tester")
     for _ in range(game_api.MAX_RACES_PER_DAY + 5):
         game_api._check_daily_limit(p)
+
+
+def test_expiry_and_bad_dates(tmp_path):
+    from datetime import date
+    from premium import PremiumRegistry
+
+    path = tmp_path / "premium.txt"
+    path.write_text(
+        "# комментарий\n1\n2 2025-06-30\n3 2025-13-01\n4 2025-06-01  # истёк\n", encoding="utf-8"
+    )
+    reg = PremiumRegistry(path)
+    today = date(2025, 6, 15)
+    assert reg.is_premium("1", today)
+    assert reg.is_premium("2", today)
+    assert not reg.is_premium("2", date(2025, 7, 1))
+    # опечатка в дате не даёт вечный премиум
+    assert not reg.is_premium("3", today)
+    assert not reg.is_premium("4", today)
+    assert reg.expires("2") == date(2025, 6, 30)
+    assert reg.premium_many(["1", "2", "3", "4", "5", 1], today) == {"1", "2"}
+
+
+def test_reload_only_when_file_changes(tmp_path, monkeypatch):
+    from premium import PremiumRegistry
+
+    path = tmp_path / "premium.txt"
+    reg = PremiumRegistry(path)
+    assert not reg.is_premium("1")
+    path.write_text("1\n", encoding="utf-8")
+    assert reg.is_premium("1")
+
+    reads = []
+    real_read = type(path).read_text
+    monkeypatch.setattr(type(path), "read_text", lambda self, *a, **k: reads.append(1) or real_read(self, *a, **k))
+    for _ in range(3):
+        assert reg.is_premium("1")
+    assert reads == []
+
+    path.write_text("22\n", encoding="utf-8")
+    assert not reg.is_premium("1") and reg.is_premium("22")
+    assert reads == [1]
+    path.unlink()
+    assert reg.premium_many(["1", "22"]) == set()
@@ -0,0 +1,84 @@
+import os, sys, pathlib
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+import game_api
+import profiling
+from leaderboard import Leaderboards
+from models_v2 import Car, RaceEngine, Track, TrackSegment
+
+DATA_DIR = pathlib.Path(__file__).resolve().parent.parent / "data"
+
+
+def _engine(profile=None):
+    car = Car(id="c", name="Car", power=100, mass=1000, cd=0.35, area=2.0, tire_grip=1.0)
+    track = Track(
+        "t",
+        "Test",
+        [
+            TrackSegment("s1", "straight", 300, 1, 1, 1, 1),
+            TrackSegment("s2", "corner", 100, 2, 2, 1, 1),
+        ],
+    )
+    return RaceEngine(car, track, laps=2, on_event=lambda evt: None, profile=profile)
+
+
+def test_unprofiled_engine_keeps_plain_methods():
+    eng = _engine()
+    eng.run()
+    assert not set(profiling.HOT_PATHS) & set(vars(eng))
+
+
+def test_stack_profile_counts_hot_paths_per_stack():
+    stacks = profiling.StackProfile()
+    eng = _engine(stacks)
+    eng.run()
+    s = stacks.stacks
+    assert s["run"][0] == 1
+    assert s["run;step"][0] == eng.steps
+    assert s["run;step;_step_straight"][0] + s["run;step;_step_corner"][0] == eng.steps
+    assert s["run;step;_step_corner;_maybe_error"][0] == s["run;step;_step_corner"][0]
+    assert s["run;step;_notify"][0] > 0
+    calls, total, own = s["run;step"]
+    children = sum(v[1] for k, v in s.items() if k.count(";") == 2 and k.startswith("run;step;"))
+    assert own == total - children
+
+
+def test_sampled_player_race_records_phases_and_folded_stacks(tmp_path, monkeypatch):
+    # другие тесты перезагружают economy_v1; берём модуль, которым пользуется game_api
+    eco = game_api.load_player.__globals__
+    monkeypatch.setitem(eco, "USERS_DIR", tmp_path)
+    monkeypatch.setitem(eco, "_STORE", None)
+    monkeypatch.setitem(eco, "DATA_DIR", DATA_DIR)
+    monkeypatch.setitem(eco, "CARS_DIR", DATA_DIR / "cars")
+    monkeypatch.setitem(eco, "TRACKS_DIR", DATA_DIR / "tracks")
+    monkeypatch.setattr(game_api, "DATA_DIR", DATA_DIR)
+    boards = Leaderboards(tmp_path / "leaderboards")
+    monkeypatch.setattr(game_api, "get_leaderboards", lambda: boards)
+    profiling.reset()
+    profiling.set_sample_rate(1.0)
+    try:
+        p = eco["load_player"]("prof1", "Prof")
+        cars = eco["list_catalog"]()["cars"]
+        car_id = min(cars, key=lambda c: cars[c]["price"])
+        assert eco["buy_car"](p, car_id).startswith("✅")
+        eco["set_current_track"](p, sorted(eco["list_tracks"]())[0])
+        result = game_api.run_player_race("prof1", "Prof")
+    finally:
+        profiling.set_sample_rate(0.0)
+    [record] = profiling.recent()
+    assert "profile" not in result
+    assert list(record["phases_ms"]) == [
+        "load_player", "load_car", "apply_upgrades", "load_track", "daily_limit",
+        "simulate", "reward", "save", "leaderboard",
+    ]
+    assert record["user_id"] == "prof1" and record["steps"] > 0
+    assert record["hot_paths"]["step"]["calls"] == record["steps"]
+    lines = profiling.folded().splitlines()
+    assert any(line.startswith("race;simulate;run;step ") for line in lines)
+    assert all(int(line.rsplit(" ", 1)[1]) > 0 for line in lines)
+    # в race;simulate остаётся только время вне движка
+    outside = dict(line.rsplit(" ", 1) for line in lines).get("race;simulate", "0")
+    assert int(outside) < record["phases_ms"]["simulate"] * 1000 - record["hot_paths"]["run"]["total_ms"] * 1000 + 2
+
+    assert game_api.run_player_race("prof1", "Prof")["time_s"] > 0
+    assert len(profiling.recent()) == 1
@@ -0,0 +1,56 @@
+import os, sys
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+import asyncio
+import pytest
+
+from race_scheduler import RaceAlreadyActive, RaceQueueFull, RaceScheduler
+
+
+def test_limit_priority_and_positions():
+    sched = RaceScheduler(limit=1, max_queue=5)
+    order = []
+    positions = {}
+
+    async def race(uid, premium=False):
+        def on_position(pos):
+            positions.setdefault(uid, []).append(pos)
+
+        async with sched.slot([uid], premium=premium, on_position=on_position):
+            order.append(uid)
+            await asyncio.sleep(0.01)
+
+    async def main():
+        tasks = [asyncio.create_task(race("a"))]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(race("b")))
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(race("vip", premium=True)))
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+    assert order == ["a", "vip", "b"]
+    assert positions["b"] == [1, 2, 1]
+    m = sched.metrics()
+    assert m.active == 0 and m.queued == 0 and m.admitted == 3
+
+
+def test_one_race_per_user_and_queue_bound():
+    sched = RaceScheduler(limit=1, max_queue=1)
+
+    async def main():
+        async with sched.slot(["a"]):
+            with pytest.raises(RaceAlreadyActive):
+                async with sched.slot(["a"]):
+                    pass
+            waiting = asyncio.create_task(sched.slot(["b"]).__aenter__())
+            await asyncio.sleep(0)
+            with pytest.raises(RaceQueueFull):
+                async with sched.slot(["c"]):
+                    pass
+            waiting.cancel()
+            await asyncio.sleep(0)
+        assert not sched.is_busy("b")
+        assert sched.metrics().rejected == 2
+
+    asyncio.run(main())
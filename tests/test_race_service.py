@@ -0,0 +1,118 @@
+import os, sys
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+import asyncio
+import pathlib
+from concurrent.futures import BrokenExecutor
+
+import pytest
+
+import game_api
+from leaderboard import Leaderboards
+from race_service import RaceJob, RaceService, RaceServiceBusy
+
+
+def test_admit_reserves_places_until_released():
+    svc = RaceService(workers=1, max_pending=2)
+    svc.admit()
+    svc.admit()
+    # места заняты сразу, ещё до запуска симуляции
+    with pytest.raises(RaceServiceBusy):
+        svc.admit()
+    svc.release()
+    svc.admit()
+    assert svc.pending == 2
+
+
+def test_failed_start_gives_the_place_back(monkeypatch):
+    svc = RaceService(workers=1, max_pending=1)
+
+    def broken_start():
+        raise OSError("нет процессов")
+
+    monkeypatch.setattr(svc, "start", broken_start)
+    job = RaceJob(car={}, track_id="t", laps=1, driver={})
+
+    async def main():
+        for _ in range(2):
+            with pytest.raises(OSError):
+                await svc.run(job)
+        svc.admit()
+        with pytest.raises(OSError):
+            await svc.run(job, admitted=True)
+
+    asyncio.run(main())
+    assert svc.pending == 0 and not svc._routes
+
+
+DATA_DIR = pathlib.Path(__file__).resolve().parent.parent / "data"
+
+
+def _race_player(tmp_path, monkeypatch, service):
+    # другие тесты перезагружают economy_v1; берём модуль, которым пользуется game_api
+    eco = game_api.load_player.__globals__
+    monkeypatch.setitem(eco, "USERS_DIR", tmp_path)
+    monkeypatch.setitem(eco, "_STORE", None)
+    monkeypatch.setitem(eco, "DATA_DIR", DATA_DIR)
+    monkeypatch.setitem(eco, "CARS_DIR", DATA_DIR / "cars")
+    monkeypatch.setitem(eco, "TRACKS_DIR", DATA_DIR / "tracks")
+    monkeypatch.setattr(game_api, "DATA_DIR", DATA_DIR)
+    boards = Leaderboards(tmp_path / "leaderboards")
+    monkeypatch.setattr(game_api, "get_leaderboards", lambda: boards)
+    monkeypatch.setattr(game_api, "get_race_service", lambda: service)
+    p = eco["load_player"]("svc1", "Svc")
+    cars = eco["list_catalog"]()["cars"]
+    eco["buy_car"](p, min(cars, key=lambda c: cars[c]["price"]))
+    eco["set_current_track"](p, sorted(eco["list_tracks"]())[0])
+    return eco
+
+
+def test_worker_streams_events_and_the_race_is_settled(tmp_path, monkeypatch, caplog):
+    service = RaceService(workers=1, max_pending=2, data_dir=DATA_DIR)
+    eco = _race_player(tmp_path, monkeypatch, service)
+    balance = eco["load_player"]("svc1", "Svc").balance
+    events = []
+
+    def on_event(evt):
+        events.append(evt)
+        if len(events) == 1:
+            raise ValueError("сломался")
+
+    async def main():
+        try:
+            return await game_api.run_player_race_async("svc1", "Svc", on_event=on_event)
+        finally:
+            await service.shutdown()
+
+    with caplog.at_level("ERROR", logger="race_service"):
+        result = asyncio.run(main())
+    # упавший обработчик залогирован, а поток событий не прервался
+    assert "Race event callback failed" in caplog.text
+    assert len(events) > 1 and any(e.get("type") == "segment_tick" for e in events)
+    assert result["time_s"] > 0 and result["reward"] > 0
+    assert eco["load_player"]("svc1", "Svc").balance == balance + result["reward"]
+    assert service.pending == 0
+
+
+def test_broken_pool_is_replaced_by_the_next_job(tmp_path, monkeypatch):
+    service = RaceService(workers=1, max_pending=2, data_dir=DATA_DIR)
+    _race_player(tmp_path, monkeypatch, service)
+
+    async def main():
+        try:
+            service.start()
+            broken = service._pool
+            for proc in list(broken._processes.values()):
+                proc.kill()
+                proc.join()
+            with pytest.raises(BrokenExecutor):
+                await game_api.run_player_race_async("svc1", "Svc")
+            assert service._pool is None and service.pending == 0
+            # следующая гонка поднимает новый пул
+            result = await game_api.run_player_race_async("svc1", "Svc")
+            assert service._pool is not None and service._pool is not broken
+            return result
+        finally:
+            await service.shutdown()
+
+    assert asyncio.run(main())["time_s"] > 0
@@ -0,0 +1,123 @@
+import os, sys
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+import asyncio
+
+import pytest
+
+from single_flight import OperationInProgress, SingleFlight
+
+
+def test_concurrent_identical_requests_share_one_run():
+    flights = SingleFlight(window_s=0)
+    runs = []
+
+    async def op():
+        runs.append(1)
+        await asyncio.sleep(0.02)
+        return len(runs)
+
+    async def main():
+        return await asyncio.gather(*(flights.run("u1", "race", op) for _ in range(3)))
+
+    results = asyncio.run(main())
+    assert runs == [1]
+    assert [r for r, _ in results] == [1, 1, 1]
+    assert sorted(shared for _, shared in results) == [False, True, True]
+
+
+def test_duplicate_within_window_is_coalesced_then_forgotten():
+    flights = SingleFlight(window_s=0.05)
+    runs = []
+
+    async def op():
+        runs.append(1)
+        return len(runs)
+
+    async def main():
+        first = await flights.run("u1", "buy:lada", op)
+        # обработчики одного пользователя идут по очереди: повтор приходит после первого
+        second = await flights.run("u1", "buy:lada", op)
+        other_user = await flights.run("u2", "buy:lada", op)
+        await asyncio.sleep(0.08)
+        later = await flights.run("u1", "buy:lada", op)
+        return first, second, other_user, later
+
+    first, second, other_user, later = asyncio.run(main())
+    assert first == (1, False)
+    assert second == (1, True)
+    assert other_user == (2, False)
+    assert later == (3, False)
+
+
+def test_exclusive_operation_rejects_others_of_same_user():
+    flights = SingleFlight(window_s=0)
+    gate = None
+
+    async def race():
+        await gate.wait()
+        return "done"
+
+    async def main():
+        nonlocal gate
+        gate = asyncio.Event()
+        running = asyncio.ensure_future(flights.run("u1", "race", race, exclusive=True))
+        await asyncio.sleep(0)
+        assert flights.active("u1") == "race"
+        with pytest.raises(OperationInProgress):
+            await flights.run("u1", "lobby", race, exclusive=True)
+        # не эксклюзивные операции и другие пользователи не ждут
+        assert await flights.run("u1", "garage", lambda: asyncio.sleep(0, "ok")) == ("ok", False)
+        gate.set()
+        assert await running == ("done", False)
+        assert flights.active("u1") is None
+
+    asyncio.run(main())
+
+
+def test_cancelled_caller_does_not_cancel_shared_work_and_errors_are_shared():
+    flights = SingleFlight(window_s=0.05)
+    finished = []
+
+    async def slow():
+        await asyncio.sleep(0.03)
+        finished.append(1)
+        return 1
+
+    async def broken():
+        raise RuntimeError("нет денег")
+
+    async def main():
+        first = asyncio.ensure_future(flights.run("u1", "race", slow))
+        await asyncio.sleep(0)
+        first.cancel()
+        assert await flights.run("u1", "race", slow) == (1, True)
+        for _ in range(2):
+            with pytest.raises(RuntimeError, match="нет денег"):
+                await flights.run("u1", "buy", broken)
+
+    asyncio.run(main())
+    assert finished == [1]
+
+
+def test_repeat_of_running_exclusive_operation_is_refused_not_awaited():
+    flights = SingleFlight(window_s=0.05)
+    gate = None
+
+    async def race():
+        await gate.wait()
+        return "done"
+
+    async def main():
+        nonlocal gate
+        gate = asyncio.Event()
+        running = asyncio.ensure_future(flights.run("u1", "race", race, exclusive=True))
+        await asyncio.sleep(0)
+        with pytest.raises(OperationInProgress):
+            await flights.run("u1", "race", race, exclusive=True)
+        gate.set()
+        assert await running == ("done", False)
+        # после завершения повтор в пределах окна получает общий результат
+        assert await flights.run("u1", "race", race, exclusive=True) == ("done", True)
+
+    asyncio.run(main())
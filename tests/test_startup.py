@@ -0,0 +1,67 @@
+import os, sys, pytest
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+import asyncio
+import subprocess
+import time
+
+import bot_kb
+import startup
+from economy_v1 import list_catalog
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_timer_reports_phases_in_order():
+    timer = startup.StartupTimer()
+    time.sleep(0.01)
+    timer.mark("import")
+    timer.mark("build_app")
+    report = timer.report()
+    assert [name for name, _ in timer.phases] == ["import", "build_app"]
+    assert timer.phases[0][1] >= 0.01
+    assert report.startswith("Старт за ") and "import" in report and "build_app" in report
+
+
+def test_prewarm_runs_concurrently_and_skips_failures():
+    def slow():
+        time.sleep(0.2)
+
+    def broken():
+        raise ValueError("boom")
+
+    t0 = time.perf_counter()
+    took = asyncio.run(startup.prewarm([("a", slow), ("b", slow), ("bad", broken)]))
+    assert time.perf_counter() - t0 < 0.35
+    assert set(took) == {"a", "b"}
+
+
+def test_warmed_catalog_keyboards_are_reused():
+    assert bot_kb.warm_catalog_kbs() == len(list_catalog()["cars"])
+    assert bot_kb.warm_static_kbs() >= 3
+    cat = list_catalog()
+    kb = bot_kb.catalog_kb(cat, bot_kb.TIERS[-1])
+    assert bot_kb._CATALOG_KBS.markups[(bot_kb.TIERS[-1], 1)] is kb
+
+
+def test_importing_economy_does_not_touch_the_data_dir(tmp_path):
+    env = dict(os.environ, GAME_DATA_DIR=str(tmp_path / "data"))
+    subprocess.run([sys.executable, "-c", "import economy_v1"], cwd=ROOT, env=env, check=True)
+    assert not (tmp_path / "data" / "users").exists()
+
+
+def test_webhook_requires_public_url_unless_bot_api_is_local(monkeypatch):
+    import bot
+
+    monkeypatch.setattr(bot, "WEBHOOK_URL", None)
+    monkeypatch.setattr(bot, "BOT_API_URL", None)
+    with pytest.raises(RuntimeError):
+        bot._webhook_url()
+    monkeypatch.setattr(bot, "BOT_API_URL", "https://api.example.org/bot")
+    with pytest.raises(RuntimeError):
+        bot._webhook_url()
+    monkeypatch.setattr(bot, "BOT_API_URL", "http://127.0.0.1:8081/bot")
+    monkeypatch.setattr(bot, "WEBHOOK_LISTEN", "0.0.0.0")
+    assert bot._webhook_url() == f"http://127.0.0.1:{bot.WEBHOOK_PORT}/{bot.WEBHOOK_PATH}"
+    monkeypatch.setattr(bot, "WEBHOOK_URL", "https://bot.example.org/hook")
+    assert bot._webhook_url() == "https://bot.example.org/hook"
@@ -0,0 +1,91 @@
+import os, sys
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+import asyncio
+
+from telegram import Update
+
+from loadtest_webhook import make_update
+from single_flight import OperationInProgress, SingleFlight
+from update_processor import PerUserUpdateProcessor, release_turn, update_key
+
+
+def test_synthetic_updates_parse():
+    msg = Update.de_json(make_update(1, 77, "/garage"), None)
+    cb = Update.de_json(make_update(2, 77, data="nav:garage"), None)
+    assert msg.message.text == "/garage" and msg.effective_user.id == 77
+    assert cb.callback_query.data == "nav:garage"
+    assert update_key(msg) == update_key(cb) == "u77"
+
+
+def test_per_user_order_with_concurrency_limit():
+    proc = PerUserUpdateProcessor(concurrency=3, backlog=100)
+    log = []
+    running = {"now": 0, "max": 0}
+
+    async def handle(uid, n, delay):
+        running["now"] += 1
+        running["max"] = max(running["max"], running["now"])
+        await asyncio.sleep(delay)
+        log.append((uid, n))
+        running["now"] -= 1
+
+    async def main():
+        tasks = []
+        for n in range(5):
+            for uid in (1, 2, 3, 4):
+                upd = Update.de_json(make_update(n * 10 + uid, uid, "/help"), None)
+                # у первого пользователя первые обновления самые долгие
+                delay = 0.02 if uid == 1 and n < 2 else 0.001
+                tasks.append(asyncio.create_task(proc.process_update(upd, handle(uid, n, delay))))
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+    for uid in (1, 2, 3, 4):
+        assert [n for u, n in log if u == uid] == list(range(5))
+    assert running["max"] == 3
+    # остальные пользователи не ждали медленного первого
+    assert log.index((1, 1)) > log.index((2, 4))
+    assert proc.processed == 20 and proc.waiting_users == 0
+
+
+def test_released_turn_lets_the_users_next_update_run():
+    proc = PerUserUpdateProcessor(concurrency=1, backlog=100)
+    flights = SingleFlight(window_s=0)
+    log = []
+
+    async def main():
+        replay = asyncio.Event()
+
+        async def race():
+            log.append("simulated")
+            release_turn()
+            release_turn()
+            # повтор гонки идёт, а очередь пользователя и слот уже свободны
+            await replay.wait()
+            log.append("replayed")
+
+        async def race_cmd():
+            try:
+                await flights.run("1", "race", race, exclusive=True)
+            except OperationInProgress:
+                log.append("busy")
+
+        async def garage():
+            log.append("garage")
+
+        def upd(n, uid):
+            return Update.de_json(make_update(n, uid, "/race"), None)
+
+        first = asyncio.create_task(proc.process_update(upd(1, 1), race_cmd()))
+        await asyncio.sleep(0.01)
+        await proc.process_update(upd(2, 1), race_cmd())
+        await proc.process_update(upd(3, 1), garage())
+        await proc.process_update(upd(4, 2), garage())
+        assert not first.done()
+        replay.set()
+        await first
+
+    asyncio.run(main())
+    assert log == ["simulated", "busy", "garage", "garage", "replayed"]
+    assert proc.waiting_users == 0 and proc._slots._value == 1
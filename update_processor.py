@@ -0,0 +1,148 @@
+"""Concurrent update processing that keeps each user's updates in order.
+
+With ``concurrent_updates`` enabled, python-telegram-bot starts a task per
+update as soon as it arrives.  :class:`PerUserUpdateProcessor` runs up to
+``UPDATE_CONCURRENCY`` handlers at once, but updates of the same user (or of
+the same chat when there is no user) wait for the previous one to finish, so
+a purchase and the garage refresh that follows it never swap places.
+
+A user who is waiting does not hold one of the concurrency slots: the slot
+is taken only after the user's turn comes.  ``UPDATE_BACKLOG`` bounds how
+many updates may be in flight (waiting or running) in total.  Handler time
+per command or callback prefix and the wait before it are recorded in
+:mod:`metrics`.
+
+A handler whose tail only paces messages (a race replay) calls
+:func:`release_turn` once the state-changing part is done: the user's next
+update and the concurrency slot are released while the handler goes on.
+"""
+
+import asyncio
+import os
+import time
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+import metrics
+
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "64"))
+UPDATE_BACKLOG = int(os.getenv("UPDATE_BACKLOG", "4096"))
+
+# освобождение очереди пользователя для обработчика, который сейчас выполняется
+_TURN: ContextVar[Optional[Callable[[], None]]] = ContextVar("update_turn", default=None)
+
+
+def release_turn() -> None:
+    """Let the user's next update start while the current handler goes on.
+
+    Does nothing outside :class:`PerUserUpdateProcessor` or when called again.
+    """
+    release = _TURN.get()
+    if release is not None:
+        release()
+
+
+def update_key(update: object) -> Optional[str]:
+    """Ordering key of an update: the user, else the chat, else ``None``."""
+    if not isinstance(update, Update):
+        return None
+    if update.effective_user is not None:
+        return f"u{update.effective_user.id}"
+    if update.effective_chat is not None:
+        return f"c{update.effective_chat.id}"
+    return None
+
+
+def update_label(update: object) -> Tuple[str, str]:
+    """``(kind, name)`` for metrics: the command or the callback data prefix."""
+    if isinstance(update, Update):
+        if update.callback_query is not None:
+            return "callback", (update.callback_query.data or "").split(":", 1)[0]
+        msg = update.effective_message
+        text = msg.text if msg is not None else None
+        if text and text.startswith("/"):
+            return "command", text.split()[0][1:].split("@", 1)[0].lower()
+    return "other", ""
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, concurrency: int = UPDATE_CONCURRENCY, backlog: int = UPDATE_BACKLOG):
+        super().__init__(max(backlog, concurrency))
+        self.concurrency = max(1, concurrency)
+        self._slots: Optional[asyncio.Semaphore] = None
+        # ключ -> [замок, число ожидающих и выполняющихся обновлений]
+        self._queues: Dict[str, List[Any]] = {}
+        self.processed = 0
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def _slot(self) -> asyncio.Semaphore:
+        # семафор создаётся внутри работающего цикла событий
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.concurrency)
+        return self._slots
+
+    async def do_process_update(self, update: object, coroutine: "Awaitable[Any]") -> None:
+        key = update_key(update)
+        if key is None:
+            async with self._slot():
+                await self._run(update, coroutine, None)
+            return
+        arrived = time.perf_counter()
+        entry = self._queues.get(key)
+        if entry is None:
+            entry = self._queues[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        lock, slots = entry[0], self._slot()
+        released = False
+
+        def release() -> None:
+            nonlocal released
+            if not released:
+                released = True
+                slots.release()
+                lock.release()
+
+        try:
+            # asyncio.Lock пропускает ожидающих по очереди прихода
+            await lock.acquire()
+            try:
+                await slots.acquire()
+            except BaseException:
+                lock.release()
+                raise
+            token = _TURN.set(release)
+            try:
+                await self._run(update, coroutine, arrived)
+            finally:
+                _TURN.reset(token)
+                release()
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._queues[key]
+
+    async def _run(self, update: object, coroutine: "Awaitable[Any]", arrived: Optional[float]) -> None:
+        if not metrics.enabled():
+            await coroutine
+            self.processed += 1
+            return
+        started = time.perf_counter()
+        if arrived is not None:
+            metrics.UPDATE_WAIT_SECONDS.observe(started - arrived)
+        try:
+            await coroutine
+        finally:
+            self.processed += 1
+            metrics.UPDATE_SECONDS.observe(time.perf_counter() - started, *update_label(update))
+
+    @property
+    def waiting_users(self) -> int:
+        return len(self._queues)